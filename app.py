@@ -1,12 +1,17 @@
-from flask import Flask, render_template, jsonify, request, send_file
+from flask import Flask, render_template, jsonify, request, send_file, g, has_request_context, Response
 from flask_caching import Cache
 import psycopg2
+from psycopg2.extensions import quote_ident
 import json
 import csv
 from datetime import datetime, timedelta
 import os
 import re
+import itertools
+import heapq
+import uuid
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from odf import text, teletype
 from odf.opendocument import load, OpenDocumentText
@@ -15,106 +20,390 @@ import base64
 from PIL import Image
 import io
 from odt_editor import ODTEditor
-from geocoder import geocode_location
-import unicodedata
+from geocoder import geocode_locations
+from db_config import db_config
+from db_pool import ConnectionPool
+from overview_snapshot import read_snapshot, estimate_overview
+from count_cube import CountCube, average_day_of_year, stddev_day_of_year
+from dimension_cache import DimensionCache
+from response_cache import ResponseCache
+from cache_warmup import CacheWarmup, HOT_URLS
+from compression import Compressor
+from binary_formats import negotiate_format, binary_variant, binary_response
+from json_provider import Rows, RawJSON, fetch_rows, init_json, raw_json_response
+from data_version import DataVersionListener, bump as bump_data_version
+from materialized_views import load_definitions, read_freshness
+from migrate_dedupe_pheno_new import is_migrated as pheno_new_deduplicated
 import zipfile
 import tempfile
 from docx import Document as DocxDocument
 from docx.oxml.ns import qn
 
-# Load city to state mapping for pheno_new historical data
-CITY_STATE_MAPPING = {}
-mapping_file = os.path.join(os.path.dirname(__file__), 'static', 'city_to_state_mapping.json')
-if os.path.exists(mapping_file):
-    with open(mapping_file, 'r', encoding='utf-8') as f:
-        raw_mapping = json.load(f)
-        # Normalize keys to NFC form for consistent matching
-        CITY_STATE_MAPPING = {unicodedata.normalize('NFC', k): v for k, v in raw_mapping.items()}
-
 app = Flask(__name__)
 app.config['JSON_AS_ASCII'] = False
+# JSON 序列化：默认使用 orjson（未安装时退回 Flask 默认实现），JSON_PROVIDER=default 强制使用默认实现
+init_json(app, os.environ.get('JSON_PROVIDER', 'orjson'))
 
 # Configure caching
-app.config['CACHE_TYPE'] = 'SimpleCache'  # In-memory cache
+# 所有 gunicorn worker 共享的缓存后端：设置 CACHE_REDIS_URL 时使用 Redis，
+# 否则使用本机文件系统缓存（CACHE_DIR）
+if os.environ.get('CACHE_REDIS_URL'):
+    app.config['CACHE_TYPE'] = 'RedisCache'
+    app.config['CACHE_REDIS_URL'] = os.environ['CACHE_REDIS_URL']
+else:
+    app.config['CACHE_TYPE'] = os.environ.get('CACHE_TYPE', 'FileSystemCache')
+    app.config['CACHE_DIR'] = os.environ.get('CACHE_DIR', os.path.join(tempfile.gettempdir(), 'phenomapping-cache'))
+    app.config['CACHE_THRESHOLD'] = int(os.environ.get('CACHE_THRESHOLD', 5000))  # max entries
 app.config['CACHE_DEFAULT_TIMEOUT'] = 3600  # 1 hour default timeout
 cache = Cache(app)
 
-# 数据库配置
-DB_CONFIG = {
-    'host': 'localhost',
-    'database': 'pheno',
-    'user': 'postgres',
-    'password': '9417941',
-    'port': '5432'
-}
+# Parameter types of the read APIs, used to normalise cache keys
+YEAR_PARAMS = {'year_start': int, 'year_end': int}
+
+# 数据库配置（与导入、迁移脚本共用，见 db_config.py）
+DB_CONFIG = db_config('pheno')
 
 # pheno_new数据库配置
-DB_CONFIG_NEW = {
-    'host': 'localhost',
-    'database': 'pheno_new',
-    'user': 'postgres',
-    'password': '9417941',
-    'port': '5432'
+DB_CONFIG_NEW = db_config('pheno_new')
+
+# 连接池配置（每个 gunicorn worker 进程各自维护连接池）
+DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN', 1))
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', 10))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+
+db_pools = {
+    'pheno': ConnectionPool('pheno', DB_CONFIG, minconn=DB_POOL_MIN, maxconn=DB_POOL_MAX,
+                            timeout=DB_POOL_TIMEOUT),
+    'pheno_new': ConnectionPool('pheno_new', DB_CONFIG_NEW, minconn=DB_POOL_MIN, maxconn=DB_POOL_MAX,
+                                timeout=DB_POOL_TIMEOUT),
 }
 
-def get_db_connection():
-    """获取数据库连接"""
-    try:
-        conn = psycopg2.connect(**DB_CONFIG)
-        return conn
-    except Exception as e:
-        print(f"Database connection error: {e}")
-        return None
+def db_connection(source='pheno', optional=False):
+    """从连接池借出数据库连接，with 块结束时自动回滚并归还
 
-def get_db_connection_new():
-    """获取pheno_new数据库连接"""
-    try:
-        conn = psycopg2.connect(**DB_CONFIG_NEW)
-        return conn
-    except Exception as e:
-        print(f"Database connection error: {e}")
-        return None
+    With optional=True the context yields None when no connection can be
+    obtained, so callers can keep treating a database as optional.
+    """
+    return db_pools[source].connection(optional=optional)
+
+# 多数据源查询的并发线程池（data_source=both 时两个数据库并行查询）
+DATA_SOURCES = ('pheno', 'pheno_new')
+QUERY_WORKERS = int(os.environ.get('QUERY_WORKERS', 8))
+query_executor = ThreadPoolExecutor(max_workers=QUERY_WORKERS, thread_name_prefix='query')
+
+# 站点/物种/物候期维表缓存与站点 × 物种 × 物候期计数立方体
+# （每个 worker 进程内存中一份，数据变化后自动重新加载）
+DIMENSION_CHECK_INTERVAL = float(os.environ.get('DIMENSION_CHECK_INTERVAL', 30))
+COUNT_CUBE_CHECK_INTERVAL = float(os.environ.get('COUNT_CUBE_CHECK_INTERVAL', 30))
+dimension_caches = {
+    source: DimensionCache(source, pool.connection, check_interval=DIMENSION_CHECK_INTERVAL,
+                           species_groups=(source == 'pheno'))
+    for source, pool in db_pools.items()
+}
+count_cubes = {
+    source: CountCube(source, pool.connection, dimension_caches[source], check_interval=COUNT_CUBE_CHECK_INTERVAL)
+    for source, pool in db_pools.items()
+}
+
+# 数据版本：导入、物化视图刷新和标注写入会增加版本号并 NOTIFY，
+# 每个 worker 监听变化，响应缓存的键包含相关命名空间的版本号
+DATA_VERSION_POLL_INTERVAL = float(os.environ.get('DATA_VERSION_POLL_INTERVAL', 60))
+
+def on_data_version_change(source, namespaces):
+    """数据变化时让内存中的维表缓存和计数立方体立即重新检查"""
+    print(f"Data version changed ({source}): {', '.join(sorted(namespaces))}")
+    if namespaces & {'observations', 'aggregates'}:
+        dimension_caches[source].invalidate()
+        count_cubes[source].invalidate()
+
+data_versions = DataVersionListener({'pheno': DB_CONFIG, 'pheno_new': DB_CONFIG_NEW},
+                                    on_change=on_data_version_change,
+                                    poll_interval=DATA_VERSION_POLL_INTERVAL)
+
+# 响应压缩：按 Accept-Encoding 协商 zstd / br / gzip（br、zstd 需要可选的
+# brotli、zstandard 包），小于 COMPRESS_MIN_SIZE 字节的响应不压缩；
+# COMPRESS_CACHE=1 时压缩后的字节与缓存条目一起保存，命中时不再重复压缩
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+COMPRESS_CACHE = os.environ.get('COMPRESS_CACHE', '1') == '1'
+compressor = Compressor(min_size=COMPRESS_MIN_SIZE)
+compressor.init_app(app)
+
+# 过期或数据版本已更新的缓存条目在 CACHE_STALE_TTL 秒内继续返回（X-Cache: STALE），
+# 同时由后台线程重新计算（stale-while-revalidate），用户请求不再等待重新计算
+CACHE_STALE_TTL = int(os.environ.get('CACHE_STALE_TTL', 86400))
+
+response_cache = ResponseCache(cache, versions=data_versions, compressor=compressor,
+                               store_compressed=COMPRESS_CACHE, stale=CACHE_STALE_TTL)
+
+# 缓存命名空间（见 data_version.py）
+OBSERVATION_DATA = ('observations',)
+DERIVED_DATA = ('observations', 'aggregates')
+
+# 启动预热（见 cache_warmup.py）：每个 worker 启动时加载维表缓存和计数立方体，
+# 并请求常用接口填充共享缓存；CACHE_PREWARM=1 时先用 pg_prewarm 把物化视图和索引
+# 读入 PostgreSQL 缓冲区。预热期间到达的请求最多等待 CACHE_WARMUP_WAIT 秒
+CACHE_WARMUP = os.environ.get('CACHE_WARMUP', '1') == '1'
+CACHE_PREWARM = os.environ.get('CACHE_PREWARM', '0') == '1'
+CACHE_WARMUP_WAIT = float(os.environ.get('CACHE_WARMUP_WAIT', 30))
+CACHE_WARMUP_URLS = [url.strip() for url in os.environ.get('CACHE_WARMUP_URLS', '').split(',') if url.strip()]
+
+def load_in_memory_caches():
+    """加载本进程的维表缓存和计数立方体"""
+    for source in DATA_SOURCES:
+        dimension_caches[source].snapshot()
+        count_cubes[source].ensure_fresh()
+
+def check_pheno_new_schema():
+    """pheno_new 的查询不再去重（DISTINCT ON），依赖 migrate_dedupe_pheno_new.py：未执行时计数偏大，启动时警告"""
+    with db_pools['pheno_new'].connection(optional=True) as conn:
+        if conn and not pheno_new_deduplicated(conn.cursor()):
+            print("WARNING: pheno_new reference tables have no primary keys, observation counts are inflated; "
+                  "run python3 migrate_dedupe_pheno_new.py")
+
+cache_warmup = CacheWarmup(app, cache, versions=data_versions,
+                           loaders=[check_pheno_new_schema, load_in_memory_caches],
+                           connections={source: pool.connection for source, pool in db_pools.items()},
+                           urls=CACHE_WARMUP_URLS or HOT_URLS, prewarm=CACHE_PREWARM,
+                           wait_timeout=CACHE_WARMUP_WAIT, namespaces=DERIVED_DATA)
+
+@app.before_request
+def start_data_version_listener():
+    """在每个 worker 进程中启动一次数据版本监听线程和缓存预热，并等待预热完成"""
+    data_versions.start()
+    if CACHE_WARMUP:
+        cache_warmup.start()
+        cache_warmup.wait()
+
+# 服务端游标每批读取的行数 / 非流式观测数据接口的最大返回行数
+STREAM_BATCH_SIZE = int(os.environ.get('STREAM_BATCH_SIZE', 2000))
+MAX_OBSERVATION_LIMIT = int(os.environ.get('MAX_OBSERVATION_LIMIT', 50000))
+
+# /api/trends 单次请求最多返回的序列数（物种 × 物候期 × 站点）
+MAX_TREND_SERIES = int(os.environ.get('MAX_TREND_SERIES', 200))
 
 def dict_fetchall(cursor):
     """将查询结果转换为字典列表"""
     columns = [col[0] for col in cursor.description]
     return [dict(zip(columns, row)) for row in cursor.fetchall()]
 
+def request_list(name):
+    """多值查询参数：?x=1&x=2 或 ?x=1,2（去重，保持顺序）"""
+    values = []
+    for value in request.args.getlist(name):
+        values.extend(part.strip() for part in value.split(',') if part.strip())
+    return list(dict.fromkeys(values))
+
+def sources_for(data_source):
+    """data_source 参数 ('pheno' / 'pheno_new' / 'both') 对应的数据库列表"""
+    return [source for source in DATA_SOURCES if data_source in (source, 'both')]
+
+def fan_out(data_source, run):
+    """Run `run(source)` for every database selected by data_source.
+
+    With more than one source the calls are dispatched concurrently on the
+    bounded query executor, so a 'both' request costs the slower of the two
+    databases instead of their sum. Returns {source: result} in DATA_SOURCES
+    order. A failing source is reported in the X-Data-Source-Errors response
+    header and left out of the result; only when every source fails is the
+    first error raised.
+    """
+    sources = sources_for(data_source)
+    if len(sources) <= 1:
+        return {source: run(source) for source in sources}
+
+    futures = {source: query_executor.submit(run, source) for source in sources}
+    results = {}
+    errors = {}
+    for source, future in futures.items():
+        try:
+            results[source] = future.result()
+        except Exception as e:
+            print(f"Query error ({source}): {e}")
+            errors[source] = e
+
+    if errors:
+        if not results:
+            raise next(iter(errors.values()))
+        if has_request_context():
+            g.setdefault('source_errors', {}).update({source: str(e) for source, e in errors.items()})
+    return results
+
+@app.after_request
+def add_source_errors_header(response):
+    """把部分数据源失败的信息写入响应头（响应体保持原有结构）"""
+    source_errors = g.get('source_errors')
+    if source_errors:
+        response.headers['X-Data-Source-Errors'] = json.dumps(source_errors)
+    return response
+
+def run_query(source, query, params=()):
+    """Run one query on a pooled connection of `source` and return the rows as dicts"""
+    with db_connection(source) as conn:
+        cur = conn.cursor()
+        cur.execute(query, params)
+        rows = dict_fetchall(cur)
+        cur.close()
+    return rows
+
+# 数据库端 JSON 组装：纯投影的响应直接由 PostgreSQL 生成 JSON 文档（string_agg），
+# Python 只转发字节。DB_JSON=0 时回到逐行读取 + jsonify
+DB_JSON = os.environ.get('DB_JSON', '1') == '1'
+
+# 与 jsonify 保持一致：numeric 按 Decimal 输出为字符串，日期输出为 HTTP 日期
+JSON_AS_TEXT_TYPES = {1700}  # numeric
+JSON_HTTP_DATE_TYPES = {
+    1082: "to_char({0}, 'Dy, DD Mon YYYY \"00:00:00 GMT\"')",                  # date
+    1114: "to_char({0}, 'Dy, DD Mon YYYY HH24:MI:SS \"GMT\"')",                 # timestamp
+    1184: "to_char({0} AT TIME ZONE 'UTC', 'Dy, DD Mon YYYY HH24:MI:SS \"GMT\"')",  # timestamptz
+}
+
+# Row number column added around the query (not part of the output)
+JSON_ROW_ORDINAL = 'json_row_ordinal__'
+
+def json_array(cursor, query, params=()):
+    """Rows of `query` as one JSON array built by PostgreSQL (RawJSON)
+
+    The document matches what jsonify(dict_fetchall(...)) writes for the same
+    query: compact, keys sorted, numeric and date columns converted like
+    Flask's JSON provider. Objects are concatenated from to_json() of each
+    value (json_agg would add whitespace). Rows are numbered in the order the
+    query returns them and aggregated with string_agg(... ORDER BY) on that
+    number, so they keep the query's ORDER BY. Float columns may be written
+    differently (1e+20 vs 1e20); the schema has none.
+    """
+    cursor.execute(f"SELECT * FROM ({query}) t LIMIT 0", params)
+    parts = []
+    for i, col in enumerate(sorted(cursor.description, key=lambda col: col.name)):
+        value = 't.' + quote_ident(col.name, cursor)
+        if col.type_code in JSON_AS_TEXT_TYPES:
+            value += '::text'
+        elif col.type_code in JSON_HTTP_DATE_TYPES:
+            value = JSON_HTTP_DATE_TYPES[col.type_code].format(value)
+        prefix = ('{' if i == 0 else ',') + json.dumps(col.name) + ':'
+        parts.append(cursor.mogrify('%s', (prefix,)).decode() + f" || COALESCE(to_json({value})::text, 'null')")
+    row_json = ' || '.join(parts) + " || '}'" if parts else "'{}'"
+    cursor.execute(f"""
+        SELECT '[' || COALESCE(string_agg({row_json}, ',' ORDER BY t.{JSON_ROW_ORDINAL}), '') || ']'
+        FROM (SELECT row_number() OVER () as {JSON_ROW_ORDINAL}, q.* FROM ({query}) q) t
+    """, params)
+    return RawJSON(cursor.fetchone()[0].encode())
+
+def fetch_projection(cursor, query, params=()):
+    """Rows of a pure projection: RawJSON built by PostgreSQL with DB_JSON, otherwise Rows"""
+    if DB_JSON:
+        return json_array(cursor, query, params)
+    cursor.execute(query, params)
+    return fetch_rows(cursor)
+
+def fetch_optional_projection(cursor, query, params=(), default=None):
+    """fetch_projection of a query on views or tables that may not be created yet; `default` if missing"""
+    try:
+        return fetch_projection(cursor, query, params)
+    except psycopg2.errors.UndefinedTable:
+        cursor.connection.rollback()
+        return default
+
+def json_array_query(source, query, params=()):
+    """json_array on a pooled connection of `source`"""
+    with db_connection(source) as conn:
+        cursor = conn.cursor()
+        document = json_array(cursor, query, params)
+        cursor.close()
+    return document
+
+def count_by_dimension(source, name, columns, **extra):
+    """Observation count per station/species/phase, joined with the cached dimension rows
+
+    Only dwd_observation is queried; rows without a dimension entry are dropped
+    like with an INNER JOIN. Ordered by observation_count descending.
+    """
+    key_column = f"{name}_id"
+    counts = run_query(source, f"""
+        SELECT {key_column} as id, COUNT(*) as observation_count
+        FROM dwd_observation
+        GROUP BY {key_column}
+    """)
+    snapshot = dimension_caches[source].snapshot()
+    rows = []
+    for count in counts:
+        info = snapshot.get(name, count['id'])
+        if info is not None:
+            rows.append({**{column: info[column] for column in columns}, **extra,
+                         'observation_count': count['observation_count']})
+    rows.sort(key=lambda row: row['observation_count'], reverse=True)
+    return rows
+
+# 观测数据行的维表字段：(维表, 外键列, 追加的列)
+OBSERVATION_DIMENSIONS = (
+    ('station', 'station_id', ('station_name', 'latitude', 'longitude')),
+    ('species', 'species_id', ('species_name_en', 'species_name_de')),
+    ('phase', 'phase_id', ('phase_name_en', 'phase_name_de')),
+)
+
+# Keeps the rows of the INNER JOINs the observation query used to make: observations
+# without a station/species/phase row are left out, the names come from the cache
+OBSERVATION_DIMENSION_FILTER = ' AND '.join(
+    f"EXISTS (SELECT 1 FROM dwd_{name} d WHERE d.id = o.{key_column})"
+    for name, key_column, _columns in OBSERVATION_DIMENSIONS
+)
+
+def decorate_observation(snapshot, row):
+    """Add station/species/phase names from the dimension cache to an observation row"""
+    for name, key_column, columns in OBSERVATION_DIMENSIONS:
+        info = snapshot.get(name, row[key_column])
+        for column in columns:
+            row[column] = info[column] if info else None
+    return row
+
+# /api/observations 查询返回的列（顺序与 SELECT 相同）
+OBSERVATION_COLUMNS = ['id', 'station_id', 'reference_year', 'species_id', 'phase_id', 'date', 'day_of_year']
+DECORATED_OBSERVATION_COLUMNS = OBSERVATION_COLUMNS + [
+    column for _name, _key_column, columns in OBSERVATION_DIMENSIONS for column in columns
+]
+
+# Arrow 列类型与字典编码的列（二进制格式，见 binary_formats.py）
+OBSERVATION_ARROW_TYPES = {
+    'id': 'string', 'station_id': 'string', 'reference_year': 'int16', 'species_id': 'string',
+    'phase_id': 'string', 'date': 'string', 'day_of_year': 'int16', 'latitude': 'double', 'longitude': 'double',
+    'station_name': 'string', 'species_name_en': 'string', 'species_name_de': 'string',
+    'phase_name_en': 'string', 'phase_name_de': 'string',
+}
+OBSERVATION_DICTIONARY_COLUMNS = ('station_name', 'species_name_en', 'species_name_de',
+                                  'phase_name_en', 'phase_name_de')
+
+def decorate_observation_batch(snapshot, rows):
+    """Tuple version of decorate_observation for a batch of OBSERVATION_COLUMNS rows"""
+    lookups = [(name, OBSERVATION_COLUMNS.index(key_column), columns)
+               for name, key_column, columns in OBSERVATION_DIMENSIONS]
+    decorated = []
+    for row in rows:
+        values = []
+        for name, position, columns in lookups:
+            info = snapshot.get(name, row[position])
+            values.extend(info[column] if info else None for column in columns)
+        decorated.append(row + tuple(values))
+    return decorated
+
+def wants_binary():
+    """True when the Accept header asks for Arrow or MessagePack"""
+    return negotiate_format() != 'json'
+
 def query_by_data_source(data_source, query_pheno, params_pheno, query_new=None, params_new=None):
     """Run a query against pheno, pheno_new, or both databases and return combined results.
     For pheno_new, if query_new is not provided, query_pheno is used.
+    Both databases are queried concurrently (see fan_out).
     """
-    results = []
-    if data_source in ('pheno', 'both'):
-        conn = get_db_connection()
-        if conn:
-            try:
-                cur = conn.cursor()
-                cur.execute(query_pheno, params_pheno)
-                results.extend(dict_fetchall(cur))
-                cur.close()
-                conn.close()
-            except Exception as e:
-                if conn:
-                    conn.close()
-                raise e
-
-    if data_source in ('pheno_new', 'both'):
-        conn_new = get_db_connection_new()
-        if conn_new:
-            try:
-                cur = conn_new.cursor()
-                q = query_new if query_new else query_pheno
-                p = params_new if params_new is not None else params_pheno
-                cur.execute(q, p)
-                results.extend(dict_fetchall(cur))
-                cur.close()
-                conn_new.close()
-            except Exception as e:
-                if conn_new:
-                    conn_new.close()
-                raise e
+    def run(source):
+        if source == 'pheno_new':
+            q = query_new if query_new else query_pheno
+            p = params_new if params_new is not None else params_pheno
+        else:
+            q, p = query_pheno, params_pheno
+        return run_query(source, q, p)
 
+    results = []
+    for rows in fan_out(data_source, run).values():
+        results.extend(rows)
     return results
 
 @app.route('/')
@@ -159,77 +448,36 @@ def distribution():
 
 # API 端点
 @app.route('/api/overview')
+@response_cache.cached(timeout=86400, depends=DERIVED_DATA)
 def api_overview():
-    """数据概览API"""
-    conn = get_db_connection()
-    if not conn:
-        return jsonify({'error': 'Database connection failed'}), 500
-    
-    try:
-        cursor = conn.cursor()
-        
-        # 获取基本统计
-        stats = {}
-        
-        # 总观测数
-        cursor.execute("SELECT COUNT(*) FROM dwd_observation")
-        stats['total_observations'] = cursor.fetchone()[0]
-        
-        # 站点数
-        cursor.execute("SELECT COUNT(*) FROM dwd_station")
-        stats['total_stations'] = cursor.fetchone()[0]
-        
-        # 物种数
-        cursor.execute("SELECT COUNT(*) FROM dwd_species")
-        stats['total_species'] = cursor.fetchone()[0]
-        
-        # 物候期数
-        cursor.execute("SELECT COUNT(*) FROM dwd_phase")
-        stats['total_phases'] = cursor.fetchone()[0]
-        
-        # 时间范围
-        cursor.execute("SELECT MIN(reference_year), MAX(reference_year) FROM dwd_observation")
-        year_range = cursor.fetchone()
-        pheno_min, pheno_max = year_range[0], year_range[1]
-
-        # 查询 pheno_new 时间范围
-        archive_min, archive_max = None, None
-        conn_new = get_db_connection_new()
-        if conn_new:
-            try:
-                cur_new = conn_new.cursor()
-                cur_new.execute("SELECT MIN(reference_year), MAX(reference_year) FROM dwd_observation")
-                new_range = cur_new.fetchone()
-                if new_range and new_range[0]:
-                    archive_min, archive_max = new_range[0], new_range[1]
-                cur_new.close()
-                conn_new.close()
-            except:
-                if conn_new:
-                    conn_new.close()
-
-        stats['pheno_basic_range'] = f"{pheno_min}-{pheno_max}"
-        if archive_min:
-            stats['pheno_archive_range'] = f"{archive_min}-{archive_max}"
-        else:
-            stats['pheno_archive_range'] = None
+    """数据概览API - 读取预计算的统计快照 (overview_snapshot.py)
 
-        # 最新观测
-        cursor.execute("""
-            SELECT COUNT(*) FROM dwd_observation
-            WHERE reference_year = (SELECT MAX(reference_year) FROM dwd_observation)
-        """)
-        stats['latest_year_observations'] = cursor.fetchone()[0]
+    ?estimated=1 returns planner-statistics estimates instead, for instant
+    first paint. Without a snapshot the estimates are served as well (flagged
+    `estimated`); the import scripts or `python3 overview_snapshot.py` create it.
+    """
+    with db_connection(optional=True) as conn:
+        if not conn:
+            return jsonify({'error': 'Database connection failed'}), 500
 
-        cursor.close()
-        conn.close()
-        
-        return jsonify(stats)
-        
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        try:
+            # 还没有快照（例如新导入的数据库）时返回估算值，不在读请求里全表计数
+            snapshot = None if request.args.get('estimated') == '1' else read_snapshot(conn)
+            if snapshot is None:
+                with db_connection('pheno_new', optional=True) as conn_new:
+                    stats = estimate_overview(conn, conn_new)
+                stats['estimated'] = True
+                return jsonify(stats)
+
+            stats, refreshed_at = snapshot
+            stats['snapshot_refreshed_at'] = refreshed_at.isoformat()
+            return jsonify(stats)
+
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
 
 @app.route('/api/stations')
+@response_cache.cached(timeout=86400, depends=DERIVED_DATA)
 def api_stations():
     """站点数据API - 支持 data_source 参数"""
     data_source = request.args.get('data_source', 'pheno')
@@ -243,18 +491,17 @@ def api_stations():
             FROM mv_station_stats
             ORDER BY observation_count DESC
         """
-        query_new = """
-            SELECT
-                s.id, s.station_name, s.latitude, s.longitude,
-                s.altitude, s.state, s.area_group, s.area,
-                COUNT(o.id) as observation_count
-            FROM (SELECT DISTINCT ON (id) * FROM dwd_station ORDER BY id) s
-            JOIN dwd_observation o ON s.id = o.station_id
-            GROUP BY s.id, s.station_name, s.latitude, s.longitude,
-                     s.altitude, s.state, s.area_group, s.area
-            ORDER BY observation_count DESC
-        """
-        stations = query_by_data_source(data_source, query_pheno, [], query_new, [])
+        station_columns = ['id', 'station_name', 'latitude', 'longitude', 'altitude', 'state', 'area_group', 'area']
+
+        if DB_JSON and data_source == 'pheno':
+            return raw_json_response(app, json_array_query('pheno', query_pheno))
+
+        def fetch_stations(source):
+            if source == 'pheno':
+                return run_query(source, query_pheno)
+            return count_by_dimension(source, 'station', station_columns)
+
+        stations = [row for rows in fan_out(data_source, fetch_stations).values() for row in rows]
 
         # Deduplicate by station_name when combining both sources
         if data_source == 'both':
@@ -273,6 +520,7 @@ def api_stations():
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/species')
+@response_cache.cached(timeout=86400, depends=DERIVED_DATA)
 def api_species():
     """物种数据API - 支持 data_source 参数"""
     data_source = request.args.get('data_source', 'pheno')
@@ -287,17 +535,17 @@ def api_species():
             LEFT JOIN dwd_species_group sg ON s.id = sg.species_id
             ORDER BY observation_count DESC
         """
-        query_new = """
-            SELECT
-                s.id, s.species_name_de, s.species_name_en, s.species_name_la,
-                NULL as group_name,
-                COUNT(o.id) as observation_count
-            FROM (SELECT DISTINCT ON (id) * FROM dwd_species ORDER BY id) s
-            JOIN dwd_observation o ON s.id = o.species_id
-            GROUP BY s.id, s.species_name_de, s.species_name_en, s.species_name_la
-            ORDER BY observation_count DESC
-        """
-        species = query_by_data_source(data_source, query_pheno, [], query_new, [])
+        species_columns = ['id', 'species_name_de', 'species_name_en', 'species_name_la']
+
+        if DB_JSON and data_source == 'pheno':
+            return raw_json_response(app, json_array_query('pheno', query_pheno))
+
+        def fetch_species(source):
+            if source == 'pheno':
+                return run_query(source, query_pheno)
+            return count_by_dimension(source, 'species', species_columns, group_name=None)
+
+        species = [row for rows in fan_out(data_source, fetch_species).values() for row in rows]
 
         if data_source == 'both':
             seen = {}
@@ -315,6 +563,7 @@ def api_species():
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/phases')
+@response_cache.cached(timeout=86400, depends=DERIVED_DATA)
 def api_phases():
     """物候期数据API - 支持 data_source 参数"""
     data_source = request.args.get('data_source', 'pheno')
@@ -327,16 +576,17 @@ def api_phases():
             FROM mv_phase_stats
             ORDER BY observation_count DESC
         """
-        query_new = """
-            SELECT
-                p.id, p.phase_name_de, p.phase_name_en,
-                COUNT(o.id) as observation_count
-            FROM (SELECT DISTINCT ON (id) * FROM dwd_phase ORDER BY id) p
-            JOIN dwd_observation o ON p.id = o.phase_id
-            GROUP BY p.id, p.phase_name_de, p.phase_name_en
-            ORDER BY observation_count DESC
-        """
-        phases = query_by_data_source(data_source, query_pheno, [], query_new, [])
+        phase_columns = ['id', 'phase_name_de', 'phase_name_en']
+
+        if DB_JSON and data_source == 'pheno':
+            return raw_json_response(app, json_array_query('pheno', query_pheno))
+
+        def fetch_phases(source):
+            if source == 'pheno':
+                return run_query(source, query_pheno)
+            return count_by_dimension(source, 'phase', phase_columns)
+
+        phases = [row for rows in fan_out(data_source, fetch_phases).values() for row in rows]
 
         if data_source == 'both':
             seen = {}
@@ -354,20 +604,45 @@ def api_phases():
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/observations')
+@response_cache.cached(timeout=3600, max_bytes=8 * 1024 * 1024,
+                       types={**YEAR_PARAMS, 'limit': int}, defaults={'format': 'json'}, depends=OBSERVATION_DATA,
+                       unless=lambda: (request.args.get('format') == 'ndjson' or request.args.get('stream') == '1'
+                                       or wants_binary()),
+                       vary=('Accept',))
 def api_observations():
-    """观测数据API（支持筛选）- supports pheno, pheno_new, or both data sources"""
+    """观测数据API（支持筛选）- supports pheno, pheno_new, or both data sources
+
+    Accept: application/vnd.apache.arrow.stream or application/msgpack streams
+    the rows in that format (see binary_formats.py), like format=ndjson.
+    """
     data_source = request.args.get('data_source', 'pheno')
 
     # 获取筛选参数
     station_id = request.args.get('station_id')
     species_id = request.args.get('species_id')
     phase_id = request.args.get('phase_id')
-    year_start = request.args.get('year_start')
-    year_end = request.args.get('year_end')
-    limit = int(request.args.get('limit', 1000))
+    year_start = request.args.get('year_start', type=int)
+    year_end = request.args.get('year_end', type=int)
+    # format=ndjson streams newline-delimited JSON, stream=1 streams the usual
+    # JSON array in chunks; both read through server-side cursors and accept
+    # an unbounded limit. Buffered responses are capped at MAX_OBSERVATION_LIMIT.
+    output_format = request.args.get('format', 'json')
+    binary_format = negotiate_format()
+    stream = output_format == 'ndjson' or request.args.get('stream') == '1' or binary_format != 'json'
+    limit = request.args.get('limit', type=int)
+    if not stream:
+        limit = min(limit or 1000, MAX_OBSERVATION_LIMIT)
+
+    # Keyset pagination: cursor is the opaque token from the X-Next-Cursor
+    # header of the previous page
+    cursor_token = request.args.get('cursor')
+    try:
+        after = decode_page_cursor(cursor_token) if cursor_token else None
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
 
-    def build_obs_query(deduplicate_refs=False):
-        where_conditions = []
+    def build_obs_query(source):
+        where_conditions = [OBSERVATION_DIMENSION_FILTER]
         params = []
 
         if station_id:
@@ -386,108 +661,365 @@ def api_observations():
             where_conditions.append("o.reference_year <= %s")
             params.append(year_end)
 
-        where_clause = "WHERE " + " AND ".join(where_conditions) if where_conditions else ""
+        if after:
+            condition, condition_params = keyset_condition(after, DATA_SOURCES.index(source))
+            where_conditions.append(condition)
+            params.extend(condition_params)
 
-        # pheno_new has duplicate rows in species/phase/station tables,
-        # so use DISTINCT ON subqueries to avoid row multiplication
-        if deduplicate_refs:
-            query = f"""
-                SELECT
-                    o.id, o.station_id, o.reference_year, o.species_id,
-                    o.phase_id, o.date, o.day_of_year,
-                    st.station_name, st.latitude, st.longitude,
-                    sp.species_name_en, sp.species_name_de,
-                    ph.phase_name_en, ph.phase_name_de
-                FROM dwd_observation o
-                JOIN (SELECT DISTINCT ON (id) id, station_name, latitude, longitude FROM dwd_station ORDER BY id) st ON o.station_id = st.id
-                JOIN (SELECT DISTINCT ON (id) id, species_name_en, species_name_de FROM dwd_species ORDER BY id) sp ON o.species_id = sp.id
-                JOIN (SELECT DISTINCT ON (id) id, phase_name_en, phase_name_de FROM dwd_phase ORDER BY id) ph ON o.phase_id = ph.id
-                {where_clause}
-                ORDER BY o.reference_year DESC, o.day_of_year
-                LIMIT %s
-            """
-        else:
-            query = f"""
-                SELECT
-                    o.id, o.station_id, o.reference_year, o.species_id,
-                    o.phase_id, o.date, o.day_of_year,
-                    st.station_name, st.latitude, st.longitude,
-                    sp.species_name_en, sp.species_name_de,
-                    ph.phase_name_en, ph.phase_name_de
-                FROM dwd_observation o
-                JOIN dwd_station st ON o.station_id = st.id
-                JOIN dwd_species sp ON o.species_id = sp.id
-                JOIN dwd_phase ph ON o.phase_id = ph.id
-                {where_clause}
-                ORDER BY o.reference_year DESC, o.day_of_year
-                LIMIT %s
-            """
-        params.append(limit)
-        return query, params
+        where_clause = "WHERE " + " AND ".join(where_conditions)
 
-    all_observations = []
+        # Names come from the dimension cache (decorate_observation), the
+        # dimension tables are only probed for existence
+        query = f"""
+            SELECT
+                o.id, o.station_id, o.reference_year, o.species_id,
+                o.phase_id, TO_CHAR(o.date, 'YYYY-MM-DD') as date, o.day_of_year
+            FROM dwd_observation o
+            {where_clause}
+            ORDER BY {KEYSET_YEAR} DESC, o.day_of_year, o.id
+        """
+        if limit:
+            query += " LIMIT %s"
+            params.append(limit)
+        return query, params
 
-    if data_source in ('pheno', 'both'):
-        conn = get_db_connection()
-        if not conn:
-            return jsonify({'error': 'Database connection failed'}), 500
+    if stream:
         try:
+            snapshots = {source: dimension_caches[source].snapshot() for source in sources_for(data_source)}
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+        if binary_format != 'json':
+            return binary_observations(binary_format, [(source, *build_obs_query(source)) for source in snapshots],
+                                       limit, snapshots)
+        return stream_observations(
+            [(source, *build_obs_query(source)) for source in snapshots],
+            limit, ndjson=(output_format == 'ndjson'),
+            decorate=lambda source, row: decorate_observation(snapshots[source], row)
+        )
+
+    def fetch_observations(source):
+        snapshot = dimension_caches[source].snapshot()
+        query, params = build_obs_query(source)
+        with db_connection(source) as conn:
             cursor = conn.cursor()
-            query, params = build_obs_query()
             cursor.execute(query, params)
-            all_observations.extend(dict_fetchall(cursor))
+            rows = cursor.fetchall()
             cursor.close()
-            conn.close()
-        except Exception as e:
-            return jsonify({'error': str(e)}), 500
+        return decorate_observation_batch(snapshot, rows)
 
-    if data_source in ('pheno_new', 'both'):
-        conn_new = get_db_connection_new()
-        if not conn_new:
-            return jsonify({'error': 'Pheno_new database connection failed'}), 500
+    try:
+        results = fan_out(data_source, fetch_observations)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+    # Every source is already ordered by the keyset, merge instead of re-sorting
+    page = list(itertools.islice(
+        merge_observation_tuples([(DATA_SOURCES.index(source), rows) for source, rows in results.items()]),
+        limit
+    ))
+
+    response = jsonify(Rows(DECORATED_OBSERVATION_COLUMNS, [row for _source_index, row in page]))
+    if len(page) == limit:
+        source_index, row = page[-1]
+        response.headers['X-Next-Cursor'] = encode_page_cursor(source_index,
+                                                                dict(zip(DECORATED_OBSERVATION_COLUMNS, row)))
+    return response
+
+# reference_year DESC NULLS LAST as an expression idx_observation_keyset can seek on: rows
+# without a year sort below every year (migrate_typed_columns.py only keeps years >= -9999)
+NULL_YEAR = -32768
+KEYSET_YEAR = f"COALESCE(o.reference_year, {NULL_YEAR})"
+
+class _Descending:
+    """Sort key wrapper that reverses the ordering of the wrapped value"""
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+def observation_sort_key(source_index, row):
+    """Python equivalent of ORDER BY reference_year DESC, day_of_year (both NULLS LAST), source, id"""
+    year, day_of_year = row['reference_year'], row['day_of_year']
+    return (year is None, _Descending(year), day_of_year is None, day_of_year, source_index, row['id'])
+
+def merge_observation_streams(streams):
+    """k-way merge of per-source observation streams that are each ordered by the keyset
+
+    Args:
+        streams: Iterable of (source_index, iterable of row dicts)
+
+    Yields:
+        (source_index, row) in global keyset order, reading lazily from every stream
+    """
+    def tag(source_index, rows):
+        for row in rows:
+            yield source_index, row
+
+    tagged = [tag(source_index, rows) for source_index, rows in streams]
+    return heapq.merge(*tagged, key=lambda item: observation_sort_key(*item))
+
+def encode_page_cursor(source_index, row):
+    """Opaque pagination token for the position right after `row`"""
+    position = [row['reference_year'], row['day_of_year'], source_index, row['id']]
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode().rstrip('=')
+
+def decode_page_cursor(token):
+    """Inverse of encode_page_cursor, raises ValueError for malformed tokens"""
+    try:
+        position = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except Exception:
+        raise ValueError('Invalid cursor')
+    if not isinstance(position, list) or len(position) != 4:
+        raise ValueError('Invalid cursor')
+    return position
+
+def keyset_condition(after, source_index):
+    """WHERE clause selecting the rows of one source that sort after the cursor position
+
+    The order is (reference_year DESC NULLS LAST, day_of_year ASC NULLS LAST,
+    source, id), so within the cursor's (year, day) group a source listed
+    before the cursor's source has nothing left, a later source starts at its
+    first row and the cursor's own source continues after the cursor id. Rows
+    without a year come after every year (KEYSET_YEAR). The leading year bound
+    lets idx_observation_keyset seek to the position.
+    """
+    year, day_of_year, after_source, after_id = after
+    if source_index < after_source:
+        same_position, same_params = "FALSE", []
+    elif source_index > after_source:
+        same_position, same_params = "TRUE", []
+    else:
+        same_position, same_params = "o.id > %s", [after_id]
+
+    if day_of_year is None:
+        same_year = f"(o.day_of_year IS NULL AND {same_position})"
+        same_year_params = same_params
+    else:
+        same_year = (f"(o.day_of_year > %s OR o.day_of_year IS NULL"
+                     f" OR (o.day_of_year = %s AND {same_position}))")
+        same_year_params = [day_of_year, day_of_year] + same_params
+
+    year = NULL_YEAR if year is None else year
+    condition = f"{KEYSET_YEAR} <= %s AND ({KEYSET_YEAR} < %s OR {same_year})"
+    return condition, [year, year] + same_year_params
+
+def iter_server_side(source, query, params, batch_size=None):
+    """Iterate over query results through a named (server-side) cursor.
+
+    Rows are fetched from PostgreSQL in batches of `batch_size` (itersize), so
+    memory use does not depend on the size of the result. The pooled
+    connection is held until the iterator is exhausted or closed.
+    """
+    with db_connection(source) as conn:
+        cursor = conn.cursor(name=f"stream_{uuid.uuid4().hex}")
+        cursor.itersize = batch_size or STREAM_BATCH_SIZE
+        cursor.execute(query, params)
+        columns = None
+        for row in cursor:
+            if columns is None:
+                columns = [col[0] for col in cursor.description]
+            yield dict(zip(columns, row))
+        cursor.close()
+
+def stream_observations(queries, limit=None, ndjson=True, decorate=None):
+    """Stream observation rows of one or more sources as NDJSON or a chunked JSON array
+
+    Args:
+        queries: List of (source, query, params)
+        limit: Maximum number of rows over all sources (None for no limit)
+        ndjson: Newline-delimited JSON when True, otherwise one JSON array
+        decorate: Optional callable (source, row) -> row applied to every row
+    """
+    sources = [iter_server_side(source, query, params) for source, query, params in queries]
+
+    def source_stream(source, source_rows):
+        if decorate:
+            source_rows = (decorate(source, row) for row in source_rows)
+        return DATA_SOURCES.index(source), source_rows
+
+    rows = (row for _source_index, row in merge_observation_streams(
+        source_stream(source, source_rows) for (source, _query, _params), source_rows in zip(queries, sources)
+    ))
+    if limit:
+        rows = itertools.islice(rows, limit)
+
+    def generate():
+        batch = []
+        first = True
+        if not ndjson:
+            yield '['
         try:
-            cursor_new = conn_new.cursor()
-            query, params = build_obs_query(deduplicate_refs=True)
-            cursor_new.execute(query, params)
-            all_observations.extend(dict_fetchall(cursor_new))
-            cursor_new.close()
-            conn_new.close()
+            for row in rows:
+                encoded = app.json.dumps(row, separators=(',', ':'))
+                if ndjson:
+                    batch.append(encoded + '\n')
+                else:
+                    batch.append(encoded if first else ',' + encoded)
+                first = False
+                if len(batch) >= STREAM_BATCH_SIZE:
+                    yield ''.join(batch)
+                    batch = []
         except Exception as e:
-            return jsonify({'error': str(e)}), 500
+            # Headers are already sent, report the failure in-band: a final
+            # {"error": ...} line, or element closing the array so it stays valid JSON
+            print(f"Streaming error: {e}")
+            error = app.json.dumps({'error': str(e)}, separators=(',', ':'))
+            if ndjson:
+                batch.append(error + '\n')
+            else:
+                batch.append(error + ']' if first else ',' + error + ']')
+            yield ''.join(batch)
+            return
+        finally:
+            # Return the pooled connections even if the client went away
+            for source_rows in sources:
+                source_rows.close()
+        if not ndjson:
+            batch.append(']')
+        yield ''.join(batch)
+
+    mimetype = 'application/x-ndjson' if ndjson else 'application/json'
+    return Response(generate(), mimetype=mimetype)
+
+def iter_server_side_batches(source, query, params, batch_size=None):
+    """Like iter_server_side, but yields lists of row tuples (one cursor.fetchmany each)"""
+    with db_connection(source) as conn:
+        cursor = conn.cursor(name=f"stream_{uuid.uuid4().hex}")
+        cursor.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(batch_size or STREAM_BATCH_SIZE)
+            if not rows:
+                break
+            yield rows
+        cursor.close()
+
+def merge_observation_tuples(streams):
+    """Tuple version of merge_observation_streams for OBSERVATION_COLUMNS rows
 
-    # Sort combined results and limit
-    all_observations.sort(key=lambda x: (x.get('reference_year', ''), x.get('day_of_year', '')), reverse=True)
-    all_observations = all_observations[:limit]
+    Args:
+        streams: List of (source_index, iterable of row tuples), each in keyset order
 
-    return jsonify(all_observations)
+    Yields:
+        (source_index, row) in global keyset order
+    """
+    year, day, row_id = (OBSERVATION_COLUMNS.index(column) for column in ('reference_year', 'day_of_year', 'id'))
+
+    def tag(source_index, rows):
+        for row in rows:
+            yield source_index, row
+
+    if len(streams) == 1:
+        return tag(*streams[0])
+    return heapq.merge(
+        *(tag(source_index, rows) for source_index, rows in streams),
+        key=lambda item: (item[1][year] is None, _Descending(item[1][year]),
+                          item[1][day] is None, item[1][day], item[0], item[1][row_id])
+    )
+
+def merge_observation_batches(streams, limit=None):
+    """k-way merge of per-source batches of OBSERVATION_COLUMNS tuples, re-batched
+
+    Args:
+        streams: List of (source_index, iterable of row tuple lists), each in keyset order
+        limit: Maximum number of rows over all sources
+    """
+    rows = (row for _source_index, row in merge_observation_tuples(
+        [(source_index, (row for rows in batches for row in rows)) for source_index, batches in streams]
+    ))
+    if limit:
+        rows = itertools.islice(rows, limit)
+    while True:
+        batch = list(itertools.islice(rows, STREAM_BATCH_SIZE))
+        if not batch:
+            return
+        yield batch
+
+def binary_observations(binary_format, queries, limit, snapshots):
+    """Stream observation rows of one or more sources as Arrow IPC or MessagePack
+
+    Rows stay tuples from cursor.fetchmany to the encoder; names are added per
+    batch from the dimension cache snapshots.
+    """
+    sources = [(source, iter_server_side_batches(source, query, params)) for source, query, params in queries]
+
+    def decorated(source, batches):
+        for rows in batches:
+            yield decorate_observation_batch(snapshots[source], rows)
+
+    def close():
+        # Return the pooled connections even if the client went away
+        for _source, batches in sources:
+            batches.close()
+
+    batches = merge_observation_batches(
+        [(DATA_SOURCES.index(source), decorated(source, batches)) for source, batches in sources], limit
+    )
+    return binary_response(binary_format, DECORATED_OBSERVATION_COLUMNS, batches, types=OBSERVATION_ARROW_TYPES,
+                           dictionary=OBSERVATION_DICTIONARY_COLUMNS, on_close=close)
 
 @app.route('/api/trends')
+@response_cache.cached(timeout=86400, types=YEAR_PARAMS, lists=('species_id', 'phase_id', 'station_id'),
+                       depends=DERIVED_DATA, variant=binary_variant, vary=('Accept',))
 def api_trends():
-    """趋势分析API - supports pheno, pheno_new, or both data sources"""
+    """趋势分析API - supports pheno, pheno_new, or both data sources
+
+    species_id, phase_id and station_id accept several values (?species_id=1&species_id=2
+    or ?species_id=1,2). With a single value of each the response is the usual
+    list of yearly points; otherwise every species × phase (× station)
+    combination is returned from one grouped query per source as
+    {"series": {"<species>:<phase>[:<station>]": {..., "trends": [...]}}}.
+    Arrow / MessagePack (Accept header) return all series as one flat table.
+    """
     data_source = request.args.get('data_source', 'pheno')
-    species_id = request.args.get('species_id')
-    phase_id = request.args.get('phase_id')
-    station_id = request.args.get('station_id')
-    year_start = request.args.get('year_start')
-    year_end = request.args.get('year_end')
+    species_ids = request_list('species_id')
+    phase_ids = request_list('phase_id')
+    station_ids = request_list('station_id')
+    year_start = request.args.get('year_start', type=int)
+    year_end = request.args.get('year_end', type=int)
 
-    if not species_id or not phase_id:
+    if not species_ids or not phase_ids:
         return jsonify({'error': 'species_id and phase_id are required'}), 400
 
-    def build_trends_query(params_list):
-        query = """
-            SELECT
-                reference_year,
-                AVG(CAST(day_of_year AS INTEGER)) as avg_day_of_year,
-                COUNT(*) as observation_count
-            FROM dwd_observation
-            WHERE species_id = %s AND phase_id = %s
-        """
-        params_list.extend([species_id, phase_id])
+    series_keys = list(itertools.product(species_ids, phase_ids, station_ids or [None]))
+    if len(series_keys) > MAX_TREND_SERIES:
+        return jsonify({'error': f'Too many series requested (maximum {MAX_TREND_SERIES})'}), 400
+    multi_series = len(series_keys) > 1
 
-        if station_id:
-            query += " AND station_id = %s"
-            params_list.append(station_id)
+    key_columns = ['species_id', 'phase_id'] + (['station_id'] if station_ids else [])
+
+    def build_trends_query(params_list, from_cube=True):
+        # 优先读取预聚合立方体 (create_trend_cube.sql)：按站点筛选时读站点级立方体，
+        # 否则读全国汇总；两者每个序列每年只有一行，不需要 GROUP BY
+        keys = ", ".join(key_columns)
+        if from_cube:
+            query = f"""
+                SELECT {keys}, reference_year, doy_sum, doy_sum_sq, doy_count, observation_count
+                FROM {'mv_trend_cube' if station_ids else 'mv_trend_national'}
+                WHERE species_id IN %s AND phase_id IN %s
+            """
+        else:
+            query = f"""
+                SELECT
+                    {keys},
+                    reference_year,
+                    SUM(day_of_year) as doy_sum,
+                    SUM(day_of_year::bigint * day_of_year) as doy_sum_sq,
+                    COUNT(day_of_year) as doy_count,
+                    COUNT(*) as observation_count
+                FROM dwd_observation
+                WHERE species_id IN %s AND phase_id IN %s
+            """
+        params_list.extend([tuple(species_ids), tuple(phase_ids)])
+
+        if station_ids:
+            query += " AND station_id IN %s"
+            params_list.append(tuple(station_ids))
         if year_start:
             query += " AND reference_year >= %s"
             params_list.append(year_start)
@@ -495,114 +1027,155 @@ def api_trends():
             query += " AND reference_year <= %s"
             params_list.append(year_end)
 
-        query += """
-            GROUP BY reference_year
-            ORDER BY reference_year
-        """
+        if not from_cube:
+            query += f" GROUP BY {keys}, reference_year"
+        query += f" ORDER BY {keys}, reference_year"
         return query
 
-    all_trends = []
-
-    if data_source in ('pheno', 'both'):
-        conn = get_db_connection()
-        if not conn:
-            return jsonify({'error': 'Database connection failed'}), 500
-        try:
+    def fetch_trends(source):
+        with db_connection(source) as conn:
             cursor = conn.cursor()
             params = []
-            query = build_trends_query(params)
-            cursor.execute(query, params)
-            all_trends.extend(dict_fetchall(cursor))
+            try:
+                cursor.execute(build_trends_query(params), params)
+            except psycopg2.errors.UndefinedTable:
+                # 立方体尚未创建：退回到原始表聚合
+                conn.rollback()
+                params = []
+                cursor.execute(build_trends_query(params, from_cube=False), params)
+            rows = dict_fetchall(cursor)
             cursor.close()
-            conn.close()
-        except Exception as e:
-            return jsonify({'error': str(e)}), 500
+        return rows
 
-    if data_source in ('pheno_new', 'both'):
-        conn_new = get_db_connection_new()
-        if not conn_new:
-            return jsonify({'error': 'Pheno_new database connection failed'}), 500
-        try:
-            cursor_new = conn_new.cursor()
-            params = []
-            query = build_trends_query(params)
-            cursor_new.execute(query, params)
-            all_trends.extend(dict_fetchall(cursor_new))
-            cursor_new.close()
-            conn_new.close()
-        except Exception as e:
-            return jsonify({'error': str(e)}), 500
+    try:
+        results = fan_out(data_source, fetch_trends)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
-    # If both sources, aggregate by reference_year
-    if data_source == 'both' and all_trends:
-        aggregated = {}
-        for row in all_trends:
-            yr = row['reference_year']
-            if yr not in aggregated:
-                aggregated[yr] = {'reference_year': yr, 'total_day': 0, 'total_count': 0}
-            aggregated[yr]['total_day'] += float(row['avg_day_of_year']) * int(row['observation_count'])
-            aggregated[yr]['total_count'] += int(row['observation_count'])
-        all_trends = [
-            {
-                'reference_year': v['reference_year'],
-                'avg_day_of_year': v['total_day'] / v['total_count'] if v['total_count'] > 0 else 0,
-                'observation_count': v['total_count']
+    # Sums and counts merge exactly across sources, averages are derived afterwards
+    totals = {key: {} for key in series_keys}
+    for rows in results.values():
+        for row in rows:
+            key = (str(row['species_id']), str(row['phase_id']),
+                   str(row['station_id']) if station_ids else None)
+            series = totals.get(key)
+            if series is not None:
+                accumulate_trend(series.setdefault(row['reference_year'], [0, 0, 0, 0]), row)
+
+    def series_points(key):
+        return [trend_point(year, total) for year, total in sorted(totals[key].items())]
+
+    binary_format = negotiate_format()
+    if binary_format != 'json':
+        rows = [key[:len(key_columns)] + trend_values(year, total, numeric=False)
+                for key in series_keys for year, total in sorted(totals[key].items())]
+        return binary_response(binary_format, key_columns + TREND_COLUMNS, [rows], types=TREND_ARROW_TYPES,
+                               buffered=True)
+
+    if not multi_series:
+        return jsonify(series_points(series_keys[0]))
+
+    return jsonify({
+        'series': {
+            ':'.join(part for part in key if part is not None): {
+                'species_id': key[0],
+                'phase_id': key[1],
+                'station_id': key[2],
+                'trends': series_points(key)
             }
-            for v in sorted(aggregated.values(), key=lambda x: x['reference_year'])
-        ]
-
-    return jsonify(all_trends)
+            for key in series_keys
+        }
+    })
+
+def accumulate_trend(total, row):
+    """Add one aggregate row (doy_sum, doy_sum_sq, doy_count, observation_count) to a running total"""
+    total[0] += int(row['doy_sum'] or 0)
+    total[1] += int(row['doy_sum_sq'] or 0)
+    total[2] += int(row['doy_count'] or 0)
+    total[3] += int(row['observation_count'] or 0)
+
+TREND_COLUMNS = ['reference_year', 'avg_day_of_year', 'stddev_day_of_year', 'observation_count']
+TREND_ARROW_TYPES = {'species_id': 'string', 'phase_id': 'string', 'station_id': 'string',
+                     'reference_year': 'int16', 'avg_day_of_year': 'double', 'stddev_day_of_year': 'double',
+                     'observation_count': 'int64'}
+
+def trend_values(year, total, numeric=True):
+    """Turn summed day_of_year statistics into the TREND_COLUMNS values of one year
+
+    numeric: Average and standard deviation as PostgreSQL numeric (Decimal, a
+             string in JSON) like the AVG the endpoint used to return; floats for
+             the binary formats
+    """
+    doy_sum, doy_sum_sq, doy_count, observation_count = total
+    avg_day = average_day_of_year(doy_sum, doy_count)
+    stddev_day = stddev_day_of_year(doy_sum, doy_sum_sq, doy_count)
+    if not numeric:
+        avg_day = None if avg_day is None else float(avg_day)
+        stddev_day = None if stddev_day is None else float(stddev_day)
+    return (year, avg_day, stddev_day, observation_count)
+
+def trend_point(year, total):
+    """One point of a trend series"""
+    return dict(zip(TREND_COLUMNS, trend_values(year, total)))
 
 @app.route('/api/quality')
+@response_cache.cached(timeout=86400, depends=OBSERVATION_DATA)
 def api_quality():
     """数据质量统计API"""
-    conn = get_db_connection()
-    if not conn:
-        return jsonify({'error': 'Database connection failed'}), 500
-    
-    try:
-        cursor = conn.cursor()
-        
-        # 质量等级分布
-        cursor.execute("""
-            SELECT 
-                ql.id, ql.description,
-                COUNT(o.id) as count
-            FROM dwd_quality_level ql
-            LEFT JOIN dwd_observation o ON ql.id = o.quality_level_id
-            GROUP BY ql.id, ql.description
-            ORDER BY count DESC
-        """)
-        
-        quality_levels = dict_fetchall(cursor)
-        
-        # 按年份的质量分布
-        cursor.execute("""
-            SELECT 
-                o.reference_year,
-                ql.description,
-                COUNT(o.id) as count
-            FROM dwd_observation o
-            JOIN dwd_quality_level ql ON o.quality_level_id = ql.id
-            WHERE o.reference_year >= '1925' AND o.reference_year <= '2020'
-            GROUP BY o.reference_year, ql.description
-            ORDER BY o.reference_year, ql.description
-        """)
-        
-        quality_by_year = dict_fetchall(cursor)
-        
-        cursor.close()
-        conn.close()
-        
-        return jsonify({
-            'quality_levels': quality_levels,
-            'quality_by_year': quality_by_year
-        })
-        
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    with db_connection(optional=True) as conn:
+        if not conn:
+            return jsonify({'error': 'Database connection failed'}), 500
+
+        try:
+            cursor = conn.cursor()
+
+            # 质量等级分布
+            cursor.execute("""
+                SELECT
+                    ql.id, ql.description,
+                    COUNT(o.id) as count
+                FROM dwd_quality_level ql
+                LEFT JOIN dwd_observation o ON ql.id = o.quality_level_id
+                GROUP BY ql.id, ql.description
+                ORDER BY count DESC
+            """)
+
+            quality_levels = fetch_rows(cursor)
+
+            # 按年份的质量分布
+            cursor.execute("""
+                SELECT
+                    o.reference_year,
+                    ql.description,
+                    COUNT(o.id) as count
+                FROM dwd_observation o
+                JOIN dwd_quality_level ql ON o.quality_level_id = ql.id
+                WHERE o.reference_year BETWEEN 1925 AND 2020
+                GROUP BY o.reference_year, ql.description
+                ORDER BY o.reference_year, ql.description
+            """)
+
+            quality_by_year = fetch_rows(cursor)
+
+            cursor.close()
+
+            return jsonify({
+                'quality_levels': quality_levels,
+                'quality_by_year': quality_by_year
+            })
+
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+
+def cube_rows(data_source, view):
+    """Run `view(cube)` on the count cube of every selected database and concatenate the rows"""
+    results = []
+    for rows in fan_out(data_source, lambda source: view(count_cubes[source])).values():
+        results.extend(rows)
+    return results
 
 @app.route('/api/species-by-phase')
+@response_cache.cached(timeout=86400, depends=DERIVED_DATA)
 def api_species_by_phase():
     """根据phase搜索species API - 支持 data_source"""
     data_source = request.args.get('data_source', 'pheno')
@@ -611,80 +1184,23 @@ def api_species_by_phase():
         return jsonify({'error': 'phase_id is required'}), 400
 
     try:
-        query_pheno = """
-            SELECT DISTINCT
-                s.id, s.species_name_de, s.species_name_en, s.species_name_la,
-                sg.group_name,
-                COUNT(DISTINCT o.id) as observation_count,
-                COUNT(DISTINCT o.station_id) as station_count,
-                MIN(o.reference_year) as first_year,
-                MAX(o.reference_year) as last_year
-            FROM dwd_observation o
-            JOIN dwd_species s ON o.species_id = s.id
-            LEFT JOIN dwd_species_group sg ON s.id = sg.species_id
-            WHERE o.phase_id = %s
-            GROUP BY s.id, s.species_name_de, s.species_name_en, s.species_name_la, sg.group_name
-            ORDER BY observation_count DESC
-        """
-        query_new = """
-            SELECT DISTINCT
-                s.id, s.species_name_de, s.species_name_en, s.species_name_la,
-                NULL as group_name,
-                COUNT(DISTINCT o.id) as observation_count,
-                COUNT(DISTINCT o.station_id) as station_count,
-                MIN(o.reference_year) as first_year,
-                MAX(o.reference_year) as last_year
-            FROM dwd_observation o
-            JOIN (SELECT DISTINCT ON (id) * FROM dwd_species ORDER BY id) s ON o.species_id = s.id
-            WHERE o.phase_id = %s
-            GROUP BY s.id, s.species_name_de, s.species_name_en, s.species_name_la
-            ORDER BY observation_count DESC
-        """
-        return jsonify(query_by_data_source(data_source, query_pheno, [phase_id], query_new, [phase_id]))
+        return jsonify(cube_rows(data_source, lambda cube: cube.species_by_phase(phase_id)))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/species-phases/<species_id>')
+@response_cache.cached(timeout=86400, depends=DERIVED_DATA)
 def api_species_phases(species_id):
     """获取特定species的所有phases - 支持 data_source"""
     data_source = request.args.get('data_source', 'pheno')
 
     try:
-        query_pheno = """
-            SELECT DISTINCT
-                p.id as phase_id,
-                p.phase_name_de,
-                p.phase_name_en,
-                COUNT(o.id) as observation_count,
-                MIN(o.reference_year) as first_year,
-                MAX(o.reference_year) as last_year,
-                AVG(CAST(o.day_of_year AS INTEGER)) as avg_day_of_year
-            FROM dwd_observation o
-            JOIN dwd_phase p ON o.phase_id = p.id
-            WHERE o.species_id = %s
-            GROUP BY p.id, p.phase_name_de, p.phase_name_en
-            ORDER BY observation_count DESC
-        """
-        query_new = """
-            SELECT DISTINCT
-                p.id as phase_id,
-                p.phase_name_de,
-                p.phase_name_en,
-                COUNT(o.id) as observation_count,
-                MIN(o.reference_year) as first_year,
-                MAX(o.reference_year) as last_year,
-                AVG(CAST(o.day_of_year AS INTEGER)) as avg_day_of_year
-            FROM dwd_observation o
-            JOIN (SELECT DISTINCT ON (id) * FROM dwd_phase ORDER BY id) p ON o.phase_id = p.id
-            WHERE o.species_id = %s
-            GROUP BY p.id, p.phase_name_de, p.phase_name_en
-            ORDER BY observation_count DESC
-        """
-        return jsonify(query_by_data_source(data_source, query_pheno, [species_id], query_new, [species_id]))
+        return jsonify(cube_rows(data_source, lambda cube: cube.species_phases(species_id)))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/station-species')
+@response_cache.cached(timeout=86400, depends=DERIVED_DATA)
 def api_station_species():
     """获取指定站点的所有物种 - 支持 data_source"""
     data_source = request.args.get('data_source', 'pheno')
@@ -693,31 +1209,12 @@ def api_station_species():
         return jsonify({'error': 'station_id is required'}), 400
 
     try:
-        query_pheno = """
-            SELECT DISTINCT
-                s.id, s.species_name_de, s.species_name_en, s.species_name_la,
-                COUNT(o.id) as observation_count
-            FROM dwd_observation o
-            JOIN dwd_species s ON o.species_id = s.id
-            WHERE o.station_id = %s
-            GROUP BY s.id, s.species_name_de, s.species_name_en, s.species_name_la
-            ORDER BY observation_count DESC
-        """
-        query_new = """
-            SELECT DISTINCT
-                s.id, s.species_name_de, s.species_name_en, s.species_name_la,
-                COUNT(o.id) as observation_count
-            FROM dwd_observation o
-            JOIN (SELECT DISTINCT ON (id) * FROM dwd_species ORDER BY id) s ON o.species_id = s.id
-            WHERE o.station_id = %s
-            GROUP BY s.id, s.species_name_de, s.species_name_en, s.species_name_la
-            ORDER BY observation_count DESC
-        """
-        return jsonify(query_by_data_source(data_source, query_pheno, [station_id], query_new, [station_id]))
+        return jsonify(cube_rows(data_source, lambda cube: cube.station_species(station_id)))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/station-phases')
+@response_cache.cached(timeout=86400, depends=DERIVED_DATA)
 def api_station_phases():
     """获取指定站点的所有物候期 - 支持 data_source"""
     data_source = request.args.get('data_source', 'pheno')
@@ -726,31 +1223,12 @@ def api_station_phases():
         return jsonify({'error': 'station_id is required'}), 400
 
     try:
-        query_pheno = """
-            SELECT DISTINCT
-                p.id, p.phase_name_de, p.phase_name_en,
-                COUNT(o.id) as observation_count
-            FROM dwd_observation o
-            JOIN dwd_phase p ON o.phase_id = p.id
-            WHERE o.station_id = %s
-            GROUP BY p.id, p.phase_name_de, p.phase_name_en
-            ORDER BY observation_count DESC
-        """
-        query_new = """
-            SELECT DISTINCT
-                p.id, p.phase_name_de, p.phase_name_en,
-                COUNT(o.id) as observation_count
-            FROM dwd_observation o
-            JOIN (SELECT DISTINCT ON (id) * FROM dwd_phase ORDER BY id) p ON o.phase_id = p.id
-            WHERE o.station_id = %s
-            GROUP BY p.id, p.phase_name_de, p.phase_name_en
-            ORDER BY observation_count DESC
-        """
-        return jsonify(query_by_data_source(data_source, query_pheno, [station_id], query_new, [station_id]))
+        return jsonify(cube_rows(data_source, lambda cube: cube.station_phases(station_id)))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/station-species-phases')
+@response_cache.cached(timeout=86400, depends=DERIVED_DATA)
 def api_station_species_phases():
     """获取指定站点和物种的所有物候期 - 支持 data_source"""
     data_source = request.args.get('data_source', 'pheno')
@@ -760,32 +1238,13 @@ def api_station_species_phases():
         return jsonify({'error': 'station_id and species_id are required'}), 400
 
     try:
-        query_pheno = """
-            SELECT DISTINCT
-                p.id as phase_id, p.phase_name_de, p.phase_name_en,
-                COUNT(o.id) as observation_count
-            FROM dwd_observation o
-            JOIN dwd_phase p ON o.phase_id = p.id
-            WHERE o.station_id = %s AND o.species_id = %s
-            GROUP BY p.id, p.phase_name_de, p.phase_name_en
-            ORDER BY observation_count DESC
-        """
-        query_new = """
-            SELECT DISTINCT
-                p.id as phase_id, p.phase_name_de, p.phase_name_en,
-                COUNT(o.id) as observation_count
-            FROM dwd_observation o
-            JOIN (SELECT DISTINCT ON (id) * FROM dwd_phase ORDER BY id) p ON o.phase_id = p.id
-            WHERE o.station_id = %s AND o.species_id = %s
-            GROUP BY p.id, p.phase_name_de, p.phase_name_en
-            ORDER BY observation_count DESC
-        """
-        params = [station_id, species_id]
-        return jsonify(query_by_data_source(data_source, query_pheno, params, query_new, list(params)))
+        return jsonify(cube_rows(data_source, lambda cube: cube.station_phases(
+            station_id, species_id=species_id, rename_id='phase_id')))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/station-phase-species')
+@response_cache.cached(timeout=86400, depends=DERIVED_DATA)
 def api_station_phase_species():
     """获取指定站点和物候期的所有物种 - 支持 data_source"""
     data_source = request.args.get('data_source', 'pheno')
@@ -795,32 +1254,12 @@ def api_station_phase_species():
         return jsonify({'error': 'station_id and phase_id are required'}), 400
 
     try:
-        query_pheno = """
-            SELECT DISTINCT
-                s.id, s.species_name_de, s.species_name_en, s.species_name_la,
-                COUNT(o.id) as observation_count
-            FROM dwd_observation o
-            JOIN dwd_species s ON o.species_id = s.id
-            WHERE o.station_id = %s AND o.phase_id = %s
-            GROUP BY s.id, s.species_name_de, s.species_name_en, s.species_name_la
-            ORDER BY observation_count DESC
-        """
-        query_new = """
-            SELECT DISTINCT
-                s.id, s.species_name_de, s.species_name_en, s.species_name_la,
-                COUNT(o.id) as observation_count
-            FROM dwd_observation o
-            JOIN (SELECT DISTINCT ON (id) * FROM dwd_species ORDER BY id) s ON o.species_id = s.id
-            WHERE o.station_id = %s AND o.phase_id = %s
-            GROUP BY s.id, s.species_name_de, s.species_name_en, s.species_name_la
-            ORDER BY observation_count DESC
-        """
-        params = [station_id, phase_id]
-        return jsonify(query_by_data_source(data_source, query_pheno, params, query_new, list(params)))
+        return jsonify(cube_rows(data_source, lambda cube: cube.station_species(station_id, phase_id=phase_id)))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/species-stations')
+@response_cache.cached(timeout=86400, depends=DERIVED_DATA)
 def api_species_stations():
     """获取有指定物种观测数据的所有站点 - 支持 data_source"""
     data_source = request.args.get('data_source', 'pheno')
@@ -830,34 +1269,12 @@ def api_species_stations():
         return jsonify({'error': 'species_id is required'}), 400
 
     try:
-        where_extra = " AND o.phase_id = %s" if phase_id else ""
-        params = [species_id, phase_id] if phase_id else [species_id]
-
-        query_pheno = f"""
-            SELECT DISTINCT
-                st.id, st.station_name, st.state, st.latitude, st.longitude,
-                COUNT(o.id) as observation_count
-            FROM dwd_observation o
-            JOIN dwd_station st ON o.station_id = st.id
-            WHERE o.species_id = %s{where_extra}
-            GROUP BY st.id, st.station_name, st.state, st.latitude, st.longitude
-            ORDER BY observation_count DESC
-        """
-        query_new = f"""
-            SELECT DISTINCT
-                st.id, st.station_name, st.state, st.latitude, st.longitude,
-                COUNT(o.id) as observation_count
-            FROM dwd_observation o
-            JOIN (SELECT DISTINCT ON (id) * FROM dwd_station ORDER BY id) st ON o.station_id = st.id
-            WHERE o.species_id = %s{where_extra}
-            GROUP BY st.id, st.station_name, st.state, st.latitude, st.longitude
-            ORDER BY observation_count DESC
-        """
-        return jsonify(query_by_data_source(data_source, query_pheno, params, query_new, list(params)))
+        return jsonify(cube_rows(data_source, lambda cube: cube.stations(species_id=species_id, phase_id=phase_id)))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/phase-stations')
+@response_cache.cached(timeout=86400, depends=DERIVED_DATA)
 def api_phase_stations():
     """获取有指定物候期观测数据的所有站点 - 支持 data_source"""
     data_source = request.args.get('data_source', 'pheno')
@@ -867,34 +1284,12 @@ def api_phase_stations():
         return jsonify({'error': 'phase_id is required'}), 400
 
     try:
-        where_extra = " AND o.species_id = %s" if species_id else ""
-        params = [phase_id, species_id] if species_id else [phase_id]
-
-        query_pheno = f"""
-            SELECT DISTINCT
-                st.id, st.station_name, st.state, st.latitude, st.longitude,
-                COUNT(o.id) as observation_count
-            FROM dwd_observation o
-            JOIN dwd_station st ON o.station_id = st.id
-            WHERE o.phase_id = %s{where_extra}
-            GROUP BY st.id, st.station_name, st.state, st.latitude, st.longitude
-            ORDER BY observation_count DESC
-        """
-        query_new = f"""
-            SELECT DISTINCT
-                st.id, st.station_name, st.state, st.latitude, st.longitude,
-                COUNT(o.id) as observation_count
-            FROM dwd_observation o
-            JOIN (SELECT DISTINCT ON (id) * FROM dwd_station ORDER BY id) st ON o.station_id = st.id
-            WHERE o.phase_id = %s{where_extra}
-            GROUP BY st.id, st.station_name, st.state, st.latitude, st.longitude
-            ORDER BY observation_count DESC
-        """
-        return jsonify(query_by_data_source(data_source, query_pheno, params, query_new, list(params)))
+        return jsonify(cube_rows(data_source, lambda cube: cube.stations(species_id=species_id, phase_id=phase_id)))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/species-phase-stations')
+@response_cache.cached(timeout=86400, depends=DERIVED_DATA)
 def api_species_phase_stations():
     """获取有指定物种和物候期观测数据的所有站点 - 支持 data_source"""
     data_source = request.args.get('data_source', 'pheno')
@@ -904,440 +1299,383 @@ def api_species_phase_stations():
         return jsonify({'error': 'species_id and phase_id are required'}), 400
 
     try:
-        query_pheno = """
-            SELECT DISTINCT
-                st.id, st.station_name, st.state, st.latitude, st.longitude,
-                COUNT(o.id) as observation_count
-            FROM dwd_observation o
-            JOIN dwd_station st ON o.station_id = st.id
-            WHERE o.species_id = %s AND o.phase_id = %s
-            GROUP BY st.id, st.station_name, st.state, st.latitude, st.longitude
-            ORDER BY observation_count DESC
-        """
-        query_new = """
-            SELECT DISTINCT
-                st.id, st.station_name, st.state, st.latitude, st.longitude,
-                COUNT(o.id) as observation_count
-            FROM dwd_observation o
-            JOIN (SELECT DISTINCT ON (id) * FROM dwd_station ORDER BY id) st ON o.station_id = st.id
-            WHERE o.species_id = %s AND o.phase_id = %s
-            GROUP BY st.id, st.station_name, st.state, st.latitude, st.longitude
-            ORDER BY observation_count DESC
-        """
-        params = [species_id, phase_id]
-        return jsonify(query_by_data_source(data_source, query_pheno, params, query_new, list(params)))
+        return jsonify(cube_rows(data_source, lambda cube: cube.stations(species_id=species_id, phase_id=phase_id)))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/pheno-new/species')
+@response_cache.cached(timeout=86400, depends=OBSERVATION_DATA)
 def api_pheno_new_species():
     """获取pheno_new数据库中的物种数据，并标记在pheno数据库中是否存在"""
-    conn_new = get_db_connection_new()
-    conn = get_db_connection()
-    if not conn_new or not conn:
-        return jsonify({'error': 'Database connection failed'}), 500
-    
-    try:
-        cursor_new = conn_new.cursor()
-        cursor = conn.cursor()
-        
-        # 获取pheno_new中的所有物种及其观测地点
-        cursor_new.execute("""
-            SELECT 
-                s.id as species_id,
-                s.species_name_en,
-                s.species_name_la,
-                s.species_name_de,
-                COUNT(DISTINCT o.id) as observation_count,
-                STRING_AGG(DISTINCT st.station_name, ', ' ORDER BY st.station_name) as locations
-            FROM dwd_species s
-            LEFT JOIN dwd_observation o ON s.id = o.species_id
-            LEFT JOIN dwd_station st ON o.station_id = st.id
-            GROUP BY s.id, s.species_name_en, s.species_name_la, s.species_name_de
-            ORDER BY COUNT(DISTINCT o.id) DESC
-        """)
-        
-        new_species = dict_fetchall(cursor_new)
-        
-        # 获取pheno数据库中的所有物种名称
-        cursor.execute("""
-            SELECT DISTINCT species_name_de FROM dwd_species
-            UNION
-            SELECT DISTINCT species_name_en FROM dwd_species
-            UNION 
-            SELECT DISTINCT species_name_la FROM dwd_species
-        """)
-        
-        existing_species_names = set(row[0] for row in cursor.fetchall() if row[0])
-        
-        # 标记每个物种是否在pheno数据库中存在
-        for species in new_species:
-            # 检查任何一个名称是否在pheno数据库中存在
-            species['exists_in_pheno'] = (
-                species['species_name_en'] in existing_species_names or
-                species['species_name_la'] in existing_species_names or
-                species['species_name_de'] in existing_species_names
-            )
-            # 选择一个非空的名称作为显示名称
-            species['species_name'] = (
-                species['species_name_en'] or 
-                species['species_name_la'] or 
-                species['species_name_de'] or 
-                'Unknown'
-            )
-            # 标准化locations显示 - 将N/A改为Unknown
-            if not species['locations'] or species['locations'] == 'N/A':
-                species['locations'] = 'Unknown'
-        
-        cursor_new.close()
-        cursor.close()
-        conn_new.close()
-        conn.close()
-        
-        return jsonify(new_species)
-        
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    with db_connection('pheno_new', optional=True) as conn_new, db_connection(optional=True) as conn:
+        if not conn_new or not conn:
+            return jsonify({'error': 'Database connection failed'}), 500
+
+        try:
+            cursor_new = conn_new.cursor()
+            cursor = conn.cursor()
+
+            # 获取pheno_new中的所有物种及其观测地点
+            cursor_new.execute("""
+                SELECT
+                    s.id as species_id,
+                    s.species_name_en,
+                    s.species_name_la,
+                    s.species_name_de,
+                    COUNT(o.id) as observation_count,
+                    STRING_AGG(DISTINCT st.station_name, ', ' ORDER BY st.station_name) as locations
+                FROM dwd_species s
+                LEFT JOIN dwd_observation o ON s.id = o.species_id
+                LEFT JOIN dwd_station st ON o.station_id = st.id
+                GROUP BY s.id, s.species_name_en, s.species_name_la, s.species_name_de
+                ORDER BY COUNT(o.id) DESC
+            """)
+
+            new_species = dict_fetchall(cursor_new)
+
+            # 获取pheno数据库中的所有物种名称
+            cursor.execute("""
+                SELECT DISTINCT species_name_de FROM dwd_species
+                UNION
+                SELECT DISTINCT species_name_en FROM dwd_species
+                UNION
+                SELECT DISTINCT species_name_la FROM dwd_species
+            """)
+
+            existing_species_names = set(row[0] for row in cursor.fetchall() if row[0])
+
+            # 标记每个物种是否在pheno数据库中存在
+            for species in new_species:
+                # 检查任何一个名称是否在pheno数据库中存在
+                species['exists_in_pheno'] = (
+                    species['species_name_en'] in existing_species_names or
+                    species['species_name_la'] in existing_species_names or
+                    species['species_name_de'] in existing_species_names
+                )
+                # 选择一个非空的名称作为显示名称
+                species['species_name'] = (
+                    species['species_name_en'] or
+                    species['species_name_la'] or
+                    species['species_name_de'] or
+                    'Unknown'
+                )
+                # 标准化locations显示 - 将N/A改为Unknown
+                if not species['locations'] or species['locations'] == 'N/A':
+                    species['locations'] = 'Unknown'
+
+            cursor_new.close()
+            cursor.close()
+
+            return jsonify(new_species)
+
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
 
 @app.route('/api/pheno-new/species-phases/<species_name>')
+@response_cache.cached(timeout=86400, max_bytes=8 * 1024 * 1024, types=YEAR_PARAMS, depends=OBSERVATION_DATA)
 def api_pheno_new_species_phases(species_name):
     """获取pheno_new中特定物种的物候期数据，并与pheno数据库中的数据对比"""
-    conn_new = get_db_connection_new()
-    conn = get_db_connection()
-    if not conn_new or not conn:
-        return jsonify({'error': 'Database connection failed'}), 500
+    with db_connection('pheno_new', optional=True) as conn_new, db_connection(optional=True) as conn:
+        if not conn_new or not conn:
+            return jsonify({'error': 'Database connection failed'}), 500
 
-    # Optional year range params for granularity control
-    req_year_start = request.args.get('year_start', type=int)
-    req_year_end = request.args.get('year_end', type=int)
+        # Optional year range params for granularity control
+        req_year_start = request.args.get('year_start', type=int)
+        req_year_end = request.args.get('year_end', type=int)
 
-    try:
-        cursor_new = conn_new.cursor()
-        cursor = conn.cursor()
-        
-        # 获取pheno_new中该物种的物候期数据
-        # 使用子查询避免species表重复记录导致的重复计数
-        cursor_new.execute("""
-            SELECT DISTINCT
-                p.id as phase_id,
-                p.phase_name_en,
-                p.phase_name_de,
-                COUNT(o.id) as observation_count,
-                MIN(o.date) as start_date,
-                MAX(o.date) as end_date
-            FROM dwd_observation o
-            JOIN dwd_phase p ON o.phase_id = p.id
-            WHERE o.species_id IN (
-                SELECT DISTINCT id FROM dwd_species
-                WHERE species_name_en = %s
-                   OR species_name_la = %s
-                   OR species_name_de = %s
-            )
-            GROUP BY p.id, p.phase_name_en, p.phase_name_de
-            ORDER BY p.phase_name_en
-        """, (species_name, species_name, species_name))
-        
-        new_phases = dict_fetchall(cursor_new)
-        
-        # 获取pheno_new中的时间序列数据
-        # 先获取年份范围来决定粒度
-        species_filter_sql = """
-            SELECT DISTINCT id FROM dwd_species
-            WHERE species_name_en = %s OR species_name_la = %s OR species_name_de = %s
-        """
-        # Build year filter clause for pheno_new
-        new_year_filter = ""
-        new_year_params = (species_name, species_name, species_name)
-        if req_year_start is not None and req_year_end is not None:
-            new_year_filter = " AND CAST(o.reference_year AS INTEGER) BETWEEN %s AND %s"
-            new_year_params = (species_name, species_name, species_name, req_year_start, req_year_end)
-
-        # Always return individual observations (deduplicated by date)
-        cursor_new.execute(f"""
-            SELECT
-                p.phase_name_en,
-                p.phase_name_de,
-                TO_CHAR(CAST(o.date AS date), 'YYYY-MM-DD') as obs_date,
-                CAST(o.day_of_year AS INTEGER) as day_of_year,
-                CAST(o.reference_year AS INTEGER) as reference_year
-            FROM dwd_observation o
-            JOIN dwd_phase p ON o.phase_id = p.id
-            WHERE o.species_id IN ({species_filter_sql})
-                AND o.date IS NOT NULL{new_year_filter}
-            GROUP BY p.phase_name_en, p.phase_name_de, CAST(o.date AS date), o.day_of_year, o.reference_year
-            ORDER BY p.phase_name_en, obs_date
-        """, new_year_params)
-        new_individual_observations = dict_fetchall(cursor_new)
-        
-        # 查找该物种在pheno数据库中的对应ID（可能有多个匹配）
-        cursor.execute("""
-            SELECT id, species_name_de, species_name_en, species_name_la 
-            FROM dwd_species 
-            WHERE species_name_de = %s OR species_name_en = %s OR species_name_la = %s
-        """, (species_name, species_name, species_name))
-        
-        pheno_species_matches = dict_fetchall(cursor)
-        
-        pheno_phases = []
-        pheno_individual_observations = []
-        if pheno_species_matches:
-            # 获取pheno数据库中的物候期数据
-            species_ids = [s['id'] for s in pheno_species_matches]
-            placeholders = ','.join(['%s'] * len(species_ids))
-            cursor.execute(f"""
+        try:
+            cursor_new = conn_new.cursor()
+            cursor = conn.cursor()
+
+            # 获取pheno_new中该物种的物候期数据
+            cursor_new.execute("""
                 SELECT DISTINCT
                     p.id as phase_id,
-                    p.phase_name_de,
                     p.phase_name_en,
+                    p.phase_name_de,
                     COUNT(o.id) as observation_count,
-                    AVG(CAST(o.day_of_year AS INTEGER)) as avg_day_of_year
+                    TO_CHAR(MIN(o.date), 'YYYY-MM-DD') as start_date,
+                    TO_CHAR(MAX(o.date), 'YYYY-MM-DD') as end_date
                 FROM dwd_observation o
                 JOIN dwd_phase p ON o.phase_id = p.id
-                WHERE o.species_id IN ({placeholders})
-                GROUP BY p.id, p.phase_name_de, p.phase_name_en
-                ORDER BY p.phase_name_de
-            """, species_ids)
-
-            pheno_phases = dict_fetchall(cursor)
-
-            # Build year filter for pheno
-            pheno_year_filter = ""
-            pheno_params = species_ids
+                WHERE o.species_id IN (
+                    SELECT DISTINCT id FROM dwd_species
+                    WHERE species_name_en = %s
+                       OR species_name_la = %s
+                       OR species_name_de = %s
+                )
+                GROUP BY p.id, p.phase_name_en, p.phase_name_de
+                ORDER BY p.phase_name_en
+            """, (species_name, species_name, species_name))
+
+            new_phases = dict_fetchall(cursor_new)
+
+            # 获取pheno_new中的时间序列数据
+            # 先获取年份范围来决定粒度
+            species_filter_sql = """
+                SELECT DISTINCT id FROM dwd_species
+                WHERE species_name_en = %s OR species_name_la = %s OR species_name_de = %s
+            """
+            # Build year filter clause for pheno_new
+            new_year_filter = ""
+            new_year_params = (species_name, species_name, species_name)
             if req_year_start is not None and req_year_end is not None:
-                pheno_year_filter = " AND CAST(o.reference_year AS INTEGER) BETWEEN %s AND %s"
-                pheno_params = species_ids + [req_year_start, req_year_end]
+                new_year_filter = " AND o.reference_year BETWEEN %s AND %s"
+                new_year_params = (species_name, species_name, species_name, req_year_start, req_year_end)
 
             # Always return individual observations (deduplicated by date)
-            cursor.execute(f"""
+            cursor_new.execute(f"""
                 SELECT
                     p.phase_name_en,
                     p.phase_name_de,
-                    TO_CHAR(CAST(o.date AS date), 'YYYY-MM-DD') as obs_date,
-                    CAST(o.day_of_year AS INTEGER) as day_of_year,
-                    CAST(o.reference_year AS INTEGER) as reference_year
+                    TO_CHAR(o.date, 'YYYY-MM-DD') as obs_date,
+                    o.day_of_year,
+                    o.reference_year
                 FROM dwd_observation o
                 JOIN dwd_phase p ON o.phase_id = p.id
-                WHERE o.species_id IN ({placeholders})
-                    AND o.date IS NOT NULL{pheno_year_filter}
-                GROUP BY p.phase_name_en, p.phase_name_de, CAST(o.date AS date), o.day_of_year, o.reference_year
+                WHERE o.species_id IN ({species_filter_sql})
+                    AND o.date IS NOT NULL{new_year_filter}
+                GROUP BY p.phase_name_en, p.phase_name_de, o.date, o.day_of_year, o.reference_year
                 ORDER BY p.phase_name_en, obs_date
-            """, pheno_params)
-            pheno_individual_observations = dict_fetchall(cursor)
+            """, new_year_params)
+            new_individual_observations = dict_fetchall(cursor_new)
+
+            # 查找该物种在pheno数据库中的对应ID（可能有多个匹配）
+            cursor.execute("""
+                SELECT id, species_name_de, species_name_en, species_name_la
+                FROM dwd_species
+                WHERE species_name_de = %s OR species_name_en = %s OR species_name_la = %s
+            """, (species_name, species_name, species_name))
+
+            pheno_species_matches = dict_fetchall(cursor)
+
+            pheno_phases = []
+            pheno_individual_observations = []
+            if pheno_species_matches:
+                # 获取pheno数据库中的物候期数据
+                species_ids = [s['id'] for s in pheno_species_matches]
+                placeholders = ','.join(['%s'] * len(species_ids))
+                cursor.execute(f"""
+                    SELECT DISTINCT
+                        p.id as phase_id,
+                        p.phase_name_de,
+                        p.phase_name_en,
+                        COUNT(o.id) as observation_count,
+                        AVG(o.day_of_year) as avg_day_of_year
+                    FROM dwd_observation o
+                    JOIN dwd_phase p ON o.phase_id = p.id
+                    WHERE o.species_id IN ({placeholders})
+                    GROUP BY p.id, p.phase_name_de, p.phase_name_en
+                    ORDER BY p.phase_name_de
+                """, species_ids)
+
+                pheno_phases = dict_fetchall(cursor)
+
+                # Build year filter for pheno
+                pheno_year_filter = ""
+                pheno_params = species_ids
+                if req_year_start is not None and req_year_end is not None:
+                    pheno_year_filter = " AND o.reference_year BETWEEN %s AND %s"
+                    pheno_params = species_ids + [req_year_start, req_year_end]
+
+                # Always return individual observations (deduplicated by date)
+                cursor.execute(f"""
+                    SELECT
+                        p.phase_name_en,
+                        p.phase_name_de,
+                        TO_CHAR(o.date, 'YYYY-MM-DD') as obs_date,
+                        o.day_of_year,
+                        o.reference_year
+                    FROM dwd_observation o
+                    JOIN dwd_phase p ON o.phase_id = p.id
+                    WHERE o.species_id IN ({placeholders})
+                        AND o.date IS NOT NULL{pheno_year_filter}
+                    GROUP BY p.phase_name_en, p.phase_name_de, o.date, o.day_of_year, o.reference_year
+                    ORDER BY p.phase_name_en, obs_date
+                """, pheno_params)
+                pheno_individual_observations = dict_fetchall(cursor)
 
-        cursor_new.close()
-        cursor.close()
-        conn_new.close()
-        conn.close()
+            cursor_new.close()
+            cursor.close()
 
-        return jsonify({
-            'pheno_new_phases': new_phases,
-            'pheno_new_individual': new_individual_observations,
-            'pheno_phases': pheno_phases,
-            'pheno_individual': pheno_individual_observations,
-            'pheno_species_matches': pheno_species_matches
-        })
-        
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+            return jsonify({
+                'pheno_new_phases': new_phases,
+                'pheno_new_individual': new_individual_observations,
+                'pheno_phases': pheno_phases,
+                'pheno_individual': pheno_individual_observations,
+                'pheno_species_matches': pheno_species_matches
+            })
+
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
 
 @app.route('/api/pheno-new/locations')
+@response_cache.cached(timeout=86400, depends=OBSERVATION_DATA)
 def api_pheno_new_locations():
     """获取pheno_new数据库中的地理位置并转换为坐标"""
-    conn_new = get_db_connection_new()
-    if not conn_new:
-        return jsonify({'error': 'Database connection failed'}), 500
+    with db_connection('pheno_new', optional=True) as conn_new:
+        if not conn_new:
+            return jsonify({'error': 'Database connection failed'}), 500
 
-    try:
-        cursor_new = conn_new.cursor()
+        try:
+            cursor_new = conn_new.cursor()
 
-        # Get unique locations and their observation counts from pheno_new
-        cursor_new.execute("""
-            SELECT
-                st.station_name as location,
-                COUNT(DISTINCT o.id) as observation_count
-            FROM dwd_station st
-            INNER JOIN dwd_observation o ON st.id = o.station_id
-            WHERE st.area_group = 'Historical'
-            GROUP BY st.station_name
-            ORDER BY st.station_name
-        """)
-
-        locations_data = dict_fetchall(cursor_new)
-
-        # Geocode locations and filter out those without coordinates
-        geocoded_locations = []
-        for loc in locations_data:
-            location_name = loc['location']
-            if location_name and not location_name.startswith('Historical Station'):
-                geocoded = geocode_location(location_name)
+            # Get unique locations and their observation counts from pheno_new
+            cursor_new.execute("""
+                SELECT
+                    st.station_name as location,
+                    COUNT(o.id) as observation_count
+                FROM dwd_station st
+                INNER JOIN dwd_observation o ON st.id = o.station_id
+                WHERE st.area_group = 'Historical'
+                GROUP BY st.station_name
+                ORDER BY st.station_name
+            """)
+
+            locations_data = dict_fetchall(cursor_new)
+
+            # Geocode locations (one batch) and filter out those without coordinates
+            locations_data = [loc for loc in locations_data
+                              if loc['location'] and not loc['location'].startswith('Historical Station')]
+            geocoded_locations = []
+            for loc, geocoded in zip(locations_data, geocode_locations([loc['location'] for loc in locations_data],
+                                                                       skip_missing=False)):
                 if geocoded:
                     geocoded['observations'] = loc['observation_count']
                     geocoded_locations.append(geocoded)
 
-        cursor_new.close()
-        conn_new.close()
+            cursor_new.close()
 
-        return jsonify(geocoded_locations)
+            return jsonify(geocoded_locations)
 
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+
+# 季节分布：年份 × 月份分布按 dim_month 的气象季节汇总（见 create_calendar.sql）
+SEASON_DISTRIBUTION_QUERY = """
+    SELECT d.year, m.season, SUM(d.observation_count)::bigint as observation_count
+    FROM {view} d
+    JOIN dim_month m ON m.month = d.month
+    GROUP BY d.year, m.season, m.season_order
+    ORDER BY d.year, m.season_order
+"""
+
+def fetch_distribution(cursor, source, query, view):
+    """fetch_projection of `query` on the distribution view `view` (written as {view} in the query)
+
+    While the view is not created yet the query runs on its definition from
+    materialized_views.py. When the tables the definition reads are missing as
+    well the rows are empty and the source is reported in X-Data-Source-Errors,
+    which also keeps the response out of the cache.
+    """
+    rows = fetch_optional_projection(cursor, query.format(view=view))
+    if rows is None:
+        definition = load_definitions(source).get(view)
+        if definition:
+            relation = '(' + definition.query.replace('%', '%%') + ')'
+            rows = fetch_optional_projection(cursor, query.format(view=relation))
+    if rows is None:
+        g.setdefault('source_errors', {})[source] = f"{view} or a table it reads is missing"
+        rows = []
+    return rows
 
 @app.route('/api/data-distribution')
-@cache.cached(timeout=7200)  # Cache for 2 hours
+@response_cache.cached(timeout=86400, max_bytes=8 * 1024 * 1024, depends=DERIVED_DATA)
 def api_data_distribution():
     """获取数据时空分布统计 - 同时从pheno和pheno_new数据库"""
-    conn = get_db_connection()
-    conn_new = get_db_connection_new()
-
-    if not conn:
-        return jsonify({'error': 'Pheno database connection failed'}), 500
-
-    try:
-        cursor = conn.cursor()
-
-        # ===== PHENO数据库数据 (using materialized views for speed) =====
-        # 获取年份-地区的观测数量分布（按1年）
-        cursor.execute("""
-            SELECT year, state, observation_count
-            FROM mv_year_state_distribution
-            ORDER BY year, state
-        """)
-
-        pheno_time_location_dist = dict_fetchall(cursor)
-
-        # 获取月份分布
-        cursor.execute("""
-            SELECT year, month, observation_count
-            FROM mv_year_month_distribution
-            ORDER BY year, month
-        """)
-
-        pheno_month_dist = dict_fetchall(cursor)
-
-        # 获取数据覆盖范围统计
-        cursor.execute("""
-            SELECT min_year, max_year, station_count, species_count, phase_count
-            FROM mv_coverage_stats
-        """)
-
-        pheno_coverage = dict_fetchone(cursor)
-
-        cursor.close()
-        conn.close()
-
-        # ===== PHENO_NEW数据库数据 =====
-        pheno_new_time_location_dist = []
-        pheno_new_month_dist = []
-        pheno_new_coverage = None
+    with db_connection(optional=True) as conn, db_connection('pheno_new', optional=True) as conn_new:
+        if not conn:
+            return jsonify({'error': 'Pheno database connection failed'}), 500
 
-        if conn_new:
-            cursor_new = conn_new.cursor()
+        try:
+            cursor = conn.cursor()
 
+            # ===== PHENO数据库数据 (using materialized views for speed) =====
             # 获取年份-地区的观测数量分布（按1年）
-            # For pheno_new, use station_name as location and map to state
-            # Use DISTINCT to avoid duplicate counting due to duplicate station records
-            cursor_new.execute("""
-                SELECT
-                    CAST(reference_year AS INTEGER) as year,
-                    s.station_name,
-                    COUNT(DISTINCT o.id) as observation_count
-                FROM dwd_observation o
-                JOIN dwd_station s ON o.station_id = s.id
-                WHERE s.station_name IS NOT NULL
-                  AND s.station_name != ''
-                  AND s.area_group = 'Historical'
-                  AND NOT s.station_name LIKE 'Historical Station%'
-                GROUP BY CAST(reference_year AS INTEGER), s.station_name
-                ORDER BY year, s.station_name
+            pheno_time_location_dist = fetch_projection(cursor, """
+                SELECT year, state, observation_count
+                FROM mv_year_state_distribution
+                ORDER BY year, state
             """)
 
-            raw_pheno_new_data = dict_fetchall(cursor_new)
-
-            # Map city names to state names and aggregate
-            state_aggregated = {}
-            for item in raw_pheno_new_data:
-                city_name = item['station_name']
-                # Normalize city name to NFC form for consistent matching
-                city_name_normalized = unicodedata.normalize('NFC', city_name)
-                state_name = CITY_STATE_MAPPING.get(city_name_normalized, city_name)  # Use mapping or keep original
-                year = item['year']
-                count = item['observation_count']
-
-                key = (year, state_name)
-                if key not in state_aggregated:
-                    state_aggregated[key] = 0
-                state_aggregated[key] += count
-
-            # Convert back to list format
-            pheno_new_time_location_dist = [
-                {
-                    'year': year,
-                    'state': state,
-                    'observation_count': count
-                }
-                for (year, state), count in sorted(state_aggregated.items())
-            ]
-
             # 获取月份分布
-            cursor_new.execute("""
-                SELECT
-                    CAST(reference_year AS INTEGER) as year,
-                    CASE
-                        WHEN CAST(day_of_year AS INTEGER) <= 31 THEN 1
-                        WHEN CAST(day_of_year AS INTEGER) <= 59 THEN 2
-                        WHEN CAST(day_of_year AS INTEGER) <= 90 THEN 3
-                        WHEN CAST(day_of_year AS INTEGER) <= 120 THEN 4
-                        WHEN CAST(day_of_year AS INTEGER) <= 151 THEN 5
-                        WHEN CAST(day_of_year AS INTEGER) <= 181 THEN 6
-                        WHEN CAST(day_of_year AS INTEGER) <= 212 THEN 7
-                        WHEN CAST(day_of_year AS INTEGER) <= 243 THEN 8
-                        WHEN CAST(day_of_year AS INTEGER) <= 273 THEN 9
-                        WHEN CAST(day_of_year AS INTEGER) <= 304 THEN 10
-                        WHEN CAST(day_of_year AS INTEGER) <= 334 THEN 11
-                        ELSE 12
-                    END as month,
-                    COUNT(o.id) as observation_count
-                FROM dwd_observation o
-                WHERE day_of_year IS NOT NULL AND day_of_year != ''
-                GROUP BY CAST(reference_year AS INTEGER), month
+            pheno_month_dist = fetch_projection(cursor, """
+                SELECT year, month, observation_count
+                FROM mv_year_month_distribution
                 ORDER BY year, month
             """)
+            pheno_season_dist = fetch_distribution(cursor, 'pheno', SEASON_DISTRIBUTION_QUERY,
+                                                   'mv_year_month_distribution')
 
-            pheno_new_month_dist = dict_fetchall(cursor_new)
-
-            # 获取数据覆盖范围统计 (count unique station names, not IDs,
-            # because old import created multiple IDs per physical station)
-            cursor_new.execute("""
-                SELECT
-                    MIN(CAST(o.reference_year AS INTEGER)) as min_year,
-                    MAX(CAST(o.reference_year AS INTEGER)) as max_year,
-                    COUNT(DISTINCT s.station_name) as station_count,
-                    COUNT(DISTINCT o.species_id) as species_count,
-                    COUNT(DISTINCT o.phase_id) as phase_count
-                FROM dwd_observation o
-                JOIN dwd_station s ON o.station_id = s.id
+            # 获取数据覆盖范围统计
+            cursor.execute("""
+                SELECT min_year, max_year, station_count, species_count, phase_count
+                FROM mv_coverage_stats
             """)
 
-            pheno_new_coverage = dict_fetchone(cursor_new)
+            pheno_coverage = dict_fetchone(cursor)
 
-            cursor_new.close()
-            conn_new.close()
+            cursor.close()
 
-        return jsonify({
-            'pheno': {
-                'time_location_distribution': pheno_time_location_dist,
-                'month_distribution': pheno_month_dist,
-                'coverage': pheno_coverage
-            },
-            'pheno_new': {
-                'time_location_distribution': pheno_new_time_location_dist,
-                'month_distribution': pheno_new_month_dist,
-                'coverage': pheno_new_coverage
-            }
-        })
+            # ===== PHENO_NEW数据库数据 =====
+            pheno_new_time_location_dist = []
+            pheno_new_month_dist = []
+            pheno_new_season_dist = []
+            pheno_new_coverage = None
+
+            if conn_new:
+                cursor_new = conn_new.cursor()
+
+                # 获取年份-地区的观测数量分布（按1年）
+                # 站点地名已在数据库中映射到州（city_state_mapping，见 pheno_new_distribution.sql）；
+                # 视图尚未创建时按视图定义实时统计
+                pheno_new_time_location_dist = fetch_distribution(cursor_new, 'pheno_new', """
+                    SELECT year, state, observation_count
+                    FROM {view} d
+                    ORDER BY year, state
+                """, 'mv_year_state_distribution')
+
+                # 获取月份分布（年积日经日历维度归月，见 pheno_new_distribution.sql）
+                pheno_new_month_dist = fetch_distribution(cursor_new, 'pheno_new', """
+                    SELECT year, month, observation_count
+                    FROM {view} d
+                    ORDER BY year, month
+                """, 'mv_year_month_distribution')
+                pheno_new_season_dist = fetch_distribution(cursor_new, 'pheno_new', SEASON_DISTRIBUTION_QUERY,
+                                                           'mv_year_month_distribution')
+
+                # 获取数据覆盖范围统计
+                cursor_new.execute("""
+                    SELECT
+                        MIN(o.reference_year) as min_year,
+                        MAX(o.reference_year) as max_year,
+                        COUNT(DISTINCT o.station_id) as station_count,
+                        COUNT(DISTINCT o.species_id) as species_count,
+                        COUNT(DISTINCT o.phase_id) as phase_count
+                    FROM dwd_observation o
+                """)
+
+                pheno_new_coverage = dict_fetchone(cursor_new)
+
+                cursor_new.close()
+
+            return raw_json_response(app, {
+                'pheno': {
+                    'time_location_distribution': pheno_time_location_dist,
+                    'month_distribution': pheno_month_dist,
+                    'season_distribution': pheno_season_dist,
+                    'coverage': pheno_coverage
+                },
+                'pheno_new': {
+                    'time_location_distribution': pheno_new_time_location_dist,
+                    'month_distribution': pheno_new_month_dist,
+                    'season_distribution': pheno_new_season_dist,
+                    'coverage': pheno_new_coverage
+                }
+            })
 
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
 
 def dict_fetchone(cursor):
     """将单行查询结果转换为字典"""
@@ -1348,124 +1686,237 @@ def dict_fetchone(cursor):
 @app.route('/api/debug/pheno-new-stations')
 def api_debug_pheno_new_stations():
     """Debug endpoint to check pheno_new station data"""
-    conn_new = get_db_connection_new()
+    with db_connection('pheno_new', optional=True) as conn_new:
+        if not conn_new:
+            return jsonify({'error': 'Pheno_new database connection failed'}), 500
 
-    if not conn_new:
-        return jsonify({'error': 'Pheno_new database connection failed'}), 500
+        try:
+            cursor_new = conn_new.cursor()
 
-    try:
-        cursor_new = conn_new.cursor()
+            # Check station table structure
+            cursor_new.execute("""
+                SELECT column_name, data_type
+                FROM information_schema.columns
+                WHERE table_name = 'dwd_station'
+                ORDER BY ordinal_position
+            """)
 
-        # Check station table structure
-        cursor_new.execute("""
-            SELECT column_name, data_type
-            FROM information_schema.columns
-            WHERE table_name = 'dwd_station'
-            ORDER BY ordinal_position
-        """)
+            columns = fetch_rows(cursor_new)
 
-        columns = dict_fetchall(cursor_new)
+            # Get sample station data
+            cursor_new.execute("""
+                SELECT * FROM dwd_station LIMIT 5
+            """)
 
-        # Get sample station data
-        cursor_new.execute("""
-            SELECT * FROM dwd_station LIMIT 5
-        """)
+            sample_stations = fetch_rows(cursor_new)
 
-        sample_stations = dict_fetchall(cursor_new)
+            # Get stations with coordinates
+            cursor_new.execute("""
+                SELECT COUNT(*) as total_stations,
+                       COUNT(latitude) as stations_with_lat,
+                       COUNT(longitude) as stations_with_lon
+                FROM dwd_station
+            """)
 
-        # Get stations with coordinates
-        cursor_new.execute("""
-            SELECT COUNT(*) as total_stations,
-                   COUNT(latitude) as stations_with_lat,
-                   COUNT(longitude) as stations_with_lon
-            FROM dwd_station
-        """)
+            coord_stats = dict_fetchone(cursor_new)
 
-        coord_stats = dict_fetchone(cursor_new)
+            cursor_new.close()
 
-        cursor_new.close()
-        conn_new.close()
+            return jsonify({
+                'columns': columns,
+                'sample_stations': sample_stations,
+                'coordinate_stats': coord_stats
+            })
 
-        return jsonify({
-            'columns': columns,
-            'sample_stations': sample_stations,
-            'coordinate_stats': coord_stats
-        })
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+
+@app.route('/api/data-freshness')
+@response_cache.cached(timeout=3600, depends=DERIVED_DATA)
+def api_data_freshness():
+    """物化视图最近一次刷新的时间（由 materialized_views.py 记录），按数据库分组"""
+    def freshness(source):
+        with db_connection(source) as conn:
+            cursor = conn.cursor()
+            views = read_freshness(cursor)
+            cursor.close()
+        return {name: {**view, 'refreshed_at': view['refreshed_at'].isoformat()} for name, view in views.items()}
 
+    try:
+        return jsonify(fan_out('both', freshness))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/data-distribution-detailed')
-@cache.cached(timeout=7200)  # Cache for 2 hours
-def api_data_distribution_detailed():
-    """获取详细的站点级别数据分布 - 用于地图和时间线可视化"""
-    conn = get_db_connection()
-    conn_new = get_db_connection_new()
+@app.route('/api/debug/pool-stats')
+def api_debug_pool_stats():
+    """Connection pool statistics for this worker process"""
+    return jsonify({name: pool.stats() for name, pool in db_pools.items()})
+
+@app.route('/api/debug/count-cube')
+def api_debug_count_cube():
+    """Count cube state for this worker process"""
+    return jsonify({source: cube.stats() for source, cube in count_cubes.items()})
+
+@app.route('/api/debug/dimension-cache')
+def api_debug_dimension_cache():
+    """Dimension cache state for this worker process"""
+    return jsonify({source: cache.stats() for source, cache in dimension_caches.items()})
+
+@app.route('/api/debug/cache-stats')
+def api_debug_cache_stats():
+    """Response cache hit/miss counters for this worker process"""
+    return jsonify({
+        'backend': app.config['CACHE_TYPE'],
+        'endpoints': response_cache.stats(),
+        'data_versions': data_versions.stats(),
+        'warmup': cache_warmup.stats()
+    })
+
+# 列式格式中每个站点只发送一次的列
+STATION_DICTIONARY_COLUMNS = ['station_id', 'station_name', 'latitude', 'longitude', 'state', 'area']
+
+def delta_encode(values):
+    """[5, 7, 8] -> [5, 2, 1]（客户端用前缀和还原）"""
+    previous = 0
+    deltas = []
+    for value in values:
+        deltas.append(value - previous)
+        previous = value
+    return deltas
+
+def columnar_station_years(rows):
+    """
+    站点-年份行（Rows）转换为列式、字典编码的格式
 
-    if not conn:
-        return jsonify({'error': 'Pheno database connection failed'}), 500
+    Returns {"stations": {"columns": [...], "rows": [[...], ...]},
+             "station_index": [...], "reference_year": [...], "observation_count": [...],
+             "delta": ["station_index", "reference_year"]}
+    Stations keep the order of their first row; the parallel arrays are sorted by
+    (station_index, reference_year) and the arrays listed in "delta" are delta encoded.
+    """
+    position = {column: i for i, column in enumerate(rows.columns)}
+    station_id, year, count = position['station_id'], position['reference_year'], position['observation_count']
+    station_positions = [position[column] for column in STATION_DICTIONARY_COLUMNS]
+    stations = []
+    station_index = {}
+    cells = []
+    for row in rows.rows:
+        index = station_index.get(row[station_id])
+        if index is None:
+            index = station_index[row[station_id]] = len(stations)
+            stations.append([row[i] for i in station_positions])
+        cells.append((index, row[year], row[count]))
+    cells.sort(key=lambda cell: (cell[0], cell[1]))
+    return {
+        'stations': {'columns': STATION_DICTIONARY_COLUMNS, 'rows': stations},
+        'station_index': delta_encode([cell[0] for cell in cells]),
+        'reference_year': delta_encode([cell[1] for cell in cells]),
+        'observation_count': [cell[2] for cell in cells],
+        'delta': ['station_index', 'reference_year']
+    }
+
+DISTRIBUTION_ARROW_TYPES = {'source': 'string', 'station_id': 'string', 'station_name': 'string',
+                            'latitude': 'double', 'longitude': 'double', 'state': 'string', 'area': 'string',
+                            'reference_year': 'int16', 'observation_count': 'int64'}
 
-    try:
-        cursor = conn.cursor()
+@app.route('/api/data-distribution-detailed')
+@response_cache.cached(timeout=86400, max_bytes=8 * 1024 * 1024, defaults={'format': 'rows'}, depends=DERIVED_DATA,
+                       variant=binary_variant, vary=('Accept',))
+def api_data_distribution_detailed():
+    """获取详细的站点级别数据分布 - 用于地图和时间线可视化
 
-        # ===== PHENO数据库 - 站点级别聚合（使用物化视图优化） =====
-        cursor.execute("""
-            SELECT
-                station_id,
-                station_name,
-                latitude,
-                longitude,
-                state,
-                area,
-                reference_year,
-                observation_count
-            FROM mv_station_yearly_stats
-            ORDER BY station_name, reference_year
-        """)
+    format=columnar 返回站点字典 + 平行数组（见 columnar_station_years），
+    默认 format=rows 每个站点-年份一行。Arrow / MessagePack（Accept 请求头）
+    返回一张带 source 列的表，站点名称、州和地区使用字典编码。
+    """
+    response_format = request.args.get('format', 'rows')
+    if response_format not in ('rows', 'columnar'):
+        return jsonify({'error': 'format must be rows or columnar'}), 400
+
+    # ===== PHENO数据库 - 站点级别聚合（使用物化视图优化） =====
+    query_pheno = """
+        SELECT
+            station_id,
+            station_name,
+            latitude,
+            longitude,
+            state,
+            area,
+            reference_year,
+            observation_count
+        FROM mv_station_yearly_stats
+        ORDER BY station_name, reference_year
+    """
 
-        pheno_station_yearly = dict_fetchall(cursor)
+    # ===== PHENO_NEW数据库 - 站点级别聚合 =====
+    # Coordinates are now stored in DB for all stations
+    query_new = """
+        SELECT
+            s.id as station_id,
+            s.station_name,
+            s.latitude,
+            s.longitude,
+            s.state,
+            s.area,
+            o.reference_year,
+            COUNT(o.id) as observation_count
+        FROM dwd_observation o
+        JOIN dwd_station s ON o.station_id = s.id
+        WHERE s.station_name IS NOT NULL
+          AND s.latitude IS NOT NULL
+          AND s.longitude IS NOT NULL
+        GROUP BY s.id, s.station_name, s.latitude, s.longitude, s.state, s.area, o.reference_year
+        ORDER BY s.station_name, o.reference_year
+    """
 
-        cursor.close()
-        conn.close()
+    binary_format = negotiate_format()
 
-        # ===== PHENO_NEW数据库 - 站点级别聚合 =====
-        pheno_new_station_yearly = []
+    with db_connection(optional=True) as conn, db_connection('pheno_new', optional=True) as conn_new:
+        if not conn:
+            return jsonify({'error': 'Pheno database connection failed'}), 500
 
-        if conn_new:
-            cursor_new = conn_new.cursor()
+        try:
+            cursor = conn.cursor()
+            cursor_new = conn_new.cursor() if conn_new else None
 
-            # Coordinates are now stored in DB for all stations
-            cursor_new.execute("""
-                SELECT
-                    s.id as station_id,
-                    s.station_name,
-                    s.latitude,
-                    s.longitude,
-                    s.state,
-                    s.area,
-                    o.reference_year,
-                    COUNT(o.id) as observation_count
-                FROM dwd_observation o
-                JOIN dwd_station s ON o.station_id = s.id
-                WHERE s.station_name IS NOT NULL
-                  AND s.latitude IS NOT NULL
-                  AND s.longitude IS NOT NULL
-                GROUP BY s.id, s.station_name, s.latitude, s.longitude, s.state, s.area, o.reference_year
-                ORDER BY s.station_name, o.reference_year
-            """)
+            if DB_JSON and response_format == 'rows' and binary_format == 'json':
+                # 逐行投影：两个 JSON 数组都由数据库生成
+                return raw_json_response(app, {
+                    'pheno': json_array(cursor, query_pheno),
+                    'pheno_new': json_array(cursor_new, query_new) if cursor_new else RawJSON(b'[]')
+                })
 
-            pheno_new_station_yearly = dict_fetchall(cursor_new)
+            cursor.execute(query_pheno)
+            columns = [col[0] for col in cursor.description]
+            pheno_station_yearly = cursor.fetchall()
+            cursor.close()
 
-            cursor_new.close()
-            conn_new.close()
+            pheno_new_station_yearly = []
+            if cursor_new:
+                cursor_new.execute(query_new)
+                pheno_new_station_yearly = cursor_new.fetchall()
+                cursor_new.close()
+
+            if binary_format != 'json':
+                rows = ([('pheno',) + row for row in pheno_station_yearly]
+                        + [('pheno_new',) + row for row in pheno_new_station_yearly])
+                return binary_response(binary_format, ['source'] + columns, [rows], types=DISTRIBUTION_ARROW_TYPES,
+                                       dictionary=('source', 'station_name', 'state', 'area'), buffered=True)
+
+            if response_format == 'columnar':
+                return jsonify({
+                    'format': 'columnar',
+                    'pheno': columnar_station_years(Rows(columns, pheno_station_yearly)),
+                    'pheno_new': columnar_station_years(Rows(columns, pheno_new_station_yearly))
+                })
 
-        return jsonify({
-            'pheno': pheno_station_yearly,
-            'pheno_new': pheno_new_station_yearly
-        })
+            return jsonify({
+                'pheno': Rows(columns, pheno_station_yearly),
+                'pheno_new': Rows(columns, pheno_new_station_yearly)
+            })
 
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
 
 # Transcription Editor API endpoints
 TRANSCRIPTION_BASE_PATH = os.environ.get('TRANSCRIPTION_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corrected'))
@@ -1689,38 +2140,37 @@ def api_transcription_odt(folder_name, file_name):
 def api_transcription_annotations(folder_name, file_name):
     """Get annotations for a specific file"""
     try:
-        conn = get_db_connection()
-        if not conn:
-            return jsonify({'error': 'Database connection failed'}), 500
+        with db_connection(optional=True) as conn:
+            if not conn:
+                return jsonify({'error': 'Database connection failed'}), 500
 
-        cursor = conn.cursor()
+            cursor = conn.cursor()
 
-        # Create table if not exists
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS transcription_annotations (
-                id SERIAL PRIMARY KEY,
-                folder_name VARCHAR(500) NOT NULL,
-                file_name VARCHAR(500) NOT NULL,
-                annotation_text TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        conn.commit()
-
-        # Get annotations for this file
-        cursor.execute("""
-            SELECT id, folder_name, file_name, annotation_text, created_at
-            FROM transcription_annotations
-            WHERE folder_name = %s AND file_name = %s
-            ORDER BY created_at DESC
-        """, (folder_name, file_name))
-
-        annotations = dict_fetchall(cursor)
+            # Create table if not exists
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS transcription_annotations (
+                    id SERIAL PRIMARY KEY,
+                    folder_name VARCHAR(500) NOT NULL,
+                    file_name VARCHAR(500) NOT NULL,
+                    annotation_text TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            conn.commit()
 
-        cursor.close()
-        conn.close()
+            # Get annotations for this file
+            cursor.execute("""
+                SELECT id, folder_name, file_name, annotation_text, created_at
+                FROM transcription_annotations
+                WHERE folder_name = %s AND file_name = %s
+                ORDER BY created_at DESC
+            """, (folder_name, file_name))
 
-        return jsonify({'annotations': annotations})
+            annotations = fetch_rows(cursor)
+
+            cursor.close()
+
+            return jsonify({'annotations': annotations})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -1736,47 +2186,48 @@ def api_transcription_add_annotation():
         if not folder_name or not file_name or not annotation_text:
             return jsonify({'error': 'Missing required fields'}), 400
 
-        conn = get_db_connection()
-        if not conn:
-            return jsonify({'error': 'Database connection failed'}), 500
+        with db_connection(optional=True) as conn:
+            if not conn:
+                return jsonify({'error': 'Database connection failed'}), 500
 
-        cursor = conn.cursor()
+            cursor = conn.cursor()
 
-        # Create table if not exists
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS transcription_annotations (
-                id SERIAL PRIMARY KEY,
-                folder_name VARCHAR(500) NOT NULL,
-                file_name VARCHAR(500) NOT NULL,
-                annotation_text TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-
-        # Insert annotation
-        cursor.execute("""
-            INSERT INTO transcription_annotations (folder_name, file_name, annotation_text)
-            VALUES (%s, %s, %s)
-            RETURNING id, created_at
-        """, (folder_name, file_name, annotation_text))
-
-        result = cursor.fetchone()
-        conn.commit()
+            # Create table if not exists
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS transcription_annotations (
+                    id SERIAL PRIMARY KEY,
+                    folder_name VARCHAR(500) NOT NULL,
+                    file_name VARCHAR(500) NOT NULL,
+                    annotation_text TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
 
-        cursor.close()
-        conn.close()
+            # Insert annotation
+            cursor.execute("""
+                INSERT INTO transcription_annotations (folder_name, file_name, annotation_text)
+                VALUES (%s, %s, %s)
+                RETURNING id, created_at
+            """, (folder_name, file_name, annotation_text))
 
-        return jsonify({
-            'success': True,
-            'message': 'Annotation added successfully',
-            'id': result[0],
-            'created_at': result[1].isoformat()
-        })
+            result = cursor.fetchone()
+            bump_data_version(conn, 'annotations')
+            conn.commit()
+
+            cursor.close()
+
+            return jsonify({
+                'success': True,
+                'message': 'Annotation added successfully',
+                'id': result[0],
+                'created_at': result[1].isoformat()
+            })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
 @app.route('/api/species-mapping')
+@response_cache.cached(timeout=3600)
 def api_species_mapping():
     """Read species mapping from final_species_mapping.csv and return as JSON"""
     try:
@@ -1795,5 +2246,9 @@ def api_species_mapping():
         return jsonify({'error': str(e)}), 500
 
 
+# 所有路由注册完成后才开始预热（预热请求之后不能再注册路由）
+if CACHE_WARMUP:
+    cache_warmup.start()
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0',port=9090)
\ No newline at end of file
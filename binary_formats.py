@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Binary response formats for the bulk endpoints (Arrow IPC stream, MessagePack)
+
+Notebooks that pull /api/observations, /api/data-distribution-detailed or
+trend series spend most of their time encoding and decoding JSON. These
+endpoints negotiate the format through the Accept header:
+
+    application/vnd.apache.arrow.stream   Arrow IPC stream (pyarrow.ipc.open_stream)
+    application/msgpack                   MessagePack (application/x-msgpack accepted too)
+
+Both are columnar and built from batches of row tuples (cursor.fetchmany),
+so no dict is created per row:
+
+- Arrow: one record batch per input batch with the declared column types;
+  columns in `dictionary` (repeated names, states) are dictionary encoded
+- MessagePack: a sequence of maps {column: [values, ...]}, one per batch
+  (read with msgpack.Unpacker; pandas.DataFrame(batch) per map)
+
+pyarrow and msgpack are optional; a format whose package is missing is not
+offered and such requests get JSON.
+
+Usage:
+    fmt = negotiate_format()
+    if fmt != 'json':
+        return binary_response(fmt, columns, batches, types={'reference_year': 'int16'})
+"""
+
+import datetime
+import decimal
+import io
+
+from flask import Response, request
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+except ImportError:
+    pyarrow = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+ARROW_MEDIA_TYPE = 'application/vnd.apache.arrow.stream'
+MSGPACK_MEDIA_TYPE = 'application/msgpack'
+JSON_MEDIA_TYPE = 'application/json'
+
+# Accept media type -> format
+MEDIA_TYPES = {
+    JSON_MEDIA_TYPE: 'json',
+    ARROW_MEDIA_TYPE: 'arrow',
+    MSGPACK_MEDIA_TYPE: 'msgpack',
+    'application/x-msgpack': 'msgpack',
+}
+
+FORMAT_MEDIA_TYPES = {'arrow': ARROW_MEDIA_TYPE, 'msgpack': MSGPACK_MEDIA_TYPE}
+
+
+def available_formats():
+    formats = ['json']
+    if pyarrow is not None:
+        formats.append('arrow')
+    if msgpack is not None:
+        formats.append('msgpack')
+    return formats
+
+
+def negotiate_format():
+    """'json', 'arrow' or 'msgpack' for the current request's Accept header (JSON wins ties)"""
+    formats = available_formats()
+    offers = [media_type for media_type, fmt in MEDIA_TYPES.items() if fmt in formats]
+    best = request.accept_mimetypes.best_match(offers, default=JSON_MEDIA_TYPE)
+    return MEDIA_TYPES[best]
+
+
+def binary_variant():
+    """Response cache variant of the negotiated format (None for JSON)"""
+    fmt = negotiate_format()
+    return None if fmt == 'json' else fmt
+
+
+def transpose(rows, width):
+    """Row tuples -> one list per column"""
+    if not rows:
+        return [[] for _ in range(width)]
+    return [list(column) for column in zip(*rows)]
+
+
+def _arrow_array(values, type_name, dictionary):
+    arrow_type = pyarrow.type_for_alias(type_name) if type_name else None
+    try:
+        array = pyarrow.array(values, type=arrow_type)
+    except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError):
+        # e.g. integer ids in a column declared as string
+        array = pyarrow.array(values).cast(arrow_type, safe=False)
+    return array.dictionary_encode() if dictionary else array
+
+
+def arrow_stream(columns, batches, types=None, dictionary=()):
+    """Arrow IPC stream bytes, one record batch per batch of row tuples"""
+    types = types or {}
+    buffer = io.BytesIO()
+    writer = None
+    schema = None
+    for rows in batches:
+        arrays = [_arrow_array(values, types.get(column), column in dictionary)
+                  for column, values in zip(columns, transpose(rows, len(columns)))]
+        if writer is None:
+            schema = pyarrow.schema([pyarrow.field(column, array.type) for column, array in zip(columns, arrays)])
+            writer = pyarrow.ipc.new_stream(buffer, schema)
+        else:
+            # Columns without declared type: keep the type of the first batch
+            arrays = [array if array.type == field.type else array.cast(field.type)
+                      for array, field in zip(arrays, schema)]
+        writer.write_batch(pyarrow.record_batch(arrays, schema=schema))
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if writer is None:
+        # Empty result: a schema-only stream
+        schema = pyarrow.schema([pyarrow.field(column, pyarrow.type_for_alias(types.get(column, 'null')))
+                                 for column in columns])
+        writer = pyarrow.ipc.new_stream(buffer, schema)
+    writer.close()
+    yield buffer.getvalue()
+
+
+def _msgpack_default(value):
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+
+def msgpack_stream(columns, batches):
+    """MessagePack bytes, one {column: [values]} map per batch of row tuples"""
+    packer = msgpack.Packer(default=_msgpack_default)
+    empty = True
+    for rows in batches:
+        empty = False
+        yield packer.pack(dict(zip(columns, transpose(rows, len(columns)))))
+    if empty:
+        yield packer.pack({column: [] for column in columns})
+
+
+def binary_response(fmt, columns, batches, types=None, dictionary=(), on_close=None, buffered=False):
+    """
+    Arrow or MessagePack response, streamed unless `buffered`
+
+    Args:
+        fmt: 'arrow' or 'msgpack'
+        columns: Column names
+        batches: Iterable of lists of row tuples in column order
+        types: Arrow type aliases per column ('string', 'int16', 'int64', 'double', ...)
+        dictionary: Columns to dictionary encode (Arrow)
+        on_close: Callable run when the stream ends or the client goes away
+        buffered: Build the whole body first (small results that the response cache stores)
+    """
+    if fmt == 'arrow':
+        chunks = arrow_stream(columns, batches, types, dictionary)
+    elif fmt == 'msgpack':
+        chunks = msgpack_stream(columns, batches)
+    else:
+        raise ValueError(f"Unsupported format: {fmt}")
+
+    if buffered:
+        try:
+            body = b''.join(chunks)
+        finally:
+            if on_close:
+                on_close()
+        response = Response(body, mimetype=FORMAT_MEDIA_TYPES[fmt])
+        response.vary.add('Accept')
+        return response
+
+    def generate():
+        try:
+            yield from chunks
+        except Exception as e:
+            # Headers are already sent; the client sees a truncated stream
+            print(f"Binary streaming error: {e}")
+        finally:
+            if on_close:
+                on_close()
+
+    response = Response(generate(), mimetype=FORMAT_MEDIA_TYPES[fmt])
+    response.vary.add('Accept')
+    return response
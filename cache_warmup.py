@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+Startup cache warmup
+
+After a deploy (or a cache flush) every response cache entry is cold and the
+first visitors of the map and timeline pages waited for the pheno_new
+aggregations and the materialized-view scans. Stale-while-revalidate in
+response_cache.py only helps once an entry exists, so each worker process
+runs a warmup when it starts:
+
+    1. in-process state: the dimension caches and count cubes are loaded
+    2. optionally the PostgreSQL buffer cache: pg_prewarm() of the
+       materialized views, their indexes and the dimension tables
+    3. the hot endpoints (HOT_URLS) are requested through the app, once per
+       data version over all workers: the first worker takes a lock entry in
+       the shared cache backend, the others wait for it to finish
+
+Requests arriving during the warmup wait for it (up to `wait_timeout`
+seconds), so none of them computes a cold entry itself. pg_prewarm is a
+contrib extension; without it (or without the right to create it) step 2 is
+skipped with a message.
+
+Usage:
+    warmup = CacheWarmup(app, cache, versions=data_versions, loaders=[...])
+    warmup.start()                       # once per worker, in a thread
+    warmup.wait()                        # in before_request
+
+    python3 cache_warmup.py [--prewarm] [--url /api/stations ...]
+"""
+
+import argparse
+import os
+import threading
+import time
+
+import psycopg2
+
+from incremental_aggregates import MANAGED_NAMES
+
+# Pages load these on first paint (see templates/)
+HOT_URLS = [
+    '/api/overview',
+    '/api/stations',
+    '/api/stations?data_source=pheno_new',
+    '/api/stations?data_source=both',
+    '/api/species',
+    '/api/species?data_source=both',
+    '/api/phases',
+    '/api/phases?data_source=both',
+    '/api/pheno-new/species',
+    '/api/pheno-new/locations',
+    '/api/quality',
+    '/api/species-mapping',
+    '/api/data-distribution',
+    '/api/data-distribution-detailed',
+    '/api/data-distribution-detailed?format=columnar',
+]
+
+# Each URL is requested once per header set: the identity entry and the
+# compressed variant browsers ask for
+WARMUP_HEADERS = [{}, {'Accept-Encoding': 'gzip, deflate, br, zstd'}]
+
+# Tables read by the hot endpoints next to the materialized views (the
+# aggregates maintained by incremental_aggregates.py are tables)
+PREWARM_TABLES = ['dwd_station', 'dwd_species', 'dwd_phase'] + sorted(MANAGED_NAMES)
+
+PREWARM_RELATIONS = """
+    SELECT c.oid::regclass::text
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    LEFT JOIN pg_index i ON i.indexrelid = c.oid
+    LEFT JOIN pg_class t ON t.oid = i.indrelid
+    WHERE n.nspname = 'public' AND c.relkind IN ('r', 'm', 'i')
+      AND (c.relkind = 'm' OR t.relkind = 'm' OR c.relname = ANY(%s) OR t.relname = ANY(%s))
+    ORDER BY c.relkind DESC, c.relname
+"""
+
+LOCK_PREFIX = 'warmup:'
+
+
+def prewarm_relations(conn, tables=PREWARM_TABLES):
+    """
+    Load the materialized views, their indexes and `tables` into shared buffers
+
+    Returns {relation: blocks read}, or None when pg_prewarm is not available.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_prewarm")
+        conn.commit()
+    except psycopg2.Error as e:
+        conn.rollback()
+        print(f"pg_prewarm not available, buffer cache not prewarmed: {str(e).splitlines()[0]}")
+        return None
+    cursor.execute(PREWARM_RELATIONS, (list(tables), list(tables)))
+    blocks = {}
+    for (relation,) in cursor.fetchall():
+        cursor.execute("SELECT pg_prewarm(%s::regclass)", (relation,))
+        blocks[relation] = cursor.fetchone()[0]
+    cursor.close()
+    return blocks
+
+
+def warm_urls(app, urls, headers_list=WARMUP_HEADERS):
+    """Request `urls` through the app; returns [(url, status, X-Cache, seconds)]"""
+    client = app.test_client()
+    results = []
+    for url in urls:
+        for headers in headers_list:
+            started = time.monotonic()
+            try:
+                response = client.get(url, headers=headers)
+                results.append((url, response.status_code, response.headers.get('X-Cache'),
+                                time.monotonic() - started))
+                response.close()
+            except Exception as e:
+                print(f"Warmup of {url} failed: {e}")
+                results.append((url, None, None, time.monotonic() - started))
+    return results
+
+
+class CacheWarmup:
+    """Per-process warmup of in-memory caches, database buffers and hot responses"""
+
+    def __init__(self, app, cache, versions=None, loaders=(), connections=None, urls=HOT_URLS,
+                 prewarm=False, wait_timeout=30.0, ready_timeout=30.0, lock_timeout=600, namespaces=()):
+        """
+        Args:
+            app: Flask app the URLs are requested from
+            cache: Flask-Caching Cache shared by the workers (warmup lock)
+            versions: Optional DataVersionListener; URLs are warmed once its versions are known
+            loaders: Callables loading in-process state (dimension caches, count cubes)
+            connections: {source: connection context factory} for pg_prewarm
+            urls: Endpoints to request
+            prewarm: Prewarm the PostgreSQL buffer cache
+            wait_timeout: Seconds wait() blocks a request at most
+            ready_timeout: Seconds to wait for the data versions before warming anyway
+            lock_timeout: Seconds the warmup lock of one worker is valid
+            namespaces: Data-version namespaces the warmed responses depend on (lock key)
+        """
+        self.app = app
+        self.cache = cache
+        self.versions = versions
+        self.loaders = list(loaders)
+        self.connections = connections or {}
+        self.urls = list(urls)
+        self.prewarm = prewarm
+        self.wait_timeout = wait_timeout
+        self.ready_timeout = ready_timeout
+        self.lock_timeout = lock_timeout
+        self.namespaces = tuple(namespaces)
+
+        self._lock = threading.Lock()
+        self._pid = None
+        self._thread = None
+        self._done = threading.Event()
+        self._stats = {'started_at': None, 'seconds': None, 'warmed_by': None, 'prewarmed': None,
+                       'urls': [], 'errors': []}
+
+    def start(self):
+        """Start the warmup thread once per process (safe to call on every request)"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # Threads do not survive fork(): every worker warms its own state
+            self._pid = os.getpid()
+            self._done = threading.Event()
+            self._thread = threading.Thread(target=self.run, daemon=True, name='cache-warmup')
+            self._thread.start()
+
+    def wait(self):
+        """Block the current request until the warmup is done (at most wait_timeout seconds)"""
+        if self._thread is None or threading.current_thread() is self._thread:
+            # Not started, or a request made by the warmup itself
+            return
+        self._done.wait(self.wait_timeout)
+
+    def _error(self, step, e):
+        print(f"Cache warmup {step} failed: {e}")
+        self._stats['errors'].append(f"{step}: {e}")
+
+    def _run_urls(self, force):
+        deadline = time.monotonic() + self.ready_timeout
+        if self.versions:
+            self.versions.start()
+            while not self.versions.ready() and time.monotonic() < deadline:
+                time.sleep(0.1)
+        lock_key = LOCK_PREFIX + (self.versions.key(self.namespaces) if self.versions else '')
+        try:
+            if force:
+                owner = self.cache.set(lock_key, 'running', timeout=self.lock_timeout) or True
+            else:
+                owner = self.cache.add(lock_key, 'running', timeout=self.lock_timeout)
+        except Exception as e:
+            self._error('lock', e)
+            owner = True
+        if not owner:
+            # Another worker warms the shared cache; its entries are hits for this one
+            deadline = time.monotonic() + self.lock_timeout
+            while self.cache.get(lock_key) == 'running' and time.monotonic() < deadline:
+                time.sleep(0.5)
+            self._stats['warmed_by'] = 'other worker'
+            return
+        self._stats['warmed_by'] = os.getpid()
+        try:
+            self._stats['urls'] = [
+                {'url': url, 'status': status, 'cache': outcome, 'seconds': round(seconds, 3)}
+                for url, status, outcome, seconds in warm_urls(self.app, self.urls)
+            ]
+        finally:
+            self.cache.set(lock_key, 'done', timeout=self.lock_timeout)
+
+    def run(self, force=False):
+        """Run all warmup steps in the current thread (force: warm URLs even if another process did)"""
+        started = time.monotonic()
+        self._stats['started_at'] = time.strftime('%Y-%m-%d %H:%M:%S')
+        try:
+            for loader in self.loaders:
+                try:
+                    loader()
+                except Exception as e:
+                    self._error('loader', e)
+            if self.prewarm:
+                self._stats['prewarmed'] = {}
+                for source, connection in self.connections.items():
+                    try:
+                        with connection(optional=True) as conn:
+                            if conn is not None:
+                                self._stats['prewarmed'][source] = prewarm_relations(conn)
+                    except Exception as e:
+                        self._error(f'prewarm {source}', e)
+            try:
+                self._run_urls(force)
+            except Exception as e:
+                self._error('urls', e)
+        finally:
+            self._stats['seconds'] = round(time.monotonic() - started, 3)
+            self._done.set()
+
+    def stats(self):
+        return {**self._stats, 'done': self._done.is_set()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--prewarm', action='store_true', help='Prewarm the PostgreSQL buffer cache (pg_prewarm)')
+    parser.add_argument('--url', action='append', help='Endpoint to warm (repeatable, default: HOT_URLS)')
+    args = parser.parse_args()
+
+    # The app's own warmup thread would do the same work concurrently
+    os.environ['CACHE_WARMUP'] = '0'
+    import app as webapp
+
+    warmup = CacheWarmup(webapp.app, webapp.cache, versions=webapp.data_versions,
+                         connections={source: pool.connection for source, pool in webapp.db_pools.items()},
+                         urls=args.url or HOT_URLS, prewarm=args.prewarm, namespaces=webapp.DERIVED_DATA)
+    warmup.run(force=True)
+    stats = warmup.stats()
+    for source, blocks in (stats['prewarmed'] or {}).items():
+        if blocks is not None:
+            print(f"{source}: {sum(blocks.values())} blocks in {len(blocks)} relations prewarmed")
+    if stats['warmed_by'] == 'other worker':
+        print("Responses were warmed by a running app worker")
+    for item in stats['urls']:
+        print(f"{item['status']} {item['cache'] or '-':5} {item['seconds']:7.3f}s {item['url']}")
+    print(f"Warmup done in {stats['seconds']}s")
+    if stats['errors']:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
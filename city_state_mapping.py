@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+City -> state lookup for the pheno_new distribution (pheno_new)
+
+pheno_new stations are historical place names without a state. The mapping
+in static/city_to_state_mapping.json is kept in the pheno_new table
+
+    city_state_mapping (city, state)
+
+so mv_year_state_distribution (pheno_new_distribution.sql) can aggregate
+observations per year and state in the database. Names are matched as
+stored; each city is loaded in NFC and, where it differs, NFD form, so
+station names imported in either normalisation map like the NFC lookup the
+app used to do. Stations without a mapping keep their name as state.
+
+The import (import_to_pheno_new.py) syncs the table; after editing the JSON
+run this script, which syncs it and refreshes the view.
+
+Usage:
+    python3 city_state_mapping.py            # sync + refresh mv_year_state_distribution
+    python3 city_state_mapping.py --check    # only report differences
+"""
+
+import argparse
+import json
+import os
+import sys
+import unicodedata
+
+import psycopg2
+
+import materialized_views
+
+DATABASE = 'pheno_new'
+
+MAPPING_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'city_to_state_mapping.json')
+
+VIEW = 'mv_year_state_distribution'
+
+CREATE_MAPPING_TABLE = """
+    CREATE TABLE IF NOT EXISTS city_state_mapping (
+        city TEXT PRIMARY KEY,
+        state TEXT NOT NULL
+    )
+"""
+
+
+def load_mapping(path=MAPPING_FILE):
+    """{city: state} from the JSON file, every city in NFC and NFD form"""
+    with open(path, 'r', encoding='utf-8') as f:
+        raw_mapping = json.load(f)
+    mapping = {}
+    for city, state in raw_mapping.items():
+        for form in ('NFC', 'NFD'):
+            mapping[unicodedata.normalize(form, city)] = state
+    return mapping
+
+
+def sync_mapping(conn, mapping=None, dry_run=False):
+    """
+    Make city_state_mapping equal to `mapping` (default: the JSON file)
+
+    Returns (cities added or changed, cities removed); the caller commits.
+    """
+    mapping = load_mapping() if mapping is None else mapping
+    cursor = conn.cursor()
+    cursor.execute(CREATE_MAPPING_TABLE)
+    cursor.execute("SELECT city, state FROM city_state_mapping")
+    stored = dict(cursor.fetchall())
+    changed = {city: state for city, state in mapping.items() if stored.get(city) != state}
+    removed = sorted(set(stored) - set(mapping))
+    if not dry_run:
+        for city, state in changed.items():
+            cursor.execute("""
+                INSERT INTO city_state_mapping (city, state) VALUES (%s, %s)
+                ON CONFLICT (city) DO UPDATE SET state = EXCLUDED.state
+            """, (city, state))
+        if removed:
+            cursor.execute("DELETE FROM city_state_mapping WHERE city = ANY(%s)", (removed,))
+    cursor.close()
+    return sorted(changed), removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--check', action='store_true', help='Report differences without changing anything')
+    args = parser.parse_args()
+
+    print(f"=== {DATABASE} ===")
+    try:
+        conn = materialized_views.connect(DATABASE)
+        changed, removed = sync_mapping(conn, dry_run=args.check)
+        conn.commit()
+        print(f"   {len(changed)} cities added or changed, {len(removed)} removed"
+              f"{' (not applied)' if args.check else ''}")
+        exists = VIEW in materialized_views.existing_views(conn.cursor())
+        conn.close()
+    except (psycopg2.Error, OSError, ValueError) as e:
+        print(f"{DATABASE}: failed: {str(e).strip()}")
+        sys.exit(1)
+    if args.check:
+        return
+    if not exists:
+        ok = materialized_views.create(DATABASE)
+    elif changed or removed:
+        ok = not materialized_views.refresh(DATABASE, [VIEW])
+    else:
+        ok = True
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Negotiated response compression (zstd, brotli, gzip)
+
+Large JSON responses such as /api/data-distribution-detailed (one object per
+station and year with repeated names, coordinates and states) compress very
+well but were sent as identity. Compressor picks the best encoding the client
+accepts, preferring zstd, then br, then gzip among those with the highest
+q-value, and compresses responses of at least `min_size` bytes:
+
+- an after_request hook compresses every eligible response (text, JSON, CSV,
+  NDJSON; not already encoded); streamed responses (NDJSON exports) are
+  compressed incrementally, whatever their size
+- ResponseCache asks for the negotiated encoding up front, so it can serve and
+  store compressed variants next to its identity entry and never compresses
+  the same cached body twice
+
+brotli and zstd need the optional packages `brotli` and `zstandard`; without
+them only gzip is offered. Every negotiated response carries
+Vary: Accept-Encoding, and ETags get an encoding suffix ("...-br") so strong
+validators stay unique per representation.
+
+Usage:
+    compressor = Compressor(min_size=1024)
+    compressor.init_app(app)
+"""
+
+import gzip
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Server preference for equal q-values
+PREFERENCE = ('zstd', 'br', 'gzip')
+
+DEFAULT_LEVELS = {'zstd': 10, 'br': 6, 'gzip': 6}
+
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/x-ndjson', 'application/javascript',
+                      'application/xml', 'image/svg+xml', 'application/msgpack',
+                      'application/vnd.apache.arrow.stream')
+
+
+def available_encodings():
+    """Encodings this process can produce, in preference order"""
+    modules = {'zstd': zstandard, 'br': brotli, 'gzip': gzip}
+    return tuple(encoding for encoding in PREFERENCE if modules[encoding] is not None)
+
+
+def compress(data, encoding, level):
+    if encoding == 'gzip':
+        # mtime=0: identical input gives identical bytes (cacheable, stable ETags)
+        return gzip.compress(data, compresslevel=level, mtime=0)
+    if encoding == 'br':
+        return brotli.compress(data, quality=level)
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    raise ValueError(f"Unsupported encoding: {encoding}")
+
+
+def stream_compressor(encoding, level):
+    """(compress(chunk), flush()) of an incremental compressor for streamed bodies"""
+    if encoding == 'gzip':
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits 16 + 15: gzip container
+        return compressor.compress, compressor.flush
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=level)
+        return compressor.process, compressor.finish
+    if encoding == 'zstd':
+        compressor = zstandard.ZstdCompressor(level=level).compressobj()
+        return compressor.compress, compressor.flush
+    raise ValueError(f"Unsupported encoding: {encoding}")
+
+
+def compress_stream(chunks, encoding, level):
+    """Compress an iterable of body chunks, closing it when done"""
+    compress_chunk, flush = stream_compressor(encoding, level)
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            data = compress_chunk(chunk)
+            if data:
+                yield data
+        yield flush()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+def is_compressible(response):
+    content_type = response.mimetype or ''
+    return content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+class Compressor:
+    """Content-Encoding negotiation and compression for a Flask app"""
+
+    def __init__(self, min_size=1024, levels=None, encodings=None):
+        """
+        Args:
+            min_size: Smaller bodies are sent uncompressed
+            levels: {encoding: level} overriding DEFAULT_LEVELS
+            encodings: Enabled encodings (default: all available)
+        """
+        self.min_size = min_size
+        self.levels = {**DEFAULT_LEVELS, **(levels or {})}
+        self.encodings = tuple(e for e in available_encodings() if encodings is None or e in encodings)
+
+    def init_app(self, app):
+        app.after_request(self.after_request)
+
+    def negotiate(self):
+        """Best encoding for the current request, None for identity"""
+        accepted = request.accept_encodings
+        best, best_quality = None, 0
+        for encoding in self.encodings:
+            quality = accepted[encoding]
+            if quality > best_quality:
+                best, best_quality = encoding, quality
+        return best
+
+    def compress(self, data, encoding):
+        return compress(data, encoding, self.levels[encoding])
+
+    def eligible(self, response):
+        """True when a response may be replaced by a compressed variant"""
+        return (response.status_code == 200 and not response.is_streamed and not response.direct_passthrough
+                and 'Content-Encoding' not in response.headers and is_compressible(response))
+
+    def apply(self, response, encoding, data):
+        """Turn `response` into the `encoding` variant with the compressed body `data`"""
+        response.set_data(data)
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag:
+            response.set_etag(f"{etag}-{encoding}", weak=weak)
+        return response
+
+    def after_request(self, response):
+        if not self.encodings:
+            return response
+        if response.is_streamed:
+            return self._compress_stream(response)
+        if not self.eligible(response):
+            return response
+        response.vary.add('Accept-Encoding')
+        body = response.get_data()
+        if len(body) < self.min_size:
+            return response
+        encoding = self.negotiate()
+        if encoding:
+            self.apply(response, encoding, self.compress(body, encoding))
+        return response
+
+    def _compress_stream(self, response):
+        if (response.status_code != 200 or response.direct_passthrough
+                or 'Content-Encoding' in response.headers or not is_compressible(response)):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = self.negotiate()
+        if encoding:
+            response.response = compress_stream(response.response, encoding, self.levels[encoding])
+            response.headers['Content-Encoding'] = encoding
+            response.headers.pop('Content-Length', None)
+        return response
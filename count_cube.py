@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+In-memory station x species x phase count cube
+
+The station/species/phase dropdowns of the timeline page call nine small
+endpoints (species-by-phase, station-species, phase-stations, ...) that each
+ran a GROUP BY over the 17M-row dwd_observation on every selection change.
+The dimensions are small (about 1000 stations x 100 species x 50 phases and
+far fewer populated combinations), so the whole answer space fits in memory:
+
+    (station_id, species_id, phase_id) ->
+        observation count, first year, last year, day_of_year sum and count
+
+One cube is kept per database and per worker process. It is built from the
+trend cube (create_trend_cube.sql) when available, otherwise from
+dwd_observation, together with the species/phase/station dimension rows the
+endpoints return (shared with the observation endpoints through
+dimension_cache.DimensionCache). Every endpoint is then a roll-up over the
+cells of one dimension value.
+
+Data changes are detected with dimension_cache.table_fingerprint, checked at
+most every `check_interval` seconds; the cube is rebuilt when it differs.
+"""
+
+import threading
+import time
+from decimal import ROUND_HALF_UP, Decimal, localcontext
+
+import psycopg2
+
+from dimension_cache import dimension_key, table_fingerprint
+
+# Dimension columns returned by the endpoints (the cache holds full rows)
+ROW_COLUMNS = {
+    'station': ['id', 'station_name', 'state', 'latitude', 'longitude'],
+    'species': ['id', 'species_name_de', 'species_name_en', 'species_name_la'],
+    'phase': ['id', 'phase_name_de', 'phase_name_en'],
+}
+
+CELLS_FROM_TREND_CUBE = """
+    SELECT station_id, species_id, phase_id,
+           SUM(observation_count), MIN(reference_year), MAX(reference_year),
+           SUM(doy_sum), SUM(doy_count)
+    FROM mv_trend_cube
+    GROUP BY station_id, species_id, phase_id
+"""
+
+CELLS_FROM_OBSERVATIONS = """
+    SELECT station_id, species_id, phase_id,
+           COUNT(*), MIN(reference_year), MAX(reference_year),
+           SUM(day_of_year), COUNT(day_of_year)
+    FROM dwd_observation
+    GROUP BY station_id, species_id, phase_id
+"""
+
+CELL_TABLES = ['dwd_observation', 'mv_trend_cube']
+
+# AVG / STDDEV_SAMP of day_of_year come back from PostgreSQL as numeric with 16
+# decimals (JSON: a string); the values derived from sums keep that representation
+NUMERIC_SCALE = Decimal('1e-16')
+
+
+def average_day_of_year(doy_sum, doy_count):
+    """AVG(day_of_year) from its sum and count, as PostgreSQL returns it (None without values)"""
+    if not doy_count:
+        return None
+    with localcontext() as context:
+        context.prec = 40
+        return (Decimal(doy_sum) / Decimal(doy_count)).quantize(NUMERIC_SCALE, ROUND_HALF_UP)
+
+
+def stddev_day_of_year(doy_sum, doy_sum_sq, doy_count):
+    """STDDEV_SAMP(day_of_year) from the sum, sum of squares and count (None below two values)"""
+    if not doy_count or doy_count < 2:
+        return None
+    with localcontext() as context:
+        context.prec = 40
+        doy_sum, doy_count = Decimal(doy_sum), Decimal(doy_count)
+        variance = (Decimal(doy_sum_sq) * doy_count - doy_sum * doy_sum) / (doy_count * (doy_count - 1))
+        return max(variance, Decimal(0)).sqrt().quantize(NUMERIC_SCALE, ROUND_HALF_UP)
+
+
+# Cell tuple layout
+STATION, SPECIES, PHASE, COUNT, FIRST_YEAR, LAST_YEAR, DOY_SUM, DOY_COUNT = range(8)
+DIMENSION_INDEX = {'station': STATION, 'species': SPECIES, 'phase': PHASE}
+
+
+class CountCube:
+    """Station x species x phase counts of one database, loaded lazily and kept in sync"""
+
+    def __init__(self, source, connection, dimensions, check_interval=30.0):
+        """
+        Args:
+            source: Database name ('pheno' or 'pheno_new')
+            connection: Callable returning a connection context manager (e.g. pool.connection)
+            dimensions: DimensionCache of the same database
+            check_interval: Seconds between data-change checks
+        """
+        self.source = source
+        self.connection = connection
+        self.dimensions = dimensions
+        self.check_interval = check_interval
+
+        self._lock = threading.Lock()
+        self._fingerprint = None
+        self._checked_at = 0.0
+        self._loaded_at = None
+        self._load_seconds = None
+        self._built_from = None
+        self._cell_count = 0
+        # dimension -> {key: [cells]}, replaced as a whole on reload
+        self._index = {name: {} for name in DIMENSION_INDEX}
+
+    def _load(self, conn, fingerprint):
+        cursor = conn.cursor()
+        started = time.monotonic()
+
+        try:
+            cursor.execute(CELLS_FROM_TREND_CUBE)
+            built_from = 'mv_trend_cube'
+        except psycopg2.errors.UndefinedTable:
+            conn.rollback()
+            cursor.execute(CELLS_FROM_OBSERVATIONS)
+            built_from = 'dwd_observation'
+
+        index = {name: {} for name in DIMENSION_INDEX}
+        cell_count = 0
+        for station_id, species_id, phase_id, count, first_year, last_year, doy_sum, doy_count in cursor:
+            cell = (dimension_key(station_id), dimension_key(species_id), dimension_key(phase_id), int(count),
+                    first_year, last_year, int(doy_sum or 0), int(doy_count or 0))
+            for name, position in DIMENSION_INDEX.items():
+                index[name].setdefault(cell[position], []).append(cell)
+            cell_count += 1
+        cursor.close()
+
+        self._index = index
+        self._cell_count = cell_count
+        self._built_from = built_from
+        self._fingerprint = fingerprint
+        self._loaded_at = time.time()
+        self._load_seconds = time.monotonic() - started
+        print(f"Count cube ({self.source}) loaded: {cell_count} cells from {built_from} "
+              f"in {self._load_seconds:.2f}s")
+
+    def ensure_fresh(self):
+        """Load the cube on first use and reload it when the data fingerprint changes
+
+        Returns the current cell index.
+        """
+        if self._fingerprint is not None and time.monotonic() - self._checked_at < self.check_interval:
+            return self._index
+        with self._lock:
+            if self._fingerprint is not None and time.monotonic() - self._checked_at < self.check_interval:
+                return self._index
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                fingerprint = table_fingerprint(cursor, CELL_TABLES)
+                cursor.close()
+                if fingerprint != self._fingerprint:
+                    self._load(conn, fingerprint)
+            self._checked_at = time.monotonic()
+            return self._index
+
+    def invalidate(self):
+        """Force a reload on the next access"""
+        with self._lock:
+            self._fingerprint = None
+
+    def rollup(self, group_by, index=None, **filters):
+        """
+        Aggregate the cells matching `filters` (dimension -> id) per value of `group_by`
+
+        Returns {group key: [count, first_year, last_year, doy_sum, doy_count, station keys]}
+        """
+        if index is None:
+            index = self.ensure_fresh()
+        filters = {name: dimension_key(value) for name, value in filters.items() if value is not None}
+        if filters:
+            # Scan the smallest candidate list
+            candidates = min((index[name].get(value, []) for name, value in filters.items()), key=len)
+        else:
+            candidates = [cell for cells in index['station'].values() for cell in cells]
+        checks = [(DIMENSION_INDEX[name], value) for name, value in filters.items()]
+        position = DIMENSION_INDEX[group_by]
+
+        groups = {}
+        for cell in candidates:
+            if any(cell[i] != value for i, value in checks):
+                continue
+            group = groups.get(cell[position])
+            if group is None:
+                groups[cell[position]] = [cell[COUNT], cell[FIRST_YEAR], cell[LAST_YEAR],
+                                          cell[DOY_SUM], cell[DOY_COUNT], {cell[STATION]}]
+                continue
+            group[0] += cell[COUNT]
+            if cell[FIRST_YEAR] is not None and (group[1] is None or cell[FIRST_YEAR] < group[1]):
+                group[1] = cell[FIRST_YEAR]
+            if cell[LAST_YEAR] is not None and (group[2] is None or cell[LAST_YEAR] > group[2]):
+                group[2] = cell[LAST_YEAR]
+            group[3] += cell[DOY_SUM]
+            group[4] += cell[DOY_COUNT]
+            group[5].add(cell[STATION])
+        return groups
+
+    def _rows(self, group_by, filters, fields, rename_id=None):
+        """Join a roll-up with its dimension rows, ordered by observation count (descending)"""
+        dimension = self.dimensions.snapshot().tables[group_by]
+        columns = ROW_COLUMNS[group_by]
+        rows = []
+        for key, (count, first_year, last_year, doy_sum, doy_count, stations) in self.rollup(group_by, **filters).items():
+            info = dimension.get(key)
+            if info is None:
+                # Same as the INNER JOIN on the dimension table
+                continue
+            row = {column: info[column] for column in columns}
+            if rename_id:
+                row[rename_id] = row.pop('id')
+            row['observation_count'] = count
+            if 'station_count' in fields:
+                row['station_count'] = len(stations)
+            if 'years' in fields:
+                row['first_year'] = first_year
+                row['last_year'] = last_year
+            if 'avg_day_of_year' in fields:
+                row['avg_day_of_year'] = average_day_of_year(doy_sum, doy_count)
+            rows.append(row)
+        rows.sort(key=lambda row: row['observation_count'], reverse=True)
+        return rows
+
+    # Endpoint views -------------------------------------------------------
+
+    def species_by_phase(self, phase_id):
+        snapshot = self.dimensions.snapshot()
+        rows = []
+        for row in self._rows('species', {'phase': phase_id}, ('station_count', 'years')):
+            # LEFT JOIN dwd_species_group: one row per group (pheno_new has no groups)
+            for group_name in snapshot.groups(row['id']) or [None]:
+                rows.append({**row, 'group_name': group_name})
+        return rows
+
+    def species_phases(self, species_id):
+        return self._rows('phase', {'species': species_id}, ('years', 'avg_day_of_year'), rename_id='phase_id')
+
+    def station_species(self, station_id, phase_id=None):
+        return self._rows('species', {'station': station_id, 'phase': phase_id}, ())
+
+    def station_phases(self, station_id, species_id=None, rename_id=None):
+        return self._rows('phase', {'station': station_id, 'species': species_id}, (), rename_id=rename_id)
+
+    def stations(self, species_id=None, phase_id=None):
+        return self._rows('station', {'species': species_id, 'phase': phase_id}, ())
+
+    def stats(self):
+        return {
+            'source': self.source,
+            'loaded': self._fingerprint is not None,
+            'loaded_at': self._loaded_at,
+            'load_seconds': self._load_seconds,
+            'built_from': self._built_from,
+            'cells': self._cell_count,
+        }
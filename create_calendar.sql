@@ -0,0 +1,51 @@
+-- 日历维度表（pheno 和 pheno_new 两个数据库都需要执行）
+-- 把 (年份, 年积日) 映射到日期、月份、ISO 周和季节，闰年按实际日历处理
+-- 月份/季节分布直接 JOIN 这张表分组，不再在每一行上用 CASE 按非闰年边界分月
+-- 需要先运行 migrate_typed_columns.py（reference_year / day_of_year 为 smallint）
+-- 可重复执行：已有的行保持不变
+
+-- 1. 月份维度：季节按气象季节划分（12-2 月为冬季）
+CREATE TABLE IF NOT EXISTS dim_month (
+    month SMALLINT PRIMARY KEY,
+    season TEXT NOT NULL,
+    season_order SMALLINT NOT NULL
+);
+
+INSERT INTO dim_month (month, season, season_order)
+SELECT m,
+       CASE WHEN m IN (12, 1, 2) THEN 'winter' WHEN m <= 5 THEN 'spring' WHEN m <= 8 THEN 'summer' ELSE 'autumn' END,
+       CASE WHEN m IN (12, 1, 2) THEN 1 WHEN m <= 5 THEN 2 WHEN m <= 8 THEN 3 ELSE 4 END
+FROM generate_series(1, 12) m
+ON CONFLICT (month) DO NOTHING;
+
+-- 2. 日历维度：1600-2199 年的每一天
+CREATE TABLE IF NOT EXISTS dim_calendar (
+    year SMALLINT NOT NULL,
+    day_of_year SMALLINT NOT NULL,
+    date DATE NOT NULL,
+    month SMALLINT NOT NULL REFERENCES dim_month(month),
+    iso_year SMALLINT NOT NULL,
+    iso_week SMALLINT NOT NULL,
+    season TEXT NOT NULL,
+    -- 主键即 JOIN 键 (reference_year, day_of_year)；INCLUDE 分组用的列，分组时只读索引
+    PRIMARY KEY (year, day_of_year) INCLUDE (month, iso_week, season)
+);
+
+INSERT INTO dim_calendar (year, day_of_year, date, month, iso_year, iso_week, season)
+SELECT
+    EXTRACT(YEAR FROM d)::smallint,
+    EXTRACT(DOY FROM d)::smallint,
+    d::date,
+    EXTRACT(MONTH FROM d)::smallint,
+    EXTRACT(ISOYEAR FROM d)::smallint,
+    EXTRACT(WEEK FROM d)::smallint,
+    m.season
+FROM generate_series(DATE '1600-01-01', DATE '2199-12-31', INTERVAL '1 day') d
+JOIN dim_month m ON m.month = EXTRACT(MONTH FROM d)
+ON CONFLICT DO NOTHING;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_dim_calendar_date ON dim_calendar(date);
+
+-- VACUUM 设置可见性映射，使 JOIN 可以走 index-only scan
+VACUUM ANALYZE dim_month;
+VACUUM ANALYZE dim_calendar;
@@ -12,6 +12,18 @@ CREATE INDEX IF NOT EXISTS idx_observation_quality ON dwd_observation(quality_le
 CREATE INDEX IF NOT EXISTS idx_observation_species_phase ON dwd_observation(species_id, phase_id);
 CREATE INDEX IF NOT EXISTS idx_observation_year_station ON dwd_observation(reference_year, station_id);
 
+-- 观测数据分页（keyset）索引，与 /api/observations 的排序一致
+-- 没有年份的行排在最后（按 -32768 排序，相当于 NULLS LAST，但条件仍可走索引）
+-- 旧版本的索引直接按 reference_year 排序，与查询不一致，先删除再重建
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_indexes WHERE indexname = 'idx_observation_keyset'
+               AND indexdef NOT LIKE '%COALESCE%') THEN
+        DROP INDEX idx_observation_keyset;
+    END IF;
+END $$;
+CREATE INDEX IF NOT EXISTS idx_observation_keyset ON dwd_observation((COALESCE(reference_year, -32768)) DESC, day_of_year, id);
+
 -- 2. dwd_station 表的索引
 CREATE INDEX IF NOT EXISTS idx_station_state ON dwd_station(state);
 CREATE INDEX IF NOT EXISTS idx_station_area ON dwd_station(area);
@@ -1,5 +1,10 @@
 -- 创建物化视图以加速常用查询
 -- 这些视图会预先计算好统计结果
+-- 视图定义由 materialized_views.py 统一管理（创建、重建、并发刷新）：
+--   python3 materialized_views.py create --database pheno
+-- 每个视图都有唯一索引（idx_*_key），以便 REFRESH MATERIALIZED VIEW CONCURRENTLY
+-- 运行 python3 incremental_aggregates.py install 后，这些视图变为同名普通表，
+-- 由触发器记录的增量维护（此处的查询仍是完整重算的定义）
 
 -- 1. 物种统计视图
 CREATE MATERIALIZED VIEW IF NOT EXISTS mv_species_stats AS
@@ -13,8 +18,8 @@ FROM dwd_species s
 LEFT JOIN dwd_observation o ON s.id = o.species_id
 GROUP BY s.id, s.species_name_de, s.species_name_en, s.species_name_la;
 
--- 为物化视图创建索引
-CREATE INDEX IF NOT EXISTS idx_mv_species_stats_id ON mv_species_stats(id);
+-- 为物化视图创建索引（唯一索引支持并发刷新）
+CREATE UNIQUE INDEX IF NOT EXISTS idx_mv_species_stats_key ON mv_species_stats(id);
 CREATE INDEX IF NOT EXISTS idx_mv_species_stats_count ON mv_species_stats(observation_count);
 
 -- 2. 站点统计视图
@@ -33,7 +38,7 @@ FROM dwd_station s
 LEFT JOIN dwd_observation o ON s.id = o.station_id
 GROUP BY s.id, s.station_name, s.latitude, s.longitude, s.altitude, s.state, s.area_group, s.area;
 
-CREATE INDEX IF NOT EXISTS idx_mv_station_stats_id ON mv_station_stats(id);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_mv_station_stats_key ON mv_station_stats(id);
 CREATE INDEX IF NOT EXISTS idx_mv_station_stats_count ON mv_station_stats(observation_count);
 
 -- 3. 物候期统计视图
@@ -47,13 +52,16 @@ FROM dwd_phase p
 LEFT JOIN dwd_observation o ON p.id = o.phase_id
 GROUP BY p.id, p.phase_name_de, p.phase_name_en;
 
-CREATE INDEX IF NOT EXISTS idx_mv_phase_stats_id ON mv_phase_stats(id);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_mv_phase_stats_key ON mv_phase_stats(id);
 CREATE INDEX IF NOT EXISTS idx_mv_phase_stats_count ON mv_phase_stats(observation_count);
 
--- 刷新所有物化视图
-REFRESH MATERIALIZED VIEW mv_species_stats;
-REFRESH MATERIALIZED VIEW mv_station_stats;
-REFRESH MATERIALIZED VIEW mv_phase_stats;
+-- 刷新所有物化视图（CONCURRENTLY：刷新期间仍可读取旧数据）
+REFRESH MATERIALIZED VIEW CONCURRENTLY mv_species_stats;
+REFRESH MATERIALIZED VIEW CONCURRENTLY mv_station_stats;
+REFRESH MATERIALIZED VIEW CONCURRENTLY mv_phase_stats;
+
+-- 通知应用：聚合数据已更新，使相关缓存失效（需要先运行 python3 data_version.py install）
+SELECT bump_data_version('aggregates');
 
 -- 显示物化视图大小
 SELECT
@@ -0,0 +1,57 @@
+-- 趋势分析预聚合立方体（pheno 和 pheno_new 两个数据库都需要执行）
+-- /api/trends 直接从这里读取，不再对 dwd_observation 做 GROUP BY
+-- 需要先运行 migrate_typed_columns.py（day_of_year 为 smallint）
+-- 视图定义由 materialized_views.py 统一管理（按依赖顺序并发刷新）
+--
+-- 保存 day_of_year 的和、平方和与计数，平均值和标准差可以在任意汇总层级上精确合并
+
+-- 1. 站点级立方体：(species_id, phase_id, station_id, reference_year)
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_trend_cube AS
+SELECT
+    species_id,
+    phase_id,
+    station_id,
+    reference_year,
+    SUM(day_of_year)::bigint as doy_sum,
+    SUM(day_of_year::bigint * day_of_year) as doy_sum_sq,
+    COUNT(day_of_year) as doy_count,
+    COUNT(*) as observation_count
+FROM dwd_observation
+GROUP BY species_id, phase_id, station_id, reference_year;
+
+-- 唯一索引：支持 REFRESH MATERIALIZED VIEW CONCURRENTLY，也是按站点查询趋势的索引
+CREATE UNIQUE INDEX IF NOT EXISTS idx_mv_trend_cube_key
+    ON mv_trend_cube(species_id, phase_id, station_id, reference_year);
+
+-- 2. 全国汇总（不按站点筛选时使用），每个物种/物候期约 70 行
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_trend_national AS
+SELECT
+    species_id,
+    phase_id,
+    reference_year,
+    SUM(doy_sum)::bigint as doy_sum,
+    SUM(doy_sum_sq)::bigint as doy_sum_sq,
+    SUM(doy_count)::bigint as doy_count,
+    SUM(observation_count)::bigint as observation_count
+FROM mv_trend_cube
+GROUP BY species_id, phase_id, reference_year;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_mv_trend_national_key
+    ON mv_trend_national(species_id, phase_id, reference_year);
+
+-- 刷新（mv_trend_national 依赖 mv_trend_cube，必须按顺序刷新；CONCURRENTLY 不阻塞读取）
+REFRESH MATERIALIZED VIEW CONCURRENTLY mv_trend_cube;
+REFRESH MATERIALIZED VIEW CONCURRENTLY mv_trend_national;
+
+ANALYZE mv_trend_cube;
+ANALYZE mv_trend_national;
+
+-- 通知应用：聚合数据已更新，使相关缓存失效（需要先运行 python3 data_version.py install）
+SELECT bump_data_version('aggregates');
+
+-- 显示物化视图大小
+SELECT
+    matviewname as name,
+    pg_size_pretty(pg_relation_size(schemaname||'.'||matviewname)) as size
+FROM pg_matviews
+WHERE schemaname = 'public' AND matviewname IN ('mv_trend_cube', 'mv_trend_national');
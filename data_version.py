@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Data-version registry with LISTEN/NOTIFY push to the app workers
+
+Every database (pheno, pheno_new) keeps a small registry table
+
+    app_data_version (namespace, version, updated_at)
+
+with one counter per cache namespace:
+
+    observations  dwd_observation and the station/species/phase tables
+    aggregates    materialized views and the overview snapshot
+    annotations   transcription_annotations
+
+Writers bump the affected namespaces with bump_data_version(namespace), which
+also sends NOTIFY data_version. Imports, migrations, the materialized-view
+scripts and the annotation API do this. Each app worker runs a
+DataVersionListener: it LISTENs on every database and re-reads the registry
+on a notification (and every `poll_interval` seconds as a safety net). The
+response cache puts the versions of the namespaces an endpoint depends on
+into its keys, so a bump invalidates exactly those entries.
+
+Usage:
+    python3 data_version.py install [--database pheno|pheno_new]
+    python3 data_version.py bump observations aggregates --database pheno_new
+    python3 data_version.py show
+"""
+
+import argparse
+import os
+import select
+import sys
+import threading
+import time
+
+import psycopg2
+
+from db_config import DB_PARAMS
+
+DATABASES = ['pheno', 'pheno_new']
+
+NAMESPACES = ('observations', 'aggregates', 'annotations')
+
+CHANNEL = 'data_version'
+
+REGISTRY_DDL = """
+    CREATE TABLE IF NOT EXISTS app_data_version (
+        namespace TEXT PRIMARY KEY,
+        version BIGINT NOT NULL DEFAULT 1,
+        updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+
+    CREATE OR REPLACE FUNCTION bump_data_version(ns TEXT) RETURNS BIGINT AS $$
+    DECLARE
+        new_version BIGINT;
+    BEGIN
+        INSERT INTO app_data_version AS v (namespace) VALUES (ns)
+        ON CONFLICT (namespace) DO UPDATE SET version = v.version + 1, updated_at = now()
+        RETURNING version INTO new_version;
+        -- Delivered to the listeners when the transaction commits
+        PERFORM pg_notify('data_version', ns);
+        RETURN new_version;
+    END;
+    $$ LANGUAGE plpgsql;
+"""
+
+
+def install(conn):
+    """Create the registry table and bump_data_version() (idempotent)"""
+    cursor = conn.cursor()
+    cursor.execute(REGISTRY_DDL)
+    cursor.close()
+
+
+def bump(conn, *namespaces):
+    """Bump namespaces in the current transaction (the caller commits); returns {namespace: version}"""
+    unknown = set(namespaces) - set(NAMESPACES)
+    if unknown:
+        raise ValueError(f"Unknown data-version namespace(s): {', '.join(sorted(unknown))}")
+    cursor = conn.cursor()
+    cursor.execute("SELECT to_regproc('bump_data_version') IS NOT NULL")
+    if not cursor.fetchone()[0]:
+        install(conn)
+    versions = {}
+    for namespace in namespaces:
+        cursor.execute("SELECT bump_data_version(%s)", (namespace,))
+        versions[namespace] = cursor.fetchone()[0]
+    cursor.close()
+    return versions
+
+
+def read_versions(cursor):
+    """{namespace: (version, updated_at)} of one database, empty when the registry does not exist"""
+    try:
+        cursor.execute("SELECT namespace, version, updated_at FROM app_data_version")
+    except psycopg2.errors.UndefinedTable:
+        cursor.connection.rollback()
+        return {}
+    return {namespace: (version, updated_at) for namespace, version, updated_at in cursor.fetchall()}
+
+
+class DataVersionListener:
+    """Keeps the data versions of all databases current in one worker process"""
+
+    def __init__(self, configs, on_change=None, poll_interval=60.0, retry_interval=5.0):
+        """
+        Args:
+            configs: {source: psycopg2.connect kwargs}
+            on_change: Optional callable (source, changed namespaces) run on every change
+            poll_interval: Seconds between registry re-reads without notifications
+            retry_interval: Seconds to wait before reconnecting after an error
+        """
+        self.configs = configs
+        self.on_change = on_change
+        self.poll_interval = poll_interval
+        self.retry_interval = retry_interval
+
+        self._lock = threading.Lock()
+        self._pid = None
+        self._versions = {source: {} for source in configs}
+        self._updated = {source: {} for source in configs}
+        self._loaded = set()
+        self._connected = {source: False for source in configs}
+        self._notifications = 0
+
+    def start(self):
+        """Start the listener threads once per process (safe to call on every request)"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # Threads do not survive fork(): a worker starts its own
+            self._pid = os.getpid()
+            for source in self.configs:
+                threading.Thread(target=self._run, args=(source,), daemon=True,
+                                 name=f"data-version-{source}").start()
+
+    def _update(self, source, registry):
+        versions = {namespace: version for namespace, (version, _updated) in registry.items()}
+        with self._lock:
+            previous = self._versions[source]
+            self._versions[source] = versions
+            self._updated[source] = {namespace: updated for namespace, (_version, updated) in registry.items()}
+            first_load = source not in self._loaded
+            self._loaded.add(source)
+        changed = {ns for ns in set(previous) | set(versions) if previous.get(ns) != versions.get(ns)}
+        if changed and not first_load and self.on_change:
+            try:
+                self.on_change(source, changed)
+            except Exception as e:
+                print(f"Data version callback failed ({source}): {e}")
+
+    def _run(self, source):
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(**self.configs[source])
+                conn.autocommit = True
+                cursor = conn.cursor()
+                cursor.execute(f"LISTEN {CHANNEL}")
+                self._connected[source] = True
+                self._update(source, read_versions(cursor))
+                while True:
+                    readable, _, _ = select.select([conn], [], [], self.poll_interval)
+                    if readable:
+                        conn.poll()
+                        if not conn.notifies:
+                            continue
+                        self._notifications += len(conn.notifies)
+                        conn.notifies.clear()
+                    self._update(source, read_versions(cursor))
+            except Exception as e:
+                print(f"Data version listener error ({source}): {e}")
+            finally:
+                self._connected[source] = False
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+            time.sleep(self.retry_interval)
+
+    def key(self, namespaces):
+        """Version tag of the given namespaces over all databases, for cache keys"""
+        with self._lock:
+            return ';'.join(
+                f"{source}:" + ','.join(str(self._versions[source].get(ns, 0)) for ns in namespaces)
+                for source in sorted(self._versions)
+            )
+
+    def ready(self):
+        """True when the versions of every database are known and being listened to"""
+        with self._lock:
+            return self._loaded.issuperset(self.configs) and all(self._connected.values())
+
+    def last_modified(self, namespaces):
+        """Latest change time of the given namespaces over all databases, or None"""
+        with self._lock:
+            times = [updated[ns] for updated in self._updated.values() for ns in namespaces if ns in updated]
+        return max(times) if times else None
+
+    def stats(self):
+        with self._lock:
+            return {
+                'versions': {source: dict(versions) for source, versions in self._versions.items()},
+                'connected': dict(self._connected),
+                'notifications': self._notifications,
+            }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['install', 'bump', 'show'])
+    parser.add_argument('namespaces', nargs='*', help='Namespaces to bump')
+    parser.add_argument('--database', choices=DATABASES, help='Only this database')
+    args = parser.parse_args()
+
+    if args.command == 'bump' and not args.namespaces:
+        parser.error('bump needs at least one namespace')
+
+    for database in ([args.database] if args.database else DATABASES):
+        try:
+            conn = psycopg2.connect(database=database, **DB_PARAMS)
+            if args.command == 'install':
+                install(conn)
+                print(f"{database}: registry installed")
+            elif args.command == 'bump':
+                print(f"{database}: {bump(conn, *args.namespaces)}")
+            else:
+                versions = read_versions(conn.cursor())
+                print(f"{database}: " + (', '.join(f"{ns}={version} ({updated:%Y-%m-%d %H:%M:%S})"
+                                                   for ns, (version, updated) in sorted(versions.items()))
+                                         or 'no registry'))
+            conn.commit()
+            conn.close()
+        except (psycopg2.Error, ValueError) as e:
+            print(f"{database}: failed: {e}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
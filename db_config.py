@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+"""
+PostgreSQL connection settings shared by the app and the scripts
+
+The app, the import scripts and the maintenance CLIs (migrations, snapshot,
+data versions, materialized views) all connect with these parameters, so they
+always reach the same server with the same credentials. The standard libpq
+variables PGHOST, PGPORT, PGUSER and PGPASSWORD override the defaults for all
+of them.
+
+Usage:
+    from db_config import DB_PARAMS, db_config
+
+    psycopg2.connect(**db_config('pheno'))
+    psycopg2.connect(database='pheno_new', **DB_PARAMS)
+"""
+
+import os
+
+DB_PARAMS = {
+    'host': os.environ.get('PGHOST', 'localhost'),
+    'user': os.environ.get('PGUSER', 'postgres'),
+    'password': os.environ.get('PGPASSWORD', '9417941'),
+    'port': os.environ.get('PGPORT', '5432'),
+}
+
+
+def db_config(database):
+    """Connection parameters of `database` (pheno / pheno_new)"""
+    return {**DB_PARAMS, 'database': database}
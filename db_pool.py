@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+Connection pooling for the pheno and pheno_new PostgreSQL databases
+
+Opening a psycopg2 connection costs a TCP handshake, authentication and a
+backend fork on the server. The Flask app used to pay that on every request
+(often twice), and leaked connections whenever an error path skipped
+conn.close(). This module keeps a small pool of open connections per database:
+
+- min/max pool size, connections are opened lazily on first use
+- checkout timeout: callers wait for a free connection instead of failing
+- liveness check: connections idle for a while are pinged before reuse,
+  broken connections are discarded and replaced
+- fork safety: a pool inherited from a gunicorn master process is reset
+  in the worker instead of sharing sockets
+- context-managed checkout that always rolls back and returns the connection
+
+Usage:
+    pool = ConnectionPool('pheno', DB_CONFIG, minconn=1, maxconn=10)
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        ...
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions
+
+
+class PoolTimeoutError(Exception):
+    """Raised when no connection becomes available within the checkout timeout"""
+
+
+class ConnectionPool:
+    """Thread-safe pool of psycopg2 connections for one database"""
+
+    def __init__(self, name, config, minconn=1, maxconn=10, timeout=10.0,
+                 check_idle=30.0, max_lifetime=3600.0):
+        """
+        Args:
+            name: Pool name used in statistics (e.g. 'pheno')
+            config: Keyword arguments for psycopg2.connect
+            minconn: Number of connections kept open once the pool is used
+            maxconn: Upper bound of open connections
+            timeout: Seconds to wait for a free connection before giving up
+            check_idle: Connections idle longer than this are pinged before reuse
+            max_lifetime: Connections older than this are closed on return
+        """
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError(f"Invalid pool size: minconn={minconn}, maxconn={maxconn}")
+
+        self.name = name
+        self.config = dict(config)
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.check_idle = check_idle
+        self.max_lifetime = max_lifetime
+
+        self._cond = threading.Condition()
+        self._reset_state()
+
+    def _reset_state(self):
+        """(Re)initialise the pool state for the current process"""
+        self._pid = os.getpid()
+        self._idle = []         # [(conn, last_used, created_at)], used as a LIFO stack
+        self._created_at = {}   # id(conn) -> creation time, for connections owned by the pool
+        self._size = 0          # open connections plus slots reserved for connections being opened
+        self._waiting = 0
+        self._closed_at = float('-inf')  # closeall() time; connections created before it are closed on return
+        self._counters = {
+            'connections_opened': 0,
+            'connections_closed': 0,
+            'connect_errors': 0,
+            'checkouts': 0,
+            'checkout_waits': 0,
+            'checkout_timeouts': 0,
+            'failed_health_checks': 0,
+            'wait_time_total': 0.0,
+        }
+
+    def _check_pid(self):
+        """Forget connections inherited through fork(); must be called with the lock held"""
+        if self._pid != os.getpid():
+            # Do not close the inherited sockets: that would terminate the
+            # parent's sessions. Dropping the references is enough.
+            self._reset_state()
+
+    def _connect(self):
+        try:
+            conn = psycopg2.connect(**self.config)
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._counters['connect_errors'] += 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._created_at[id(conn)] = time.monotonic()
+            self._counters['connections_opened'] += 1
+        return conn
+
+    def _close(self, conn):
+        """Close a connection owned by the pool and release its slot"""
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            if self._created_at.pop(id(conn), None) is not None:
+                self._size -= 1
+                self._counters['connections_closed'] += 1
+            self._cond.notify()
+
+    def _is_alive(self, conn, last_used):
+        """Cheap liveness check, only pings connections that sat idle for a while"""
+        if conn.closed:
+            return False
+        if time.monotonic() - last_used < self.check_idle:
+            return True
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.close()
+            conn.rollback()
+            return True
+        except Exception:
+            with self._cond:
+                self._counters['failed_health_checks'] += 1
+            return False
+
+    def _fill(self):
+        """Open connections until the pool holds at least minconn"""
+        while True:
+            with self._cond:
+                self._check_pid()
+                if self._size >= self.minconn:
+                    return
+                self._size += 1
+            conn = self._connect()
+            with self._cond:
+                self._idle.append((conn, time.monotonic(), self._created_at[id(conn)]))
+                self._cond.notify()
+
+    def getconn(self, timeout=None):
+        """Check out a connection, waiting up to `timeout` seconds for a free one"""
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        started = time.monotonic()
+        waited = False
+
+        while True:
+            with self._cond:
+                self._check_pid()
+                while not self._idle and self._size >= self.maxconn:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._counters['checkout_timeouts'] += 1
+                        raise PoolTimeoutError(
+                            f"No connection available in pool '{self.name}' after {timeout:.1f}s "
+                            f"({self._size} of {self.maxconn} in use)"
+                        )
+                    waited = True
+                    self._waiting += 1
+                    try:
+                        self._cond.wait(remaining)
+                    finally:
+                        self._waiting -= 1
+                    self._check_pid()
+
+                if self._idle:
+                    conn, last_used, _created = self._idle.pop()
+                else:
+                    conn = None
+                    self._size += 1
+
+            if conn is None:
+                conn = self._connect()
+            elif not self._is_alive(conn, last_used):
+                self._close(conn)
+                continue
+
+            with self._cond:
+                self._counters['checkouts'] += 1
+                if waited:
+                    self._counters['checkout_waits'] += 1
+                    self._counters['wait_time_total'] += time.monotonic() - started
+            return conn
+
+    def putconn(self, conn, discard=False):
+        """Return a connection to the pool, rolling back any open transaction"""
+        with self._cond:
+            owned = id(conn) in self._created_at and self._pid == os.getpid()
+        if not owned:
+            # Connection from before a fork or not from this pool
+            try:
+                conn.close()
+            except Exception:
+                pass
+            return
+
+        if not discard and not conn.closed:
+            try:
+                if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Exception:
+                discard = True
+
+        with self._cond:
+            created = self._created_at.get(id(conn), time.monotonic())
+            retired = created <= self._closed_at
+        expired = self.max_lifetime and time.monotonic() - created > self.max_lifetime
+        if discard or conn.closed or expired or retired:
+            self._close(conn)
+            return
+
+        with self._cond:
+            self._idle.append((conn, time.monotonic(), created))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self, timeout=None, optional=False):
+        """
+        Context-managed checkout. The connection is always returned to the pool;
+        uncommitted work is rolled back, broken connections are discarded.
+
+        Args:
+            timeout: Checkout timeout in seconds (defaults to the pool timeout)
+            optional: Yield None instead of raising when no connection can be obtained
+        """
+        try:
+            self._fill()
+            conn = self.getconn(timeout)
+        except (psycopg2.Error, PoolTimeoutError) as e:
+            if not optional:
+                raise
+            print(f"Database connection error ({self.name}): {e}")
+            yield None
+            return
+
+        discard = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            discard = True
+            raise
+        finally:
+            self.putconn(conn, discard=discard or conn.closed)
+
+    def closeall(self):
+        """Close all idle connections (checked-out ones are closed on return)"""
+        with self._cond:
+            self._check_pid()
+            self._closed_at = time.monotonic()
+            idle, self._idle = self._idle, []
+        for conn, _last_used, _created in idle:
+            self._close(conn)
+
+    def stats(self):
+        """Snapshot of the pool state and counters"""
+        with self._cond:
+            self._check_pid()
+            counters = dict(self._counters)
+            checkouts = counters['checkouts']
+            return {
+                'name': self.name,
+                'database': self.config.get('database'),
+                'pid': self._pid,
+                'minconn': self.minconn,
+                'maxconn': self.maxconn,
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+                'waiting': self._waiting,
+                **counters,
+                'avg_wait_ms': (counters['wait_time_total'] / counters['checkout_waits'] * 1000)
+                if counters['checkout_waits'] else 0.0,
+                'reuse_ratio': (1 - counters['connections_opened'] / checkouts) if checkouts else None,
+            }
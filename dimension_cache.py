@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Process-local cache of the station, species and phase dimension tables
+
+Observation queries used to join dwd_station, dwd_species and dwd_phase on
+every request, and for pheno_new each join went through a
+SELECT DISTINCT ON (id) ... ORDER BY id subquery because those tables contain
+duplicate rows. The tables are tiny and almost static, so each worker keeps
+them in memory per database (deduplicated by id) and endpoints decorate rows
+read from dwd_observation alone.
+
+Reloads are version based: a fingerprint of the tables (file node and
+pg_stat_user_tables write counters, see table_fingerprint) is compared at most
+every `check_interval` seconds and the tables are read again when it changed.
+
+Usage:
+    dimensions = DimensionCache('pheno_new', pool.connection)
+    snapshot = dimensions.snapshot()
+    station = snapshot.get('station', row['station_id'])
+"""
+
+import threading
+import time
+
+# (table, columns) per dimension
+DIMENSION_TABLES = {
+    'station': ('dwd_station', ['id', 'station_name', 'latitude', 'longitude', 'altitude',
+                                'state', 'area_group', 'area']),
+    'species': ('dwd_species', ['id', 'species_name_de', 'species_name_en', 'species_name_la']),
+    'phase': ('dwd_phase', ['id', 'phase_name_de', 'phase_name_en']),
+}
+
+FINGERPRINT_QUERY = """
+    SELECT c.relname, pg_relation_filenode(c.oid), s.n_tup_ins, s.n_tup_upd, s.n_tup_del
+    FROM pg_class c
+    LEFT JOIN pg_stat_user_tables s ON s.relid = c.oid
+    WHERE c.relkind IN ('r', 'm') AND c.relname = ANY(%s)
+    ORDER BY c.relname
+"""
+
+
+def dimension_key(value):
+    """Dimension ids are compared as text (request args are strings, pheno_new ids are text)"""
+    return None if value is None else str(value)
+
+
+def table_fingerprint(cursor, tables):
+    """Version of the given tables: changes on every write, TRUNCATE or REFRESH"""
+    cursor.execute(FINGERPRINT_QUERY, (list(tables),))
+    return tuple(cursor.fetchall())
+
+
+class DimensionSnapshot:
+    """Immutable view of the dimension tables of one database at one version"""
+
+    def __init__(self, tables, species_groups, version):
+        self.tables = tables                  # dimension -> {key: row dict}
+        self.species_groups = species_groups  # species key -> [group_name, ...]
+        self.version = version
+
+    def get(self, name, value):
+        """Row of dimension `name` with id `value`, or None"""
+        return self.tables[name].get(dimension_key(value))
+
+    def groups(self, species_id):
+        return self.species_groups.get(dimension_key(species_id), [])
+
+
+class DimensionCache:
+    """Station/species/phase rows of one database, loaded lazily and reloaded on change"""
+
+    def __init__(self, source, connection, check_interval=30.0, species_groups=False):
+        """
+        Args:
+            source: Database name ('pheno' or 'pheno_new')
+            connection: Callable returning a connection context manager (e.g. pool.connection)
+            check_interval: Seconds between version checks
+            species_groups: Also load dwd_species_group (only used for pheno)
+        """
+        self.source = source
+        self.connection = connection
+        self.check_interval = check_interval
+        self.species_groups = species_groups
+
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._checked_at = 0.0
+        self._loaded_at = None
+        self._reloads = 0
+
+    def _tables(self):
+        tables = [table for table, _columns in DIMENSION_TABLES.values()]
+        return tables + ['dwd_species_group'] if self.species_groups else tables
+
+    def _load(self, cursor, version):
+        tables = {}
+        for name, (table, columns) in DIMENSION_TABLES.items():
+            # First row per id, same as SELECT DISTINCT ON (id) ... ORDER BY id
+            cursor.execute(f"SELECT {', '.join(columns)} FROM {table} ORDER BY id")
+            rows = {}
+            for row in cursor.fetchall():
+                rows.setdefault(dimension_key(row[0]), dict(zip(columns, row)))
+            tables[name] = rows
+
+        species_groups = {}
+        if self.species_groups:
+            cursor.execute("SELECT species_id, group_name FROM dwd_species_group")
+            for species_id, group_name in cursor.fetchall():
+                species_groups.setdefault(dimension_key(species_id), []).append(group_name)
+
+        self._snapshot = DimensionSnapshot(tables, species_groups, version)
+        self._loaded_at = time.time()
+        self._reloads += 1
+
+    def snapshot(self):
+        """Current DimensionSnapshot, (re)loading it first when needed"""
+        if self._snapshot is not None and time.monotonic() - self._checked_at < self.check_interval:
+            return self._snapshot
+        with self._lock:
+            if self._snapshot is not None and time.monotonic() - self._checked_at < self.check_interval:
+                return self._snapshot
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                version = table_fingerprint(cursor, self._tables())
+                if self._snapshot is None or version != self._snapshot.version:
+                    self._load(cursor, version)
+                cursor.close()
+            self._checked_at = time.monotonic()
+            return self._snapshot
+
+    def invalidate(self):
+        """Force a version check on the next access"""
+        with self._lock:
+            self._checked_at = 0.0
+
+    def stats(self):
+        snapshot = self._snapshot
+        return {
+            'source': self.source,
+            'loaded': snapshot is not None,
+            'loaded_at': self._loaded_at,
+            'reloads': self._reloads,
+            'rows': {name: len(rows) for name, rows in snapshot.tables.items()} if snapshot else {},
+        }
@@ -12,8 +12,20 @@ Coordinates are provided here through:
 
 Data source: /Users/puzhen/Downloads/Forstämter 5.shp
 Coordinate system: WGS84 (EPSG:4326)
+
+Lookups go through a normalised index (LocationIndex) built once from
+LOCATION_COORDINATES and an LRU memo, so their cost does not grow with the
+number of known places. Call rebuild_index() after changing the table.
 """
 
+import bisect
+import functools
+import threading
+import unicodedata
+
+# Distinct normalised names kept in the lookup memo
+LOOKUP_CACHE_SIZE = 4096
+
 # =============================================================================
 # PHENO_NEW DATABASE LOCATION COORDINATES
 # =============================================================================
@@ -114,59 +126,179 @@ LOCATION_COORDINATES = {
     "Unknown": {"lat": 49.4000, "lon": 11.7000},
 }
 
+class LocationIndex:
+    """
+    Normalised lookup structure over a {name: {"lat", "lon"}} table
+
+    Names are compared NFC-normalised, stripped and casefolded. A name that
+    is not known exactly is matched partially, as before: the first known
+    name (in table order) that is contained in it or that contains it.
+    Both directions avoid scanning the table:
+
+    - known name in query: an Aho-Corasick automaton over all known names,
+      one walk over the query
+    - query in known name: one str.find over all known names joined with a
+      separator, the offset is mapped back to the name by bisection
+    """
+
+    SEPARATOR = '\x00'
+
+    def __init__(self, coordinates):
+        self.names = []      # normalised names in table order
+        self.coords = []     # (lat, lon) per name
+        self.exact = {}      # normalised name -> position of its first entry
+        for name, coords in coordinates.items():
+            key = normalize_name(name)
+            if not key or key in self.exact:
+                continue
+            self.exact[key] = len(self.names)
+            self.names.append(key)
+            self.coords.append((coords["lat"], coords["lon"]))
+        self._build_automaton()
+        self.joined = self.SEPARATOR.join(self.names)
+        self.offsets = []
+        offset = 0
+        for key in self.names:
+            self.offsets.append(offset)
+            offset += len(key) + 1
+
+    def _build_automaton(self):
+        # goto[node]: {char: node}; best[node]: first (lowest) name position ending at node or its suffixes
+        goto = [{}]
+        best = [None]
+        for position, key in enumerate(self.names):
+            node = 0
+            for char in key:
+                if char not in goto[node]:
+                    goto.append({})
+                    best.append(None)
+                    goto[node][char] = len(goto) - 1
+                node = goto[node][char]
+            if best[node] is None:
+                best[node] = position
+        fail = [0] * len(goto)
+        queue = list(goto[0].values())
+        for node in queue:
+            for char, child in goto[node].items():
+                state = fail[node]
+                while state and char not in goto[state]:
+                    state = fail[state]
+                fail[child] = goto[state][char] if char in goto[state] and goto[state][char] != child else 0
+                inherited = best[fail[child]]
+                if inherited is not None and (best[child] is None or inherited < best[child]):
+                    best[child] = inherited
+                queue.append(child)
+        self.goto = goto
+        self.fail = fail
+        self.best = best
+
+    def _first_contained(self, key):
+        """Position of the first known name occurring in `key`, or None"""
+        goto, fail, best = self.goto, self.fail, self.best
+        node = 0
+        found = None
+        for char in key:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if best[node] is not None and (found is None or best[node] < found):
+                found = best[node]
+        return found
+
+    def _first_containing(self, key):
+        """Position of the first known name containing `key`, or None"""
+        if self.SEPARATOR in key:
+            return None
+        offset = self.joined.find(key)
+        if offset < 0:
+            return None
+        return bisect.bisect_right(self.offsets, offset) - 1
+
+    def lookup(self, key):
+        """(lat, lon) for a normalised name, or None"""
+        if not key:
+            return None
+        position = self.exact.get(key)
+        if position is None:
+            candidates = [p for p in (self._first_contained(key), self._first_containing(key)) if p is not None]
+            if not candidates:
+                return None
+            position = min(candidates)
+        return self.coords[position]
+
+
+def normalize_name(name):
+    """Comparison form of a location name: NFC, stripped, casefolded"""
+    return unicodedata.normalize('NFC', name).strip().casefold()
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def rebuild_index(coordinates=None):
+    """(Re)build the index, e.g. after adding names to LOCATION_COORDINATES; clears the memo"""
+    global _index
+    with _index_lock:
+        _index = LocationIndex(LOCATION_COORDINATES if coordinates is None else coordinates)
+        _lookup.cache_clear()
+    return _index
+
+
+@functools.lru_cache(maxsize=LOOKUP_CACHE_SIZE)
+def _lookup(key):
+    index = _index or rebuild_index()
+    return index.lookup(key)
+
+
+def _result(name, coords):
+    return {
+        "name": name,
+        "latitude": coords[0],
+        "longitude": coords[1]
+    }
+
+
 def geocode_location(location_name):
     """
     Convert a location name to coordinates
-    
+
     Args:
         location_name: Name of the location
-        
+
     Returns:
         dict: {"name": location_name, "latitude": lat, "longitude": lon} or None if not found
     """
     if not location_name:
         return None
-    
-    # Clean up location name
-    location_clean = location_name.strip()
-    
-    # Direct lookup
-    if location_clean in LOCATION_COORDINATES:
-        coords = LOCATION_COORDINATES[location_clean]
-        return {
-            "name": location_clean,
-            "latitude": coords["lat"],
-            "longitude": coords["lon"]
-        }
-    
-    # Try partial matches for compound names
-    for known_loc, coords in LOCATION_COORDINATES.items():
-        if known_loc in location_clean or location_clean in known_loc:
-            return {
-                "name": location_clean,
-                "latitude": coords["lat"],
-                "longitude": coords["lon"]
-            }
-    
+    coords = _lookup(normalize_name(location_name))
     # If not found, return None (we won't show unknown locations on map)
-    return None
+    return _result(location_name.strip(), coords) if coords else None
+
 
-def geocode_locations(location_list):
+def geocode_locations(location_list, skip_missing=True):
     """
-    Geocode a list of locations
-    
+    Geocode a list of locations, every distinct name resolved once
+
     Args:
         location_list: List of location names
-        
+        skip_missing: Leave out names without coordinates; with False the
+            result is aligned with location_list and has None for them
+
     Returns:
         list: List of geocoded locations with coordinates
     """
+    resolved = {}
     geocoded = []
     for location in location_list:
-        result = geocode_location(location)
-        if result:
-            geocoded.append(result)
-    
+        key = normalize_name(location) if location else ''
+        if key not in resolved:
+            resolved[key] = _lookup(key) if key else None
+        coords = resolved[key]
+        if coords:
+            geocoded.append(_result(location.strip(), coords))
+        elif not skip_missing:
+            geocoded.append(None)
     return geocoded
 
 # For testing
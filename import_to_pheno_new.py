@@ -4,23 +4,18 @@ from datetime import datetime
 import re
 import uuid
 import os
+import hashlib
+from overview_snapshot import refresh_snapshot
+from data_version import bump
+from migrate_dedupe_pheno_new import station_name_key
+from city_state_mapping import sync_mapping
+import materialized_views
+from db_config import db_config
 
-# 数据库连接参数
-conn_params_old = {
-    'host': 'localhost',
-    'database': 'pheno',
-    'user': 'postgres',
-    'password': '',
-    'port': '5432'
-}
+# 数据库连接参数（与应用共用，见 db_config.py）
+conn_params_old = db_config('pheno')
 
-conn_params_new = {
-    'host': 'localhost',
-    'database': 'pheno_new',
-    'user': 'postgres',
-    'password': '',
-    'port': '5432'
-}
+conn_params_new = db_config('pheno_new')
 
 # 物候期列名映射到phase_id
 phenophase_mapping = {
@@ -67,20 +62,60 @@ def parse_date(date_str, year=None):
     
     return None
 
+def stable_station_id(prefix, station_key):
+    """由站点标识生成稳定的ID（hash() 每个进程随机化，不能用于持久化的ID）"""
+    digest = hashlib.sha1(station_key.encode('utf-8')).hexdigest()[:12]
+    return f"{prefix}_{digest}"
+
 def get_station_from_description(description, location=None):
     """从站点描述中提取或创建站点ID"""
     if pd.isna(description):
         # Use location as fallback if description is missing
         if location and not pd.isna(location):
-            station_key = str(location)
-            station_id = f"LOC_{abs(hash(station_key)) % 1000:03d}"
-            return station_id
+            return stable_station_id('LOC', str(location))
         return 'HIST_001'  # 默认历史站点ID
     
     # 简化描述作为站点标识
     station_key = description[:50] if len(description) > 50 else description
     # 生成一个基于描述的伪ID
-    station_id = f"HIST_{abs(hash(station_key)) % 1000:03d}"
+    return stable_station_id('HIST', station_key)
+
+def load_existing_stations(cursor):
+    """
+    已有站点：(站点名 -> 规范ID, 别名ID -> 规范ID, 已有ID -> 站点名)
+
+    重新导入时同名站点沿用 migrate_dedupe_pheno_new.py 选定的规范ID
+    """
+    cursor.execute("SELECT id, station_name FROM dwd_station WHERE id IS NOT NULL ORDER BY id")
+    by_name = {}
+    names = {}
+    for station_id, name in cursor.fetchall():
+        names.setdefault(station_id, name)
+        key = station_name_key(name)
+        if key is not None:
+            by_name.setdefault(key, station_id)
+    aliases = {}
+    cursor.execute("SELECT to_regclass('dwd_station_alias') IS NOT NULL")
+    if cursor.fetchone()[0]:
+        cursor.execute("SELECT alias_id, station_id FROM dwd_station_alias")
+        aliases = dict(cursor.fetchall())
+    return by_name, aliases, names
+
+def resolve_station_id(station_id, station_name, existing):
+    """新算出的ID经别名表映射到规范ID；与其他地点的已有ID冲突时改用完整摘要"""
+    by_name, aliases, names = existing
+    key = station_name_key(station_name)
+    if key is not None and key in by_name:
+        return by_name[key]
+    station_id = aliases.get(station_id, station_id)
+    if station_id in names and station_name_key(names[station_id]) != key:
+        prefix = station_id.split('_', 1)[0]
+        full = hashlib.sha1(f"{station_id}/{station_name}".encode('utf-8')).hexdigest()
+        station_id = f"{prefix}_{full}"
+    # 本次导入新建的站点也参与后续的匹配
+    names.setdefault(station_id, station_name)
+    if key is not None:
+        by_name.setdefault(key, station_id)
     return station_id
 
 def main():
@@ -161,13 +196,20 @@ def main():
     unique_locations = csv_df[['Location', 'Genaue Bezeichnung der Standorte']].drop_duplicates()
     station_mapping = {}
     location_to_station = {}
+    existing_stations = load_existing_stations(cursor_new)
     
     for i, row in unique_locations.iterrows():
         location = row['Location']
         station_desc = row['Genaue Bezeichnung der Standorte']
         
-        # Create station ID using both location and description
-        station_id = get_station_from_description(station_desc, location)
+        # Create station ID using both location and description; descriptions of
+        # an already known location share its station (one ID per physical station)
+        if pd.notna(location) and location in location_to_station:
+            station_id = location_to_station[location]
+        else:
+            station_id = resolve_station_id(get_station_from_description(station_desc, location),
+                                            location if pd.notna(location) else "Unknown",
+                                            existing_stations)
         
         # Map both description and location to station ID
         if pd.notna(station_desc):
@@ -324,6 +366,22 @@ def main():
     print(f"   物种数: {total_species}")
     print(f"   站点数: {total_stations}")
     
+    # 同步地名 -> 州映射表（distribution 页面按州统计用）
+    changed, removed = sync_mapping(conn_new)
+    conn_new.commit()
+    print(f"   地名映射已同步: {len(changed)} 条新增/修改, {len(removed)} 条删除")
+
+    # 刷新 pheno_new 的物化视图（distribution 统计、趋势立方体），使新数据立即可见
+    failed = materialized_views.refresh('pheno_new')
+    if failed:
+        print("   部分视图未刷新，请运行 python3 materialized_views.py create --database pheno_new")
+
+    # 刷新首页统计快照，并通知应用使缓存失效
+    refresh_snapshot(conn_old, conn_new)
+    print("   首页统计快照已刷新")
+    bump(conn_new, 'observations')
+    conn_new.commit()
+    
     # 关闭连接
     cursor_old.close()
     cursor_new.close()
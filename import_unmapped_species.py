@@ -2,15 +2,13 @@ import pandas as pd
 import psycopg2
 from datetime import datetime
 import re
+from overview_snapshot import refresh_snapshot
+from data_version import bump
+import materialized_views
+from db_config import db_config
 
-# 数据库连接参数
-conn_params = {
-    'host': 'localhost',
-    'database': 'pheno_new',
-    'user': 'postgres',
-    'password': '',
-    'port': '5432'
-}
+# 数据库连接参数（与应用共用，见 db_config.py）
+conn_params = db_config('pheno_new')
 
 # 物候期列映射
 phenophase_mapping = {
@@ -297,6 +295,21 @@ def main():
         for row in cursor.fetchall():
             print(f"     ID={row[0]}: {row[1]} ({row[2]}) - {row[3]}条观测")
     
+    # 刷新 pheno_new 的物化视图（distribution 统计、趋势立方体），使新物种立即可见
+    failed = materialized_views.refresh('pheno_new')
+    if failed:
+        print("   部分视图未刷新，请运行 python3 materialized_views.py create --database pheno_new")
+
+    # 刷新首页统计快照（存放在 pheno 数据库中）
+    conn_pheno = psycopg2.connect(**db_config('pheno'))
+    refresh_snapshot(conn_pheno, conn)
+    conn_pheno.close()
+    print("   首页统计快照已刷新")
+
+    # 通知应用使缓存失效
+    bump(conn, 'observations')
+    conn.commit()
+
     cursor.close()
     conn.close()
     
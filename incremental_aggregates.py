@@ -0,0 +1,524 @@
+#!/usr/bin/env python3
+"""
+Incremental maintenance of the observation count aggregates (pheno)
+
+The station, species, phase, station-yearly and distribution aggregates
+(create_materialized_views.sql, optimize_distribution.sql) are COUNTs over
+dwd_observation. As materialized views every refresh recounted all 17M rows,
+even after an import that added one year. With incremental maintenance:
+
+- statement-level triggers on dwd_observation (transition tables) write the
+  change of every INSERT / UPDATE / DELETE / COPY, already grouped, to
+
+      dwd_observation_delta (station_id, species_id, phase_id, reference_year,
+                             month, row_count, id_count, full_rebuild)
+
+  (negative counts for removed rows); TRUNCATE and changes to the station,
+  species and phase tables only flag a full rebuild
+- the aggregates are regular tables under the view names, so the app reads
+  them unchanged; apply() claims the pending deltas and adds them to the
+  affected rows (new keys inserted, emptied keys removed), so its cost
+  depends on the size of the change, not of dwd_observation
+- mv_coverage_stats becomes a view over agg_observation_keys, a maintained
+  count per year / station / species / phase
+
+install converts the materialized views into such tables (built from the
+definitions in the SQL files in one snapshot, then swapped in);
+materialized_views.py refresh applies the deltas instead of refreshing them,
+and uninstall goes back to materialized views. The trend cube views keep
+their concurrent refresh.
+
+Usage:
+    python3 incremental_aggregates.py install
+    python3 incremental_aggregates.py apply        # also run by materialized_views.py refresh
+    python3 incremental_aggregates.py rebuild      # full recount, e.g. after a bulk rewrite
+    python3 incremental_aggregates.py status
+    python3 incremental_aggregates.py uninstall    # then: python3 materialized_views.py create
+"""
+
+import argparse
+import sys
+import time
+
+import psycopg2
+
+import materialized_views
+from data_version import bump
+
+DATABASE = 'pheno'
+
+DELTA_TABLE = 'dwd_observation_delta'
+
+# Serialises apply and rebuild over all processes
+LOCK_KEY = "hashtext('incremental_aggregates')"
+
+CAPTURE_DDL = """
+    CREATE TABLE IF NOT EXISTS dwd_observation_delta (
+        id BIGSERIAL PRIMARY KEY,
+        station_id TEXT,
+        species_id TEXT,
+        phase_id TEXT,
+        reference_year SMALLINT,
+        month INT,
+        row_count BIGINT NOT NULL DEFAULT 0,
+        id_count BIGINT NOT NULL DEFAULT 0,
+        full_rebuild BOOLEAN NOT NULL DEFAULT false
+    );
+
+    CREATE OR REPLACE FUNCTION capture_observation_delta() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            INSERT INTO dwd_observation_delta (station_id, species_id, phase_id, reference_year, month,
+                                               row_count, id_count)
+            SELECT station_id, species_id, phase_id, reference_year::smallint, EXTRACT(MONTH FROM date)::int,
+                   COUNT(*), COUNT(id)
+            FROM new_rows
+            GROUP BY 1, 2, 3, 4, 5;
+        END IF;
+        IF TG_OP IN ('DELETE', 'UPDATE') THEN
+            INSERT INTO dwd_observation_delta (station_id, species_id, phase_id, reference_year, month,
+                                               row_count, id_count)
+            SELECT station_id, species_id, phase_id, reference_year::smallint, EXTRACT(MONTH FROM date)::int,
+                   -COUNT(*), -COUNT(id)
+            FROM old_rows
+            GROUP BY 1, 2, 3, 4, 5;
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION flag_aggregate_rebuild() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO dwd_observation_delta (full_rebuild) VALUES (true);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS observation_delta_insert ON dwd_observation;
+    CREATE TRIGGER observation_delta_insert AFTER INSERT ON dwd_observation
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION capture_observation_delta();
+
+    DROP TRIGGER IF EXISTS observation_delta_update ON dwd_observation;
+    CREATE TRIGGER observation_delta_update AFTER UPDATE ON dwd_observation
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION capture_observation_delta();
+
+    DROP TRIGGER IF EXISTS observation_delta_delete ON dwd_observation;
+    CREATE TRIGGER observation_delta_delete AFTER DELETE ON dwd_observation
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION capture_observation_delta();
+
+    DROP TRIGGER IF EXISTS observation_delta_truncate ON dwd_observation;
+    CREATE TRIGGER observation_delta_truncate AFTER TRUNCATE ON dwd_observation
+        FOR EACH STATEMENT EXECUTE FUNCTION flag_aggregate_rebuild();
+"""
+
+# Aggregates that copy columns of these tables need a recount when they change
+DIMENSION_TABLES = ['dwd_station', 'dwd_species', 'dwd_phase']
+
+CAPTURE_TRIGGERS = ['observation_delta_insert', 'observation_delta_update', 'observation_delta_delete',
+                    'observation_delta_truncate']
+
+# Claimed deltas, one row per key (the `d` of the delta queries)
+CLAIM_DELTAS = """
+    CREATE TEMPORARY TABLE observation_delta (
+        station_id TEXT,
+        species_id TEXT,
+        phase_id TEXT,
+        reference_year SMALLINT,
+        month INT,
+        row_count BIGINT,
+        id_count BIGINT
+    ) ON COMMIT DROP;
+
+    -- Rebuild flags committed after pending() stay in the log for the next apply()
+    WITH claimed AS (
+        DELETE FROM dwd_observation_delta WHERE NOT full_rebuild RETURNING *
+    )
+    INSERT INTO observation_delta
+    SELECT station_id, species_id, phase_id, reference_year, month, SUM(row_count), SUM(id_count)
+    FROM claimed
+    GROUP BY station_id, species_id, phase_id, reference_year, month
+    HAVING SUM(row_count) <> 0 OR SUM(id_count) <> 0;
+"""
+
+# Observations per year / station / species / phase; one pass with grouping sets
+KEY_COUNTS = """
+    SELECT dimension, key, observation_count
+    FROM (
+        SELECT
+            CASE GROUPING(reference_year, station_id, species_id, phase_id)
+                WHEN 7 THEN 'year' WHEN 11 THEN 'station' WHEN 13 THEN 'species' ELSE 'phase'
+            END as dimension,
+            COALESCE(reference_year::text, station_id, species_id, phase_id) as key,
+            {count}::bigint as observation_count
+        FROM {source}
+        GROUP BY GROUPING SETS ((reference_year), (station_id), (species_id), (phase_id))
+    ) k
+    WHERE key IS NOT NULL
+"""
+
+COVERAGE_VIEW = """
+    CREATE VIEW mv_coverage_stats AS
+    SELECT
+        1 as id,
+        MIN(CASE WHEN dimension = 'year' THEN key::smallint END) as min_year,
+        MAX(CASE WHEN dimension = 'year' THEN key::smallint END) as max_year,
+        COUNT(*) FILTER (WHERE dimension = 'station') as station_count,
+        COUNT(*) FILTER (WHERE dimension = 'species') as species_count,
+        COUNT(*) FILTER (WHERE dimension = 'phase') as phase_count
+    FROM agg_observation_keys
+    WHERE observation_count > 0
+"""
+
+
+class Summary:
+    """An aggregate table kept current by adding deltas"""
+
+    def __init__(self, name, keys, delta_query, keep_zero=False, full_query=None, indexes=()):
+        """
+        Args:
+            name: Table name (the materialized view it replaces keeps its name)
+            keys: Columns identifying a row
+            delta_query: Rows to add, computed from the claimed deltas `observation_delta d`
+            keep_zero: Keep rows whose count drops to 0 (dimension lists with LEFT JOIN)
+            full_query: Full definition; default: the view's query from the SQL files
+            indexes: (name, columns, unique) when not taken from the SQL files
+        """
+        self.name = name
+        self.keys = keys
+        self.delta_query = delta_query
+        self.keep_zero = keep_zero
+        self.full_query = full_query
+        self.indexes = list(indexes)
+
+
+SUMMARIES = [
+    Summary('mv_species_stats', ['id'], """
+        SELECT s.id, s.species_name_de, s.species_name_en, s.species_name_la,
+               SUM(d.id_count)::bigint as observation_count
+        FROM observation_delta d
+        JOIN dwd_species s ON s.id = d.species_id
+        GROUP BY s.id, s.species_name_de, s.species_name_en, s.species_name_la
+    """, keep_zero=True),
+    Summary('mv_station_stats', ['id'], """
+        SELECT s.id, s.station_name, s.latitude, s.longitude, s.altitude, s.state, s.area_group, s.area,
+               SUM(d.id_count)::bigint as observation_count
+        FROM observation_delta d
+        JOIN dwd_station s ON s.id = d.station_id
+        GROUP BY s.id, s.station_name, s.latitude, s.longitude, s.altitude, s.state, s.area_group, s.area
+    """, keep_zero=True),
+    Summary('mv_phase_stats', ['id'], """
+        SELECT p.id, p.phase_name_de, p.phase_name_en, SUM(d.id_count)::bigint as observation_count
+        FROM observation_delta d
+        JOIN dwd_phase p ON p.id = d.phase_id
+        GROUP BY p.id, p.phase_name_de, p.phase_name_en
+    """, keep_zero=True),
+    Summary('mv_station_yearly_stats', ['station_id', 'reference_year'], """
+        SELECT s.id as station_id, s.station_name, s.latitude, s.longitude, s.state, s.area, d.reference_year,
+               SUM(d.id_count)::bigint as observation_count
+        FROM observation_delta d
+        JOIN dwd_station s ON d.station_id = s.id
+        WHERE s.latitude IS NOT NULL AND s.longitude IS NOT NULL
+        GROUP BY s.id, s.station_name, s.latitude, s.longitude, s.state, s.area, d.reference_year
+    """),
+    Summary('mv_year_state_distribution', ['year', 'state'], """
+        SELECT d.reference_year as year, s.state, SUM(d.id_count)::bigint as observation_count
+        FROM observation_delta d
+        JOIN dwd_station s ON d.station_id = s.id
+        GROUP BY d.reference_year, s.state
+    """),
+    Summary('mv_year_month_distribution', ['year', 'month'], """
+        SELECT d.reference_year as year, d.month, SUM(d.id_count)::bigint as observation_count
+        FROM observation_delta d
+        WHERE d.month IS NOT NULL
+        GROUP BY d.reference_year, d.month
+    """),
+    Summary('agg_observation_keys', ['dimension', 'key'],
+            KEY_COUNTS.format(count='SUM(row_count)', source='observation_delta'),
+            full_query=KEY_COUNTS.format(count='COUNT(*)', source='dwd_observation'),
+            indexes=[('idx_agg_observation_keys_key', 'dimension, key', True)]),
+]
+
+# Replaced by a view over agg_observation_keys
+COVERAGE = 'mv_coverage_stats'
+
+MANAGED_NAMES = {summary.name for summary in SUMMARIES} | {COVERAGE}
+
+REBUILD_SUFFIX = '__rebuild'
+
+RELATION_KINDS = {'r': 'TABLE', 'v': 'VIEW', 'm': 'MATERIALIZED VIEW'}
+
+
+def relation_kind(cursor, name):
+    """'TABLE', 'VIEW', 'MATERIALIZED VIEW' or None"""
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (name,))
+    row = cursor.fetchone()
+    return RELATION_KINDS.get(row[0]) if row else None
+
+
+def installed(cursor):
+    """True when the capture triggers exist on dwd_observation"""
+    cursor.execute("""
+        SELECT COUNT(*) FROM pg_trigger
+        WHERE tgrelid = to_regclass('dwd_observation') AND tgname = ANY(%s)
+    """, (CAPTURE_TRIGGERS,))
+    return cursor.fetchone()[0] == len(CAPTURE_TRIGGERS)
+
+
+def maintained(cursor):
+    """Names of the views that are currently maintained incrementally (empty when not installed)"""
+    if not installed(cursor):
+        return set()
+    names = {summary.name for summary in SUMMARIES if relation_kind(cursor, summary.name) == 'TABLE'}
+    if relation_kind(cursor, COVERAGE) == 'VIEW':
+        names.add(COVERAGE)
+    return names
+
+
+def pending(cursor):
+    """(pending delta rows, full rebuild flagged); (0, False) without a delta log"""
+    if not relation_kind(cursor, DELTA_TABLE):
+        return 0, False
+    cursor.execute(f"SELECT COUNT(*), COALESCE(bool_or(full_rebuild), false) FROM {DELTA_TABLE}")
+    return cursor.fetchone()
+
+
+def _full_queries(database):
+    definitions = materialized_views.load_definitions(database)
+    queries = {}
+    for summary in SUMMARIES:
+        if summary.full_query:
+            queries[summary.name] = (summary.full_query, summary.indexes)
+        else:
+            view = definitions[summary.name]
+            queries[summary.name] = (view.query, view.indexes)
+    return queries
+
+
+def _drop(cursor, name):
+    kind = relation_kind(cursor, name)
+    if kind:
+        cursor.execute(f"DROP {kind} {name}")
+
+
+def rebuild(conn, database=DATABASE):
+    """
+    Recount every aggregate from dwd_observation and discard the deltas it includes
+
+    The tables are built under temporary names in one REPEATABLE READ snapshot
+    and swapped in at the end, so readers only wait for the renames. Deltas
+    committed after the snapshot stay in the log for the next apply().
+    Returns the build time in seconds.
+    """
+    queries = _full_queries(database)
+    conn.set_session(isolation_level='REPEATABLE READ')
+    cursor = conn.cursor()
+    started = time.monotonic()
+    try:
+        cursor.execute(f"SELECT pg_advisory_xact_lock({LOCK_KEY})")
+        for summary in SUMMARIES:
+            query, indexes = queries[summary.name]
+            temporary = summary.name + REBUILD_SUFFIX
+            cursor.execute(f"DROP TABLE IF EXISTS {temporary}")
+            cursor.execute(f"CREATE TABLE {temporary} AS {query}")
+            for index, columns, unique in indexes:
+                cursor.execute(f"CREATE {'UNIQUE ' if unique else ''}INDEX {index}{REBUILD_SUFFIX} "
+                               f"ON {temporary}({columns})")
+            cursor.execute(f"ANALYZE {temporary}")
+        # Swap: the coverage view depends on agg_observation_keys, so it goes first
+        _drop(cursor, COVERAGE)
+        for summary in SUMMARIES:
+            _drop(cursor, summary.name)
+            cursor.execute(f"ALTER TABLE {summary.name}{REBUILD_SUFFIX} RENAME TO {summary.name}")
+            for index, _columns, _unique in queries[summary.name][1]:
+                cursor.execute(f"ALTER INDEX {index}{REBUILD_SUFFIX} RENAME TO {index}")
+        cursor.execute(COVERAGE_VIEW)
+        # Deltas visible in this snapshot are part of the new counts
+        cursor.execute(f"DELETE FROM {DELTA_TABLE}")
+        seconds = time.monotonic() - started
+        for name in sorted(MANAGED_NAMES):
+            materialized_views.record_refresh(cursor, name, seconds, False, incremental=False)
+        bump(conn, 'aggregates')
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.set_session(isolation_level='DEFAULT')
+        cursor.close()
+    return seconds
+
+
+def _match(keys, with_null):
+    """Delta row c -> table row t; with_null: only delta rows with a NULL key (not indexable)"""
+    if with_null:
+        return ('(' + ' OR '.join(f"c.{key} IS NULL" for key in keys) + ') AND '
+                + ' AND '.join(f"t.{key} IS NOT DISTINCT FROM c.{key}" for key in keys))
+    return ' AND '.join(f"t.{key} = c.{key}" for key in keys)
+
+
+def apply_summary(cursor, summary):
+    """Add the claimed deltas to one aggregate table; returns the number of changed keys"""
+    cursor.execute("DROP TABLE IF EXISTS summary_delta")
+    cursor.execute(f"CREATE TEMPORARY TABLE summary_delta ON COMMIT DROP AS {summary.delta_query}")
+    cursor.execute("SELECT * FROM summary_delta LIMIT 0")
+    columns = ', '.join(col.name for col in cursor.description)
+    values = ', '.join(f"c.{col.name}" for col in cursor.description)
+    cursor.execute("SELECT COUNT(*) FROM summary_delta")
+    changed = cursor.fetchone()[0]
+    if not changed:
+        return 0
+    # NULL keys (e.g. stations without state) cannot use the key index; they are matched separately
+    for with_null in (False, True):
+        match = _match(summary.keys, with_null)
+        cursor.execute(f"""
+            UPDATE {summary.name} t SET observation_count = t.observation_count + c.observation_count
+            FROM summary_delta c
+            WHERE {match}
+        """)
+        null_key = ' OR '.join(f"c.{key} IS NULL" for key in summary.keys)
+        cursor.execute(f"""
+            INSERT INTO {summary.name} ({columns})
+            SELECT {values} FROM summary_delta c
+            WHERE {'' if with_null else 'NOT '}({null_key})
+              AND NOT EXISTS (SELECT 1 FROM {summary.name} t WHERE {match})
+        """)
+        if not summary.keep_zero:
+            cursor.execute(f"""
+                DELETE FROM {summary.name} t
+                USING summary_delta c
+                WHERE {match} AND t.observation_count = 0
+            """)
+    return changed
+
+
+def apply(conn, database=DATABASE):
+    """
+    Apply the pending deltas to all aggregates in one transaction
+
+    Falls back to rebuild() when a full recount was flagged. Returns
+    (delta rows claimed, 'incremental' | 'rebuild' | None when nothing was pending).
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"SELECT pg_advisory_xact_lock({LOCK_KEY})")
+        rows, full_rebuild = pending(cursor)
+        if full_rebuild:
+            conn.rollback()
+            rebuild(conn, database)
+            return rows, 'rebuild'
+        if not rows:
+            conn.rollback()
+            return 0, None
+        started = time.monotonic()
+        cursor.execute(CLAIM_DELTAS)
+        claimed = cursor.rowcount
+        # A rebuild flagged since pending() is not claimed; recount now instead of applying
+        _rows, full_rebuild = pending(cursor)
+        if full_rebuild:
+            conn.rollback()
+            rebuild(conn, database)
+            return rows, 'rebuild'
+        for summary in SUMMARIES:
+            apply_summary(cursor, summary)
+        seconds = time.monotonic() - started
+        for name in sorted(MANAGED_NAMES):
+            materialized_views.record_refresh(cursor, name, seconds, False, incremental=True)
+        bump(conn, 'aggregates')
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    return rows, 'incremental' if claimed else None
+
+
+def install(conn, database=DATABASE):
+    """Create the delta log and triggers, then build the aggregate tables"""
+    cursor = conn.cursor()
+    materialized_views.install(conn)
+    cursor.execute(CAPTURE_DDL)
+    for table in DIMENSION_TABLES:
+        cursor.execute(f"DROP TRIGGER IF EXISTS {table}_aggregate_rebuild ON {table}")
+        cursor.execute(f"""
+            CREATE TRIGGER {table}_aggregate_rebuild AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table}
+                FOR EACH STATEMENT EXECUTE FUNCTION flag_aggregate_rebuild()
+        """)
+    # From here on every change is captured; the rebuild snapshot includes all earlier ones
+    conn.commit()
+    cursor.close()
+    return rebuild(conn, database)
+
+
+def uninstall(conn):
+    """Remove triggers, delta log and aggregate tables (recreate the views with materialized_views.py create)"""
+    cursor = conn.cursor()
+    for trigger in CAPTURE_TRIGGERS:
+        cursor.execute(f"DROP TRIGGER IF EXISTS {trigger} ON dwd_observation")
+    for table in DIMENSION_TABLES:
+        cursor.execute(f"DROP TRIGGER IF EXISTS {table}_aggregate_rebuild ON {table}")
+    cursor.execute("DROP FUNCTION IF EXISTS capture_observation_delta()")
+    cursor.execute("DROP FUNCTION IF EXISTS flag_aggregate_rebuild()")
+    cursor.execute(f"DROP TABLE IF EXISTS {DELTA_TABLE}")
+    if relation_kind(cursor, COVERAGE) == 'VIEW':
+        cursor.execute(f"DROP VIEW {COVERAGE}")
+    for summary in SUMMARIES:
+        if relation_kind(cursor, summary.name) == 'TABLE':
+            cursor.execute(f"DROP TABLE {summary.name}")
+    conn.commit()
+    cursor.close()
+
+
+def status(conn):
+    cursor = conn.cursor()
+    if not installed(cursor):
+        print("   not installed (aggregates are materialized views)")
+        return
+    rows, full_rebuild = pending(cursor)
+    print(f"   {rows} pending delta rows{', full rebuild flagged' if full_rebuild else ''}")
+    names = maintained(cursor)
+    for name in sorted(MANAGED_NAMES):
+        if name not in names:
+            print(f"   {name}: not maintained ({relation_kind(cursor, name) or 'missing'}), run rebuild")
+            continue
+        cursor.execute(f"SELECT COUNT(*) FROM {name}")
+        print(f"   {name}: {cursor.fetchone()[0]} rows")
+    cursor.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['install', 'apply', 'rebuild', 'status', 'uninstall'])
+    parser.add_argument('--database', default=DATABASE, help='Database holding the aggregates')
+    args = parser.parse_args()
+
+    print(f"=== {args.database} ===")
+    try:
+        conn = materialized_views.connect(args.database)
+        if args.command == 'install':
+            print(f"   installed, aggregates built in {install(conn, args.database):.1f}s")
+        elif args.command == 'apply':
+            started = time.monotonic()
+            rows, mode = apply(conn, args.database)
+            if mode == 'rebuild':
+                print(f"   full rebuild flagged, aggregates recounted in {time.monotonic() - started:.1f}s")
+            else:
+                print(f"   {rows} delta rows applied in {time.monotonic() - started:.2f}s")
+        elif args.command == 'rebuild':
+            print(f"   aggregates recounted in {rebuild(conn, args.database):.1f}s")
+        elif args.command == 'uninstall':
+            uninstall(conn)
+            print("   removed; run python3 materialized_views.py create")
+        else:
+            status(conn)
+        conn.close()
+    except (psycopg2.Error, KeyError) as e:
+        print(f"{args.database}: failed: {str(e).strip()}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Fast JSON serialisation for the API responses
+
+Flask's default provider encodes with the stdlib json module, and endpoints
+built one dict per row with dict_fetchall before that. On large result sets
+(observations, distributions) encoding cost more than the query. This module
+provides:
+
+- Rows: query rows kept as cursor tuples plus one column header. It encodes
+  as the same list of objects dict_fetchall + jsonify produced; the objects
+  are only materialised inside the encoder.
+- OrjsonProvider: a Flask JSON provider backed by orjson, with Flask's
+  conventions for everything orjson does not handle natively (Decimal and
+  UUID as strings, dates as HTTP dates, sorted keys, indent in debug mode).
+  Non-ASCII text is written as UTF-8 instead of \\u escapes.
+- RowsJSONProvider: Flask's default provider plus Rows support, used when
+  orjson is not installed or JSON_PROVIDER=default.
+- RawJSON / raw_json_response: documents already encoded elsewhere (by
+  PostgreSQL) spliced into a response without decoding them.
+
+Usage:
+    init_json(app, os.environ.get('JSON_PROVIDER', 'orjson'))
+    return jsonify(fetch_rows(cursor))
+    return raw_json_response(app, {'pheno': RawJSON(document)})
+"""
+
+import itertools
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class Rows:
+    """Query result as (columns, row tuples), encoded as a list of objects"""
+
+    __slots__ = ('columns', 'rows')
+
+    def __init__(self, columns, rows):
+        self.columns = list(columns)
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        """Rows as dicts, for code that post-processes a result"""
+        return map(dict, map(zip, itertools.repeat(self.columns), self.rows))
+
+    def to_dicts(self):
+        return list(self)
+
+
+def fetch_rows(cursor):
+    """cursor.fetchall() with its column header, without building a dict per row"""
+    return Rows([col[0] for col in cursor.description], cursor.fetchall())
+
+
+def json_default(o):
+    """Encoder fallback: Rows as a list of objects, everything else as Flask does"""
+    if isinstance(o, Rows):
+        return o.to_dicts()
+    return DefaultJSONProvider.default(o)
+
+
+class RowsJSONProvider(DefaultJSONProvider):
+    """Flask's stdlib-json provider with Rows support"""
+
+    default = staticmethod(json_default)
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """orjson-backed provider producing the same documents as DefaultJSONProvider"""
+
+    default = staticmethod(json_default)
+
+    def _options(self, indent=False):
+        # Dates go through json_default so they keep Flask's HTTP date format
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return option
+
+    def dumps(self, obj, **kwargs):
+        # Formatting kwargs (separators) are implied: orjson output is compact
+        return orjson.dumps(obj, default=self.default, option=self._options(bool(kwargs.get('indent')))).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        body = orjson.dumps(obj, default=self.default, option=self._options(indent)) + b"\n"
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+class RawJSON(bytes):
+    """An encoded JSON value, copied into the output as is by raw_json_response"""
+
+
+def encode_with_raw(obj, dumps):
+    """Encode `obj` (dicts and lists may contain RawJSON values) with sorted keys, as bytes"""
+    if isinstance(obj, RawJSON):
+        return bytes(obj)
+    if isinstance(obj, dict):
+        return b'{' + b','.join(dumps(str(key)).encode() + b':' + encode_with_raw(value, dumps)
+                                for key, value in sorted(obj.items())) + b'}'
+    if isinstance(obj, (list, tuple)):
+        return b'[' + b','.join(encode_with_raw(value, dumps) for value in obj) + b']'
+    return dumps(obj).encode()
+
+
+def raw_json_response(app, obj):
+    """JSON response for a document containing RawJSON parts (same layout as jsonify)"""
+    body = encode_with_raw(obj, lambda value: app.json.dumps(value, separators=(',', ':')))
+    return app.response_class(body + b"\n", mimetype=app.json.mimetype)
+
+
+def init_json(app, name='orjson'):
+    """Install the JSON provider `name` ('orjson' or 'default') on `app`; returns the name used"""
+    if name == 'orjson' and orjson is None:
+        print("orjson is not installed, using the default JSON provider")
+        name = 'default'
+    provider = OrjsonProvider if name == 'orjson' else RowsJSONProvider
+    app.json_provider_class = provider
+    app.json = provider(app)
+    return name
@@ -0,0 +1,529 @@
+#!/usr/bin/env python3
+"""
+Materialized view lifecycle: create, rebuild and concurrent refresh
+
+The views the app reads are defined in the SQL files listed in SQL_FILES
+(CREATE MATERIALIZED VIEW and CREATE INDEX statements; the files can still be
+run with psql). This module reads those definitions and manages the views of
+both databases:
+
+    create    creates missing views with their indexes; with --rebuild a
+              view whose stored definition differs from the file is built
+              under a temporary name and swapped in, so readers keep the old
+              one until the rename
+    refresh   REFRESH MATERIALIZED VIEW CONCURRENTLY on the views (and
+              everything depending on them), independent views in parallel
+              on separate connections, a view only after the views it reads;
+              readers of the views and of dwd_observation are never blocked
+    status    definition, unique index, population and freshness per view
+
+Every view has a unique index on plain columns (idx_<view>_key), which
+CONCURRENTLY requires. A view without one is refreshed with a blocking
+REFRESH and reported. Each create/refresh is recorded in
+
+    app_materialized_view (name, refreshed_at, refresh_seconds, row_estimate, concurrent)
+
+(read_freshness(), served by /api/data-freshness), and the aggregates data
+version is bumped once at the end (see data_version.py). Tables the
+definitions read that have their own SQL file (SETUP_FILES, e.g. the calendar
+dimension) are created by create first when missing. Once
+incremental_aggregates.py is installed, the pheno count aggregates are tables
+fed from captured deltas: create leaves them alone and refresh applies the
+pending deltas instead of recounting them.
+
+Usage:
+    python3 materialized_views.py status
+    python3 materialized_views.py create [--rebuild] [--database pheno|pheno_new]
+    python3 materialized_views.py refresh [mv_trend_cube ...] [--jobs 3] [--database pheno]
+"""
+
+import argparse
+import os
+import re
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import psycopg2
+
+from data_version import bump
+from db_config import DB_PARAMS
+
+DATABASES = ['pheno', 'pheno_new']
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Definition file -> databases its views belong to
+SQL_FILES = {
+    'create_materialized_views.sql': ['pheno'],
+    'optimize_distribution.sql': ['pheno'],
+    'create_trend_cube.sql': ['pheno', 'pheno_new'],
+    'pheno_new_distribution.sql': ['pheno_new'],
+}
+
+# Setup file -> databases; run by create before the views when a table it creates is missing
+SETUP_FILES = {
+    'create_calendar.sql': ['pheno', 'pheno_new'],
+}
+
+# Memory for the sorts and hash aggregates of one refresh
+REFRESH_WORK_MEM = os.environ.get('REFRESH_WORK_MEM', '256MB')
+
+REGISTRY_DDL = """
+    CREATE TABLE IF NOT EXISTS app_materialized_view (
+        name TEXT PRIMARY KEY,
+        refreshed_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        refresh_seconds REAL,
+        row_estimate BIGINT,
+        concurrent BOOLEAN NOT NULL DEFAULT false,
+        incremental BOOLEAN NOT NULL DEFAULT false
+    );
+    ALTER TABLE app_materialized_view ADD COLUMN IF NOT EXISTS incremental BOOLEAN NOT NULL DEFAULT false
+"""
+
+VIEW_PATTERN = re.compile(r'CREATE\s+MATERIALIZED\s+VIEW\s+IF\s+NOT\s+EXISTS\s+(\w+)\s+AS\s+(.*)', re.I | re.S)
+TABLE_PATTERN = re.compile(r'CREATE\s+TABLE\s+IF\s+NOT\s+EXISTS\s+(\w+)', re.I)
+INDEX_PATTERN = re.compile(r'CREATE\s+(UNIQUE\s+)?INDEX\s+IF\s+NOT\s+EXISTS\s+(\w+)\s+ON\s+(\w+)\s*\((.*)\)', re.I | re.S)
+
+REBUILD_SUFFIX = '__rebuild'
+
+
+class ViewDefinition:
+    """One materialized view from a SQL file"""
+
+    def __init__(self, name, query, source_file):
+        self.name = name
+        self.query = query
+        self.source_file = source_file
+        self.indexes = []  # (name, columns, unique)
+        self.depends = set()
+
+    @property
+    def key_index(self):
+        """The unique index REFRESH ... CONCURRENTLY relies on, or None"""
+        for name, columns, unique in self.indexes:
+            if unique and re.fullmatch(r'\w+(\s*,\s*\w+)*', columns):
+                return name
+        return None
+
+
+def _statements(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        sql = re.sub(r'--[^\n]*', '', f.read())
+    return [statement.strip() for statement in sql.split(';') if statement.strip()]
+
+
+def load_definitions(database):
+    """{name: ViewDefinition} of the views of `database`, dependencies resolved"""
+    views = {}
+    for filename, databases in SQL_FILES.items():
+        if database not in databases:
+            continue
+        path = os.path.join(BASE_DIR, filename)
+        for statement in _statements(path):
+            match = VIEW_PATTERN.match(statement)
+            if match:
+                views[match.group(1)] = ViewDefinition(match.group(1), match.group(2).strip(), filename)
+                continue
+            match = INDEX_PATTERN.match(statement)
+            if match and match.group(3) in views:
+                views[match.group(3)].indexes.append((match.group(2), match.group(4).strip(), bool(match.group(1))))
+    for view in views.values():
+        view.depends = {name for name in re.findall(r'\b(mv_\w+)\b', view.query) if name in views and name != view.name}
+    return views
+
+
+def dependency_order(views):
+    """View names, every view after the views it reads"""
+    ordered = []
+    visiting = set()
+
+    def visit(name):
+        if name in ordered:
+            return
+        if name in visiting:
+            raise ValueError(f"Circular materialized view dependency at {name}")
+        visiting.add(name)
+        for dependency in sorted(views[name].depends):
+            visit(dependency)
+        visiting.discard(name)
+        ordered.append(name)
+
+    for name in sorted(views):
+        visit(name)
+    return ordered
+
+
+def with_dependents(views, names):
+    """`names` plus every view that (indirectly) reads one of them"""
+    selected = set(names)
+    changed = True
+    while changed:
+        changed = False
+        for view in views.values():
+            if view.name not in selected and view.depends & selected:
+                selected.add(view.name)
+                changed = True
+    return selected
+
+
+def connect(database):
+    return psycopg2.connect(database=database, **DB_PARAMS)
+
+
+def existing_views(cursor):
+    """{name: (definition, populated)} of the materialized views in public"""
+    cursor.execute("SELECT matviewname, definition, ispopulated FROM pg_matviews WHERE schemaname = 'public'")
+    return {name: (definition, populated) for name, definition, populated in cursor.fetchall()}
+
+
+def has_unique_key(cursor, view):
+    """True when `view` has a unique index usable by REFRESH ... CONCURRENTLY"""
+    cursor.execute("""
+        SELECT 1 FROM pg_index i
+        WHERE i.indrelid = %s::regclass AND i.indisunique AND i.indpred IS NULL AND i.indexprs IS NULL
+    """, (view,))
+    return cursor.fetchone() is not None
+
+
+def definition_changed(cursor, view, stored_definition):
+    """Compare a view's stored definition with the file, both as normalised by PostgreSQL"""
+    cursor.execute("SAVEPOINT compare_definition")
+    try:
+        cursor.execute(f"CREATE TEMPORARY VIEW managed_definition AS {view.query}")
+        cursor.execute("SELECT pg_get_viewdef('managed_definition'::regclass)")
+        managed = cursor.fetchone()[0]
+    finally:
+        cursor.execute("ROLLBACK TO SAVEPOINT compare_definition")
+    return managed.strip() != stored_definition.strip()
+
+
+def run_setup_files(conn, database):
+    """Run the SETUP_FILES of `database` whose tables are missing (autocommit: they may VACUUM)"""
+    for filename, databases in SETUP_FILES.items():
+        if database not in databases:
+            continue
+        statements = _statements(os.path.join(BASE_DIR, filename))
+        tables = [match.group(1) for match in map(TABLE_PATTERN.match, statements) if match]
+        cursor = conn.cursor()
+        cursor.execute("SELECT count(*) FROM unnest(%s::text[]) t WHERE to_regclass(t) IS NULL", (tables,))
+        missing = cursor.fetchone()[0]
+        conn.commit()
+        if missing:
+            started = time.monotonic()
+            conn.autocommit = True
+            try:
+                for statement in statements:
+                    cursor.execute(statement)
+            finally:
+                conn.autocommit = False
+            print(f"   {filename}: applied ({time.monotonic() - started:.1f}s)")
+        cursor.close()
+
+
+def install(conn):
+    """Create the freshness registry (idempotent)"""
+    cursor = conn.cursor()
+    cursor.execute(REGISTRY_DDL)
+    cursor.close()
+    conn.commit()
+
+
+def record_refresh(cursor, name, seconds, concurrent, incremental=False):
+    cursor.execute("""
+        INSERT INTO app_materialized_view (name, refreshed_at, refresh_seconds, row_estimate, concurrent,
+                                           incremental)
+        SELECT %s, now(), %s, GREATEST(reltuples, 0)::bigint, %s, %s FROM pg_class WHERE oid = %s::regclass
+        ON CONFLICT (name) DO UPDATE SET refreshed_at = EXCLUDED.refreshed_at,
+            refresh_seconds = EXCLUDED.refresh_seconds, row_estimate = EXCLUDED.row_estimate,
+            concurrent = EXCLUDED.concurrent, incremental = EXCLUDED.incremental
+    """, (name, round(seconds, 3), concurrent, incremental, name))
+
+
+def read_freshness(cursor):
+    """
+    {view: {refreshed_at, refresh_seconds, row_estimate, concurrent, incremental}}, empty without the registry
+
+    Views maintained by incremental_aggregates.py are tables (or plain views) under the same names.
+    """
+    try:
+        cursor.execute("""
+            SELECT r.name, r.refreshed_at, r.refresh_seconds, r.row_estimate, r.concurrent, r.incremental
+            FROM app_materialized_view r
+            JOIN pg_class c ON c.relname = r.name AND c.relkind IN ('m', 'r', 'v')
+            JOIN pg_namespace n ON n.oid = c.relnamespace AND n.nspname = 'public'
+            ORDER BY r.name
+        """)
+    except psycopg2.errors.UndefinedTable:
+        cursor.connection.rollback()
+        return {}
+    return {name: {'refreshed_at': refreshed_at, 'refresh_seconds': seconds, 'row_estimate': rows,
+                   'concurrent': concurrent, 'incremental': incremental}
+            for name, refreshed_at, seconds, rows, concurrent, incremental in cursor.fetchall()}
+
+
+def maintained_views(cursor, database):
+    """Names of the views incremental_aggregates.py maintains as tables in `database` (empty when not installed)"""
+    import incremental_aggregates  # imports this module
+    if database != incremental_aggregates.DATABASE:
+        return set()
+    return incremental_aggregates.maintained(cursor)
+
+
+def create_indexes(cursor, view, table=None, suffix=''):
+    for index, columns, unique in view.indexes:
+        cursor.execute(f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {index}{suffix} "
+                       f"ON {table or view.name}({columns})")
+
+
+def rebuild(conn, views, view, existing):
+    """Build `view` under a temporary name, then swap it in (dependents are dropped for re-creation)"""
+    cursor = conn.cursor()
+    temporary = view.name + REBUILD_SUFFIX
+    started = time.monotonic()
+    cursor.execute(f"DROP MATERIALIZED VIEW IF EXISTS {temporary}")
+    cursor.execute(f"CREATE MATERIALIZED VIEW {temporary} AS {view.query}")
+    create_indexes(cursor, view, table=temporary, suffix=REBUILD_SUFFIX)
+    conn.commit()
+    # The swap: readers wait only for the drop and renames, not for the build
+    dependents = with_dependents(views, [view.name]) - {view.name}
+    for dependent in reversed(dependency_order(views)):
+        if dependent in dependents and dependent in existing:
+            cursor.execute(f"DROP MATERIALIZED VIEW IF EXISTS {dependent}")
+            existing.pop(dependent)
+            print(f"   {dependent}: dropped, recreated after {view.name}")
+    cursor.execute(f"DROP MATERIALIZED VIEW IF EXISTS {view.name}")
+    cursor.execute(f"ALTER MATERIALIZED VIEW {temporary} RENAME TO {view.name}")
+    for index, _columns, _unique in view.indexes:
+        cursor.execute(f"ALTER INDEX {index}{REBUILD_SUFFIX} RENAME TO {index}")
+    cursor.execute(f"ANALYZE {view.name}")
+    record_refresh(cursor, view.name, time.monotonic() - started, False)
+    conn.commit()
+    cursor.close()
+
+
+def create(database, rebuild_changed=False):
+    """Create missing views and indexes (rebuild changed ones with rebuild_changed); True on success"""
+    views = load_definitions(database)
+    conn = connect(database)
+    install(conn)
+    ok = True
+    try:
+        run_setup_files(conn, database)
+    except psycopg2.Error as e:
+        conn.rollback()
+        ok = False
+        print(f"   setup failed: {str(e).strip()}")
+    cursor = conn.cursor()
+    existing = existing_views(cursor)
+    maintained = maintained_views(cursor, database)
+    changed_any = False
+    for name in dependency_order(views):
+        view = views[name]
+        if name in maintained:
+            print(f"   {name}: maintained incrementally (incremental_aggregates.py)")
+            continue
+        try:
+            if name not in existing:
+                started = time.monotonic()
+                cursor.execute(f"CREATE MATERIALIZED VIEW {name} AS {view.query}")
+                create_indexes(cursor, view)
+                cursor.execute(f"ANALYZE {name}")
+                record_refresh(cursor, name, time.monotonic() - started, False)
+                conn.commit()
+                existing[name] = (None, True)
+                changed_any = True
+                print(f"   {name}: created ({time.monotonic() - started:.1f}s)")
+                continue
+            if definition_changed(cursor, view, existing[name][0]):
+                if not rebuild_changed:
+                    print(f"   {name}: definition differs from {view.source_file} (run create --rebuild)")
+                    continue
+                rebuild(conn, views, view, existing)
+                changed_any = True
+                print(f"   {name}: rebuilt from {view.source_file}")
+                continue
+            create_indexes(cursor, view)
+            conn.commit()
+            if not view.key_index:
+                print(f"   {name}: no unique index in {view.source_file}, refreshes will block readers")
+        except psycopg2.Error as e:
+            conn.rollback()
+            ok = False
+            print(f"   {name}: failed: {str(e).strip()}")
+    if changed_any:
+        bump(conn, 'aggregates')
+        conn.commit()
+    conn.close()
+    return ok
+
+
+def refresh_view(database, name, work_mem=REFRESH_WORK_MEM):
+    """Refresh one view on its own connection; returns (seconds, concurrent)"""
+    conn = connect(database)
+    conn.autocommit = True
+    try:
+        cursor = conn.cursor()
+        if work_mem:
+            cursor.execute("SET work_mem = %s", (work_mem,))
+        cursor.execute("SELECT ispopulated FROM pg_matviews WHERE schemaname = 'public' AND matviewname = %s",
+                       (name,))
+        populated = cursor.fetchone()[0]
+        # CONCURRENTLY keeps the view readable; it needs a unique index and existing contents
+        concurrent = populated and has_unique_key(cursor, name)
+        started = time.monotonic()
+        cursor.execute(f"REFRESH MATERIALIZED VIEW {'CONCURRENTLY ' if concurrent else ''}{name}")
+        cursor.execute(f"ANALYZE {name}")
+        seconds = time.monotonic() - started
+        record_refresh(cursor, name, seconds, concurrent)
+        cursor.close()
+        return seconds, concurrent
+    finally:
+        conn.close()
+
+
+def refresh(database, names=None, jobs=3, work_mem=REFRESH_WORK_MEM):
+    """
+    Refresh views of `database` in dependency order, independent ones in parallel
+
+    Args:
+        names: Views to refresh (their dependents are refreshed too); default: all existing managed views
+        jobs: Views refreshed at the same time
+
+    Returns {view: error message} of the views that failed or were skipped.
+    """
+    views = load_definitions(database)
+    dependency_order(views)  # rejects cycles
+    conn = connect(database)
+    install(conn)
+    maintained = maintained_views(conn.cursor(), database)
+    present = set(existing_views(conn.cursor())) | maintained
+    unknown = set(names or ()) - set(views)
+    if unknown:
+        conn.close()
+        raise ValueError(f"Not a managed view of {database}: {', '.join(sorted(unknown))}")
+    selected = with_dependents(views, names) if names else set(views)
+    missing = selected - present
+    for name in sorted(missing):
+        print(f"   {name}: does not exist (run create)")
+    failed = {name: 'does not exist' for name in missing}
+    done = set()
+    running = {}
+
+    # Aggregate tables take the captured deltas instead of a recount; views reading them refresh afterwards
+    if selected & maintained:
+        import incremental_aggregates
+        try:
+            started = time.monotonic()
+            rows, mode = incremental_aggregates.apply(conn, database)
+            done |= selected & maintained
+            if mode == 'rebuild':
+                print(f"   incremental aggregates: full rebuild flagged, recounted in {time.monotonic() - started:.1f}s")
+            else:
+                print(f"   incremental aggregates: {rows} delta rows applied in {time.monotonic() - started:.2f}s")
+        except psycopg2.Error as e:
+            for name in selected & maintained:
+                failed[name] = str(e).strip()
+            print(f"   incremental aggregates: failed: {str(e).strip()}")
+    pending = selected & present - maintained
+
+    with ThreadPoolExecutor(max_workers=jobs, thread_name_prefix='refresh') as executor:
+        while pending or running:
+            for name in sorted(pending):
+                blocking = views[name].depends & (selected - done)
+                if blocking & set(failed):
+                    pending.discard(name)
+                    failed[name] = f"skipped, {', '.join(sorted(blocking & set(failed)))} failed"
+                    print(f"   {name}: {failed[name]}")
+                elif not blocking and len(running) < jobs:
+                    pending.discard(name)
+                    running[executor.submit(refresh_view, database, name, work_mem)] = name
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    seconds, concurrent = future.result()
+                    done.add(name)
+                    print(f"   {name}: refreshed{' concurrently' if concurrent else ''} in {seconds:.1f}s")
+                except psycopg2.Error as e:
+                    failed[name] = str(e).strip()
+                    print(f"   {name}: failed: {failed[name]}")
+
+    if done:
+        bump(conn, 'aggregates')
+        conn.commit()
+    conn.close()
+    return failed
+
+
+def status(database):
+    views = load_definitions(database)
+    conn = connect(database)
+    cursor = conn.cursor()
+    existing = existing_views(cursor)
+    freshness = read_freshness(cursor)
+    maintained = maintained_views(cursor, database)
+    if maintained:
+        import incremental_aggregates
+        rows, full_rebuild = incremental_aggregates.pending(cursor)
+        print(f"   incremental aggregates: {rows} pending delta rows{', full rebuild flagged' if full_rebuild else ''}")
+    for name in dependency_order(views):
+        view = views[name]
+        if name in maintained:
+            refreshed = freshness.get(name)
+            when = f"applied {refreshed['refreshed_at']:%Y-%m-%d %H:%M:%S}" if refreshed else 'apply time unknown'
+            print(f"   {name}: maintained incrementally, {when}")
+            continue
+        if name not in existing:
+            print(f"   {name}: missing ({view.source_file})")
+            continue
+        notes = []
+        if definition_changed(cursor, view, existing[name][0]):
+            notes.append('definition changed')
+        if not existing[name][1]:
+            notes.append('not populated')
+        if not has_unique_key(cursor, name):
+            notes.append('no unique index')
+        refreshed = freshness.get(name)
+        when = f"refreshed {refreshed['refreshed_at']:%Y-%m-%d %H:%M:%S}" if refreshed else 'refresh time unknown'
+        depends = f", reads {', '.join(sorted(view.depends))}" if view.depends else ''
+        print(f"   {name}: {', '.join(notes) or 'ok'}, {when}{depends}")
+    for name in sorted(set(existing) - set(views)):
+        print(f"   {name}: not managed")
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['status', 'create', 'refresh'])
+    parser.add_argument('views', nargs='*', help='Views to refresh (default: all)')
+    parser.add_argument('--database', choices=DATABASES, help='Only this database')
+    parser.add_argument('--rebuild', action='store_true', help='create: rebuild views whose definition changed')
+    parser.add_argument('--jobs', type=int, default=3, help='refresh: views refreshed in parallel')
+    args = parser.parse_args()
+
+    ok = True
+    for database in ([args.database] if args.database else DATABASES):
+        print(f"=== {database} ===")
+        try:
+            if args.command == 'status':
+                status(database)
+            elif args.command == 'create':
+                ok = create(database, rebuild_changed=args.rebuild) and ok
+            else:
+                views = [name for name in args.views if name in load_definitions(database)]
+                if args.views and not views:
+                    print("   nothing to refresh")
+                    continue
+                ok = not refresh(database, views or None, jobs=args.jobs) and ok
+        except (psycopg2.Error, ValueError) as e:
+            print(f"{database}: failed: {str(e).strip()}")
+            ok = False
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+Collapse duplicate reference rows in pheno_new and add primary keys
+
+The pheno_new import copied dwd_species and dwd_phase without constraints and
+created station rows per description, so the reference tables contain
+duplicate ids and a physical station (one station_name) can have several
+HIST_/LOC_ ids. Every pheno_new query therefore needed DISTINCT ON (id)
+subqueries or COUNT(DISTINCT o.id). This migration:
+
+    1. keeps one row per id in dwd_species and dwd_phase
+    2. merges dwd_station rows per id and per station name into one canonical
+       station (lowest id), filling empty columns from the merged rows
+    3. remaps dwd_observation.station_id to the canonical ids and records the
+       mapping in dwd_station_alias (alias_id -> station_id)
+    4. adds primary keys on the three tables and indexes on the observation
+       foreign-key columns, then refreshes the trend cube
+
+It runs in one transaction and is repeatable: a second run finds nothing to
+merge. Placeholder names (see UNMERGED_STATION_NAMES) are never merged.
+
+Usage:
+    python3 migrate_dedupe_pheno_new.py [--dry-run]
+"""
+
+import argparse
+import sys
+import unicodedata
+
+import psycopg2
+
+from data_version import bump
+from db_config import DB_PARAMS
+
+DATABASE = 'pheno_new'
+
+REFERENCE_TABLES = ['dwd_station', 'dwd_species', 'dwd_phase']
+
+# Station names that do not identify a physical station
+UNMERGED_STATION_NAMES = ('unknown', 'historical station')
+
+CREATE_ALIAS_TABLE = """
+    CREATE TABLE IF NOT EXISTS dwd_station_alias (
+        alias_id TEXT PRIMARY KEY,
+        station_id TEXT NOT NULL
+    )
+"""
+
+# Same names as create_indexes.sql
+FOREIGN_KEY_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_observation_station_id ON dwd_observation(station_id)",
+    "CREATE INDEX IF NOT EXISTS idx_observation_species_id ON dwd_observation(species_id)",
+    "CREATE INDEX IF NOT EXISTS idx_observation_phase_id ON dwd_observation(phase_id)",
+    "CREATE INDEX IF NOT EXISTS idx_observation_species_phase ON dwd_observation(species_id, phase_id)",
+]
+
+# Materialized views keyed by station_id, refreshed in this order when present
+STATION_VIEWS = ['mv_trend_cube', 'mv_trend_national']
+
+
+def station_name_key(name):
+    """Normalized station name, None for names that must not be merged"""
+    if not name:
+        return None
+    key = unicodedata.normalize('NFC', name).strip().casefold()
+    if not key or key.startswith(UNMERGED_STATION_NAMES):
+        return None
+    return key
+
+
+def canonical_stations(cursor):
+    """
+    Work out the canonical station rows
+
+    Returns (columns, rows, aliases, row_count): one row per canonical id,
+    aliases maps every merged id to its canonical id.
+    """
+    cursor.execute("SELECT * FROM dwd_station WHERE id IS NOT NULL ORDER BY id, ctid")
+    columns = [col[0] for col in cursor.description]
+    all_rows = cursor.fetchall()
+
+    def merge(target, row):
+        return [value if value not in (None, '') else other for value, other in zip(target, row)]
+
+    # 1. one row per id (duplicate rows only fill empty columns)
+    by_id = {}
+    for row in all_rows:
+        by_id[row[0]] = merge(by_id[row[0]], row) if row[0] in by_id else list(row)
+
+    # 2. one id per physical station
+    name_index = columns.index('station_name')
+    canonical = {}
+    aliases = {}
+    for station_id in sorted(by_id):
+        row = by_id[station_id]
+        name_key = station_name_key(row[name_index])
+        key = ('id', station_id) if name_key is None else ('name', name_key)
+        if key in canonical:
+            target_id = canonical[key][0]
+            canonical[key] = merge(canonical[key], row)
+            aliases[station_id] = target_id
+        else:
+            canonical[key] = row
+
+    return columns, list(canonical.values()), aliases, len(all_rows)
+
+
+def has_primary_key(cursor, table):
+    cursor.execute("""
+        SELECT 1 FROM pg_constraint
+        WHERE conrelid = %s::regclass AND contype = 'p'
+    """, (table,))
+    return cursor.fetchone() is not None
+
+
+def is_migrated(cursor):
+    """True once the reference tables have their primary keys (checked by the app at startup)"""
+    return all(has_primary_key(cursor, table) for table in REFERENCE_TABLES)
+
+
+def migrate(dry_run=False):
+    conn = psycopg2.connect(database=DATABASE, **DB_PARAMS)
+    cursor = conn.cursor()
+
+    try:
+        # Species and phases: keep the first row per id
+        for table in ('dwd_species', 'dwd_phase'):
+            cursor.execute(f"SELECT COUNT(*), COUNT(DISTINCT id), COUNT(*) - COUNT(id) FROM {table}")
+            total, distinct, null_ids = cursor.fetchone()
+            print(f"   {table}: {total} rows, {distinct} ids, {total - distinct - null_ids} duplicates, "
+                  f"{null_ids} without id")
+            cursor.execute(f"DELETE FROM {table} WHERE id IS NULL")
+            cursor.execute(f"DELETE FROM {table} a USING {table} b WHERE a.id = b.id AND a.ctid > b.ctid")
+
+        # Stations: merge per id and per physical station
+        columns, rows, aliases, total = canonical_stations(cursor)
+        print(f"   dwd_station: {total} rows -> {len(rows)} stations, {len(aliases)} ids merged")
+        for alias_id, station_id in sorted(aliases.items()):
+            print(f"      {alias_id} -> {station_id}")
+
+        cursor.execute(CREATE_ALIAS_TABLE)
+        for alias_id, station_id in aliases.items():
+            cursor.execute("""
+                INSERT INTO dwd_station_alias (alias_id, station_id) VALUES (%s, %s)
+                ON CONFLICT (alias_id) DO UPDATE SET station_id = EXCLUDED.station_id
+            """, (alias_id, station_id))
+        # Aliases of ids that were merged again in this run
+        cursor.execute("""
+            UPDATE dwd_station_alias a SET station_id = b.station_id
+            FROM dwd_station_alias b
+            WHERE a.station_id = b.alias_id
+        """)
+
+        cursor.execute("""
+            UPDATE dwd_observation o SET station_id = a.station_id
+            FROM dwd_station_alias a
+            WHERE o.station_id = a.alias_id
+        """)
+        print(f"   dwd_observation: {cursor.rowcount} observations remapped to canonical stations")
+
+        cursor.execute("DELETE FROM dwd_station")
+        placeholders = ', '.join(['%s'] * len(columns))
+        for row in rows:
+            cursor.execute(f"INSERT INTO dwd_station ({', '.join(columns)}) VALUES ({placeholders})", row)
+
+        for table in REFERENCE_TABLES:
+            if not has_primary_key(cursor, table):
+                cursor.execute(f"ALTER TABLE {table} ADD PRIMARY KEY (id)")
+                print(f"   {table}: primary key added")
+
+        for statement in FOREIGN_KEY_INDEXES:
+            cursor.execute(statement)
+
+        cursor.execute("""
+            SELECT COUNT(*) FROM dwd_observation o
+            WHERE NOT EXISTS (SELECT 1 FROM dwd_station s WHERE s.id = o.station_id)
+               OR NOT EXISTS (SELECT 1 FROM dwd_species s WHERE s.id = o.species_id)
+               OR NOT EXISTS (SELECT 1 FROM dwd_phase p WHERE p.id = o.phase_id)
+        """)
+        orphans = cursor.fetchone()[0]
+        if orphans:
+            print(f"   warning: {orphans} observations reference missing station/species/phase ids")
+
+        if dry_run:
+            conn.rollback()
+            conn.close()
+            print("   dry run, nothing changed")
+            return
+
+        cursor.execute("SELECT matviewname FROM pg_matviews WHERE schemaname = 'public'")
+        existing_views = {row[0] for row in cursor.fetchall()}
+        for view in STATION_VIEWS:
+            if view in existing_views:
+                cursor.execute(f"REFRESH MATERIALIZED VIEW {view}")
+                print(f"   {view} refreshed")
+
+        bump(conn, 'observations', 'aggregates')
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        conn.close()
+        raise
+
+    conn.autocommit = True
+    for table in REFERENCE_TABLES + ['dwd_observation']:
+        cursor.execute(f"ANALYZE {table}")
+    print("   done")
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dry-run', action='store_true', help='Only report what would change')
+    args = parser.parse_args()
+
+    print(f"=== {DATABASE} ===")
+    try:
+        migrate(dry_run=args.dry_run)
+    except psycopg2.Error as e:
+        print(f"Migration of {DATABASE} failed: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Convert the text columns of dwd_observation to native types
+
+The DWD import stores reference_year, day_of_year and date as text, so every
+query had to CAST them per row and year filters compared strings
+(reference_year >= '1925'), which keeps the btree indexes from being used for
+range scans. This migration converts, in both pheno and pheno_new:
+
+    reference_year  text -> smallint
+    day_of_year     text -> smallint
+    date            text -> date
+
+Views and materialized views that depend on these columns are dropped and
+recreated with their indexes in the same transaction; the column indexes
+themselves are rebuilt by ALTER TABLE. Values that cannot be converted,
+impossible dates such as 2021-02-29 included, become NULL and are reported (use --dry-run to see them without changing anything).
+
+Usage:
+    python3 migrate_typed_columns.py [--dry-run] [--database pheno|pheno_new]
+"""
+
+import argparse
+import sys
+
+import psycopg2
+
+from data_version import bump
+from db_config import DB_PARAMS
+
+DATABASES = ['pheno', 'pheno_new']
+
+# Date conversion that returns NULL for impossible dates (2021-02-29) instead of
+# aborting the ALTER TABLE; session-local, created before the checks
+SAFE_DATE_FUNCTION = r"""
+    CREATE OR REPLACE FUNCTION pg_temp.safe_date(value text) RETURNS date AS $$
+    BEGIN
+        IF value !~ '^\s*\d{4}-\d{2}-\d{2}' THEN
+            RETURN NULL;
+        END IF;
+        RETURN CAST(SUBSTRING(TRIM(value) FROM 1 FOR 10) AS date);
+    EXCEPTION WHEN data_exception THEN
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql IMMUTABLE
+"""
+
+# column -> (target type, SQL test for a convertible value, conversion expression)
+# The tests must not cast before the format is checked: AND does not fix the evaluation order, CASE does
+TYPED_COLUMNS = {
+    'reference_year': (
+        'smallint',
+        r"reference_year ~ '^\s*-?\d{1,4}\s*$'",
+        "CAST(TRIM(reference_year) AS smallint)",
+    ),
+    'day_of_year': (
+        'smallint',
+        r"CASE WHEN day_of_year ~ '^\s*\d{1,3}\s*$' THEN CAST(TRIM(day_of_year) AS integer) BETWEEN 1 AND 366 END",
+        "CAST(TRIM(day_of_year) AS smallint)",
+    ),
+    'date': (
+        'date',
+        "pg_temp.safe_date(date) IS NOT NULL",
+        "pg_temp.safe_date(date)",
+    ),
+}
+
+# Indexes the typed queries rely on (see create_indexes.sql)
+TYPED_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_observation_year ON dwd_observation(reference_year)",
+    "CREATE INDEX IF NOT EXISTS idx_observation_species_phase ON dwd_observation(species_id, phase_id)",
+    "CREATE INDEX IF NOT EXISTS idx_observation_keyset ON dwd_observation((COALESCE(reference_year, -32768)) DESC, day_of_year, id)",
+]
+
+
+def column_types(cursor):
+    """Current data types of the columns to migrate"""
+    cursor.execute("""
+        SELECT column_name, data_type
+        FROM information_schema.columns
+        WHERE table_schema = 'public' AND table_name = 'dwd_observation'
+          AND column_name = ANY(%s)
+    """, (list(TYPED_COLUMNS),))
+    return dict(cursor.fetchall())
+
+
+def dependent_views(cursor, columns):
+    """Views and materialized views that read the given columns, in creation order"""
+    cursor.execute("""
+        WITH RECURSIVE deps AS (
+            SELECT DISTINCT r.ev_class AS oid, 1 AS depth
+            FROM pg_depend d
+            JOIN pg_rewrite r ON d.objid = r.oid
+            JOIN pg_attribute a ON a.attrelid = d.refobjid AND a.attnum = d.refobjsubid
+            WHERE d.refobjid = 'dwd_observation'::regclass
+              AND a.attname = ANY(%s)
+              AND r.ev_class <> 'dwd_observation'::regclass
+            UNION
+            SELECT DISTINCT r.ev_class, deps.depth + 1
+            FROM deps
+            JOIN pg_depend d ON d.refobjid = deps.oid
+            JOIN pg_rewrite r ON d.objid = r.oid
+            WHERE r.ev_class <> deps.oid
+        )
+        SELECT c.relname, c.relkind, pg_get_viewdef(c.oid), MAX(deps.depth)
+        FROM deps
+        JOIN pg_class c ON c.oid = deps.oid
+        GROUP BY c.oid, c.relname, c.relkind
+        ORDER BY MAX(deps.depth), c.relname
+    """, (columns,))
+    views = []
+    for name, kind, definition, _depth in cursor.fetchall():
+        cursor.execute("SELECT indexdef FROM pg_indexes WHERE schemaname = 'public' AND tablename = %s", (name,))
+        indexes = [row[0] for row in cursor.fetchall()]
+        views.append({'name': name, 'materialized': kind == 'm', 'definition': definition, 'indexes': indexes})
+    return views
+
+
+def migrate_database(database, dry_run=False):
+    print(f"\n=== {database} ===")
+    conn = psycopg2.connect(database=database, **DB_PARAMS)
+    cursor = conn.cursor()
+
+    types = column_types(cursor)
+    pending = [col for col, (target, _test, _expr) in TYPED_COLUMNS.items()
+               if col in types and types[col] in ('text', 'character varying', 'character')]
+    for col in TYPED_COLUMNS:
+        if col not in types:
+            print(f"   {col}: column not found, skipped")
+        elif col not in pending:
+            print(f"   {col}: already {types[col]}")
+    if not pending:
+        conn.close()
+        return
+
+    cursor.execute(SAFE_DATE_FUNCTION)
+
+    # Report values that would be lost
+    for col in pending:
+        _target, test, _expr = TYPED_COLUMNS[col]
+        cursor.execute(f"""
+            SELECT COUNT(*) FROM dwd_observation
+            WHERE {col} IS NOT NULL AND TRIM({col}) <> '' AND NOT COALESCE({test}, false)
+        """)
+        invalid = cursor.fetchone()[0]
+        print(f"   {col}: {types[col]} -> {TYPED_COLUMNS[col][0]} ({invalid} unconvertible values become NULL)")
+
+    views = dependent_views(cursor, pending)
+    for view in views:
+        kind = 'materialized view' if view['materialized'] else 'view'
+        print(f"   will recreate {kind} {view['name']} ({len(view['indexes'])} indexes)")
+
+    if dry_run:
+        conn.rollback()
+        conn.close()
+        return
+
+    try:
+        for view in reversed(views):
+            kind = 'MATERIALIZED VIEW' if view['materialized'] else 'VIEW'
+            cursor.execute(f"DROP {kind} IF EXISTS {view['name']}")
+
+        alterations = []
+        for col in pending:
+            target, test, expr = TYPED_COLUMNS[col]
+            alterations.append(f"ALTER COLUMN {col} TYPE {target} USING CASE WHEN {test} THEN {expr} END")
+        print("   converting columns (rewrites the table and its indexes)...")
+        cursor.execute("ALTER TABLE dwd_observation " + ", ".join(alterations))
+
+        for statement in TYPED_INDEXES:
+            cursor.execute(statement)
+
+        for view in views:
+            kind = 'MATERIALIZED VIEW' if view['materialized'] else 'VIEW'
+            cursor.execute(f"CREATE {kind} {view['name']} AS {view['definition']}")
+            for index in view['indexes']:
+                cursor.execute(index)
+
+        bump(conn, 'observations', 'aggregates')
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        conn.close()
+        raise
+
+    conn.autocommit = True
+    cursor.execute("ANALYZE dwd_observation")
+    for view in views:
+        cursor.execute(f"ANALYZE {view['name']}")
+    print("   done")
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dry-run', action='store_true', help='Only report what would change')
+    parser.add_argument('--database', choices=DATABASES, help='Migrate only this database')
+    args = parser.parse_args()
+
+    for database in ([args.database] if args.database else DATABASES):
+        try:
+            migrate_database(database, dry_run=args.dry_run)
+        except psycopg2.Error as e:
+            print(f"Migration of {database} failed: {e}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
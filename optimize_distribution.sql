@@ -1,5 +1,8 @@
 -- 优化 distribution 页面的物化视图
--- 为站点-年份级别的观测数据创建物化视图
+-- 为站点-年份级别的观测数据以及 /api/data-distribution 的统计创建物化视图
+-- 视图定义由 materialized_views.py 统一管理（创建、重建、并发刷新）
+-- 运行 python3 incremental_aggregates.py install 后，这些视图变为同名普通表（mv_coverage_stats 为普通视图），
+-- 由触发器记录的增量维护（此处的查询仍是完整重算的定义）
 
 -- 1. PHENO 数据库的站点-年份统计视图
 CREATE MATERIALIZED VIEW IF NOT EXISTS mv_station_yearly_stats AS
@@ -18,19 +21,62 @@ WHERE s.latitude IS NOT NULL AND s.longitude IS NOT NULL
 GROUP BY s.id, s.station_name, s.latitude, s.longitude, s.state, s.area, o.reference_year
 ORDER BY s.station_name, o.reference_year;
 
--- 为物化视图创建索引
-CREATE INDEX IF NOT EXISTS idx_mv_station_yearly_station ON mv_station_yearly_stats(station_id);
+-- 为物化视图创建索引（唯一索引支持并发刷新，也用于按站点查询）
+CREATE UNIQUE INDEX IF NOT EXISTS idx_mv_station_yearly_stats_key ON mv_station_yearly_stats(station_id, reference_year);
 CREATE INDEX IF NOT EXISTS idx_mv_station_yearly_year ON mv_station_yearly_stats(reference_year);
-CREATE INDEX IF NOT EXISTS idx_mv_station_yearly_composite ON mv_station_yearly_stats(station_id, reference_year);
 
--- 刷新物化视图
-REFRESH MATERIALIZED VIEW mv_station_yearly_stats;
+-- 2. 年份 × 州的观测数量（/api/data-distribution 的时空分布）
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_year_state_distribution AS
+SELECT
+    o.reference_year as year,
+    s.state,
+    COUNT(o.id) as observation_count
+FROM dwd_observation o
+JOIN dwd_station s ON o.station_id = s.id
+GROUP BY o.reference_year, s.state;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_mv_year_state_distribution_key ON mv_year_state_distribution(year, state);
+
+-- 3. 年份 × 月份的观测数量（按观测日期）
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_year_month_distribution AS
+SELECT
+    reference_year as year,
+    EXTRACT(MONTH FROM date)::int as month,
+    COUNT(id) as observation_count
+FROM dwd_observation
+WHERE date IS NOT NULL
+GROUP BY reference_year, EXTRACT(MONTH FROM date)::int;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_mv_year_month_distribution_key ON mv_year_month_distribution(year, month);
+
+-- 4. 数据覆盖范围（单行；常量 id 只用于并发刷新需要的唯一索引）
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_coverage_stats AS
+SELECT
+    1 as id,
+    MIN(reference_year) as min_year,
+    MAX(reference_year) as max_year,
+    COUNT(DISTINCT station_id) as station_count,
+    COUNT(DISTINCT species_id) as species_count,
+    COUNT(DISTINCT phase_id) as phase_count
+FROM dwd_observation;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_mv_coverage_stats_key ON mv_coverage_stats(id);
+
+-- 刷新物化视图（CONCURRENTLY：刷新期间仍可读取旧数据）
+REFRESH MATERIALIZED VIEW CONCURRENTLY mv_station_yearly_stats;
+REFRESH MATERIALIZED VIEW CONCURRENTLY mv_year_state_distribution;
+REFRESH MATERIALIZED VIEW CONCURRENTLY mv_year_month_distribution;
+REFRESH MATERIALIZED VIEW CONCURRENTLY mv_coverage_stats;
+
+-- 通知应用：聚合数据已更新，使相关缓存失效（需要先运行 python3 data_version.py install）
+SELECT bump_data_version('aggregates');
 
 -- 显示物化视图大小
 SELECT
     schemaname,
     matviewname as name,
-    pg_size_pretty(pg_relation_size(schemaname||'.'||matviewname)) as size,
-    (SELECT COUNT(*) FROM mv_station_yearly_stats) as row_count
+    pg_size_pretty(pg_relation_size(schemaname||'.'||matviewname)) as size
 FROM pg_matviews
-WHERE schemaname = 'public' AND matviewname = 'mv_station_yearly_stats';
+WHERE schemaname = 'public'
+  AND matviewname IN ('mv_station_yearly_stats', 'mv_year_state_distribution',
+                      'mv_year_month_distribution', 'mv_coverage_stats');
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Precomputed statistics snapshot for the landing page (/api/overview)
+
+Computing the overview live means COUNT(*) over the 17M-row dwd_observation,
+a MIN/MAX year scan, a "latest year" count and a second connection to
+pheno_new on every page load. Instead the numbers are computed once per data
+change and stored as a single row in pheno:
+
+    app_overview_snapshot (id = 1, stats jsonb, refreshed_at)
+
+so the endpoint is a primary-key read. The snapshot must be refreshed after
+imports (the import scripts do this) or manually:
+
+    python3 overview_snapshot.py
+
+estimate_overview() provides an instant approximation from planner
+statistics for first paint before a snapshot exists.
+"""
+
+import json
+
+import psycopg2
+from psycopg2.extras import Json
+
+from data_version import bump
+from db_config import DB_PARAMS
+
+CREATE_SNAPSHOT_TABLE = """
+    CREATE TABLE IF NOT EXISTS app_overview_snapshot (
+        id SMALLINT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+        stats JSONB NOT NULL,
+        refreshed_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    )
+"""
+
+
+def _year_range(min_year, max_year):
+    return f"{min_year}-{max_year}" if min_year else None
+
+
+def _archive_range(conn_new):
+    """Year range of pheno_new (small database, always exact)"""
+    if conn_new is None:
+        return None
+    try:
+        cursor = conn_new.cursor()
+        cursor.execute("SELECT MIN(reference_year), MAX(reference_year) FROM dwd_observation")
+        archive_min, archive_max = cursor.fetchone()
+        cursor.close()
+        return _year_range(archive_min, archive_max)
+    except psycopg2.Error:
+        conn_new.rollback()
+        return None
+
+
+def compute_overview(conn, conn_new=None):
+    """Exact overview statistics (the expensive queries the snapshot replaces)"""
+    cursor = conn.cursor()
+    stats = {}
+
+    cursor.execute("SELECT COUNT(*) FROM dwd_observation")
+    stats['total_observations'] = cursor.fetchone()[0]
+
+    cursor.execute("SELECT COUNT(*) FROM dwd_station")
+    stats['total_stations'] = cursor.fetchone()[0]
+
+    cursor.execute("SELECT COUNT(*) FROM dwd_species")
+    stats['total_species'] = cursor.fetchone()[0]
+
+    cursor.execute("SELECT COUNT(*) FROM dwd_phase")
+    stats['total_phases'] = cursor.fetchone()[0]
+
+    cursor.execute("SELECT MIN(reference_year), MAX(reference_year) FROM dwd_observation")
+    pheno_min, pheno_max = cursor.fetchone()
+    stats['pheno_basic_range'] = f"{pheno_min}-{pheno_max}"
+    stats['pheno_archive_range'] = _archive_range(conn_new)
+
+    cursor.execute("SELECT COUNT(*) FROM dwd_observation WHERE reference_year = %s", (pheno_max,))
+    stats['latest_year_observations'] = cursor.fetchone()[0]
+
+    cursor.close()
+    return stats
+
+
+def refresh_snapshot(conn, conn_new=None):
+    """Recompute the overview and store it as the snapshot row, returns the stats"""
+    stats = compute_overview(conn, conn_new)
+    cursor = conn.cursor()
+    cursor.execute(CREATE_SNAPSHOT_TABLE)
+    cursor.execute("""
+        INSERT INTO app_overview_snapshot (id, stats, refreshed_at)
+        VALUES (1, %s, now())
+        ON CONFLICT (id) DO UPDATE SET stats = EXCLUDED.stats, refreshed_at = EXCLUDED.refreshed_at
+    """, (Json(stats),))
+    bump(conn, 'aggregates')
+    conn.commit()
+    cursor.close()
+    return stats
+
+
+def read_snapshot(conn):
+    """Return (stats, refreshed_at) of the stored snapshot, or None if there is none"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT stats, refreshed_at FROM app_overview_snapshot WHERE id = 1")
+        row = cursor.fetchone()
+    except psycopg2.errors.UndefinedTable:
+        conn.rollback()
+        return None
+    finally:
+        cursor.close()
+    return (row[0], row[1]) if row else None
+
+
+def estimate_overview(conn, conn_new=None):
+    """Approximate overview from planner statistics (pg_class / pg_stats), no table scans
+
+    Accuracy depends on how recently the tables were analyzed.
+    """
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT relname, GREATEST(reltuples, 0)::bigint
+        FROM pg_class
+        WHERE relname IN ('dwd_observation', 'dwd_station', 'dwd_species', 'dwd_phase')
+          AND relkind = 'r'
+    """)
+    counts = dict(cursor.fetchall())
+
+    # MIN/MAX are answered from idx_observation_year without scanning the table
+    cursor.execute("SELECT MIN(reference_year), MAX(reference_year) FROM dwd_observation")
+    pheno_min, pheno_max = cursor.fetchone()
+
+    # Share of the latest year: most-common-values list if present, else 1/n_distinct
+    cursor.execute("""
+        SELECT most_common_vals::text, most_common_freqs, n_distinct
+        FROM pg_stats
+        WHERE tablename = 'dwd_observation' AND attname = 'reference_year'
+    """)
+    row = cursor.fetchone()
+    cursor.close()
+
+    total = counts.get('dwd_observation', 0)
+    latest = None
+    if row:
+        values, freqs, n_distinct = row
+        if values and freqs:
+            value_list = [v.strip('"') for v in values.strip('{}').split(',')]
+            if str(pheno_max) in value_list:
+                latest = round(total * freqs[value_list.index(str(pheno_max))])
+        if latest is None and n_distinct:
+            distinct = n_distinct if n_distinct > 0 else -n_distinct * total
+            latest = round(total / distinct) if distinct else None
+
+    return {
+        'total_observations': total,
+        'total_stations': counts.get('dwd_station', 0),
+        'total_species': counts.get('dwd_species', 0),
+        'total_phases': counts.get('dwd_phase', 0),
+        'pheno_basic_range': f"{pheno_min}-{pheno_max}",
+        'pheno_archive_range': _archive_range(conn_new),
+        'latest_year_observations': latest,
+    }
+
+
+def main():
+    conn = psycopg2.connect(database='pheno', **DB_PARAMS)
+    try:
+        conn_new = psycopg2.connect(database='pheno_new', **DB_PARAMS)
+    except psycopg2.Error as e:
+        print(f"pheno_new not available, archive range left empty: {e}")
+        conn_new = None
+
+    stats = refresh_snapshot(conn, conn_new)
+    print("Overview snapshot refreshed:")
+    print(json.dumps(stats, indent=2, ensure_ascii=False))
+
+    conn.close()
+    if conn_new:
+        conn_new.close()
+
+
+if __name__ == "__main__":
+    main()
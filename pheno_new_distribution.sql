@@ -0,0 +1,48 @@
+-- pheno_new 的 distribution 统计（只在 pheno_new 数据库执行）
+-- 历史站点只有地名，通过 city_state_mapping 映射到州；没有映射的站点以地名作为州
+-- 映射表内容来自 static/city_to_state_mapping.json，由 city_state_mapping.py 同步（导入时自动同步）：
+--   python3 city_state_mapping.py
+-- 月份分布需要日历维度表：先执行 create_calendar.sql
+-- 视图定义由 materialized_views.py 统一管理（创建、重建、并发刷新）
+
+-- 地名 -> 州 映射表（city 同时保存 NFC 和 NFD 两种形式）
+CREATE TABLE IF NOT EXISTS city_state_mapping (
+    city TEXT PRIMARY KEY,
+    state TEXT NOT NULL
+);
+
+-- 1. 年份 × 州的观测数量（与 pheno 的 mv_year_state_distribution 结构相同）
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_year_state_distribution AS
+SELECT
+    o.reference_year as year,
+    COALESCE(m.state, s.station_name) as state,
+    COUNT(o.id) as observation_count
+FROM dwd_observation o
+JOIN dwd_station s ON o.station_id = s.id
+LEFT JOIN city_state_mapping m ON m.city = s.station_name
+WHERE s.station_name IS NOT NULL
+  AND s.station_name != ''
+  AND s.area_group = 'Historical'
+  AND NOT s.station_name LIKE 'Historical Station%'
+GROUP BY o.reference_year, COALESCE(m.state, s.station_name);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_mv_year_state_distribution_key ON mv_year_state_distribution(year, state);
+
+-- 2. 年份 × 月份的观测数量（按年积日查日历维度，闰年按实际日期归月）
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_year_month_distribution AS
+SELECT
+    o.reference_year as year,
+    c.month,
+    COUNT(o.id) as observation_count
+FROM dwd_observation o
+JOIN dim_calendar c ON c.year = o.reference_year AND c.day_of_year = o.day_of_year
+GROUP BY o.reference_year, c.month;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_mv_year_month_distribution_key ON mv_year_month_distribution(year, month);
+
+-- 刷新物化视图（CONCURRENTLY：刷新期间仍可读取旧数据）
+REFRESH MATERIALIZED VIEW CONCURRENTLY mv_year_state_distribution;
+REFRESH MATERIALIZED VIEW CONCURRENTLY mv_year_month_distribution;
+
+-- 通知应用：聚合数据已更新，使相关缓存失效（需要先运行 python3 data_version.py install）
+SELECT bump_data_version('aggregates');
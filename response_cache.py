@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+"""
+Response cache for the read-only JSON APIs
+
+Flask-Caching's @cache.cached keys on the path only, so
+/api/trends?species_id=1 and ?species_id=2 would share an entry, and the
+default SimpleCache lives in one process, so every gunicorn worker computed
+everything again. This module caches complete responses in the app's
+Flask-Caching backend (configure a shared one: RedisCache, or FileSystemCache
+on a local directory) under keys built from normalised request parameters:
+
+- parameters are sorted by name, the jQuery cache buster `_` is ignored
+- declared types are coerced (year_start=01990 and year_start=1990 share a key)
+- values equal to the declared default are dropped (data_source=pheno)
+- list parameters (?x=2,1&x=1) are split, deduplicated and sorted
+
+Each endpoint declares its own TTL, the maximum response size worth caching
+and the data-version namespaces it depends on (see data_version.py); the
+current versions are part of the key, so a bumped namespace invalidates its
+entries immediately on every worker. Only complete 200 responses are stored;
+responses where a data source failed (X-Data-Source-Errors) are not.
+
+The same versioned key makes a strong validator: endpoints with data-version
+namespaces send an ETag (hash of the key) and a Last-Modified header (latest
+bump of those namespaces) together with Cache-Control: no-cache. A matching
+If-None-Match (or, without one, an If-Modified-Since not older than the last
+bump) is answered with 304 before the cache or the view is touched, so
+revalidation costs neither a database query nor serialisation. Validators are
+derived from the data versions while those of all databases are known;
+otherwise, and for endpoints without namespaces, the ETag is a hash of the
+body (saves the transfer only).
+
+With a compression.Compressor, responses are sent in the negotiated
+Content-Encoding and (store_compressed=True) the compressed bytes are cached
+under the entry's key plus the encoding, so a hit is served without
+compressing again.
+
+Stale-while-revalidate: entries are kept `stale` seconds past their TTL.
+A request for an expired entry, or for an entry whose data version was just
+bumped (the previous version's response is found through a pointer stored
+under the unversioned key), is answered from that entry with X-Cache: STALE
+while one background thread recomputes it. A lock entry in the shared
+backend makes sure only one worker recomputes a given key. So only a key that
+was never computed takes the cold path; cache_warmup.py covers those at
+startup.
+
+Usage:
+    response_cache = ResponseCache(cache, versions=data_versions, compressor=compressor)
+
+    @app.route('/api/trends')
+    @response_cache.cached(timeout=600, types={'year_start': int}, lists=('species_id',))
+    def api_trends(): ...
+"""
+
+import functools
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+from flask import Response, current_app, g, make_response, request
+
+# Defaults shared by all endpoints
+DEFAULT_PARAMS = {'data_source': 'pheno'}
+
+# Query parameters that never change the response
+IGNORED_PARAMS = {'_'}
+
+# Response headers stored with the body
+CACHED_HEADERS = ('Content-Type', 'X-Next-Cursor')
+
+KEY_PREFIX = 'resp:'
+
+# Seconds a worker holds the recompute lock of a key / waits before retrying a failed recompute
+REFRESH_LOCK_TIMEOUT = 300
+REFRESH_RETRY_INTERVAL = 30
+
+
+def _coerce(value, type_):
+    try:
+        return str(type_(value))
+    except (TypeError, ValueError):
+        return value
+
+
+def normalized_params(args, defaults=None, types=None, lists=()):
+    """Sorted (name, value) pairs that identify a request"""
+    defaults = {**DEFAULT_PARAMS, **(defaults or {})}
+    types = types or {}
+    params = []
+    for name in sorted(set(args.keys()) - IGNORED_PARAMS):
+        values = args.getlist(name)
+        if name in lists:
+            values = sorted({part.strip() for value in values for part in value.split(',') if part.strip()})
+            if values:
+                params.append((name, ','.join(values)))
+            continue
+        for value in values:
+            if name in types:
+                value = _coerce(value, types[name])
+            if value == '' or (name in defaults and value == str(defaults[name])):
+                continue
+            params.append((name, value))
+    return params
+
+
+def cache_key(path, params):
+    return KEY_PREFIX + path + ('?' + urlencode(params) if params else '')
+
+
+def entity_tag(key):
+    """Strong ETag value of a versioned cache key"""
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:32]
+
+
+class ResponseCache:
+    """Caches complete responses of GET endpoints in a Flask-Caching backend"""
+
+    def __init__(self, cache, versions=None, compressor=None, store_compressed=True, stale=0,
+                 refresh_workers=2):
+        """
+        Args:
+            cache: Flask-Caching Cache instance
+            versions: Optional data_version.DataVersionListener providing key(),
+                last_modified() and ready() for the namespaces endpoints depend on
+            compressor: Optional compression.Compressor for Content-Encoding negotiation
+            store_compressed: Cache compressed variants next to the identity entry
+            stale: Default seconds an expired or outdated entry is still served while
+                it is recomputed in the background (0: recompute in the request)
+            refresh_workers: Background threads recomputing stale entries
+        """
+        self.cache = cache
+        self.versions = versions
+        self.compressor = compressor
+        self.store_compressed = store_compressed
+        self.stale = stale
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._refreshing = set()
+        self._executor = ThreadPoolExecutor(max_workers=refresh_workers, thread_name_prefix='cache-refresh')
+
+    def _count(self, endpoint, outcome):
+        with self._lock:
+            counters = self._stats.setdefault(endpoint, {'hits': 0, 'misses': 0, 'stored': 0, 'skipped': 0,
+                                                         'not_modified': 0, 'compressed': 0, 'stale': 0,
+                                                         'refreshed': 0})
+            counters[outcome] += 1
+
+    def _get(self, key):
+        try:
+            return self.cache.get(key)
+        except Exception as e:
+            print(f"Response cache read failed: {e}")
+            return None
+
+    def _set(self, key, value, timeout):
+        try:
+            self.cache.set(key, value, timeout=timeout)
+            return True
+        except Exception as e:
+            print(f"Response cache write failed: {e}")
+            return False
+
+    def _delete(self, *keys):
+        try:
+            self.cache.delete_many(*keys)
+        except Exception as e:
+            print(f"Response cache delete failed: {e}")
+
+    def _acquire(self, lock_key):
+        """Take the recompute lock of a key in the shared backend"""
+        try:
+            return self.cache.add(lock_key, os.getpid(), timeout=REFRESH_LOCK_TIMEOUT)
+        except Exception as e:
+            print(f"Response cache lock failed: {e}")
+            return False
+
+    def _validators(self, key, depends):
+        """(etag, last_modified) of a versioned key, (None, None) when versions are unknown"""
+        if not depends or not self.versions or not self.versions.ready():
+            return None, None
+        last_modified = self.versions.last_modified(depends)
+        # HTTP dates have whole seconds
+        return entity_tag(key), last_modified.replace(microsecond=0) if last_modified else None
+
+    @staticmethod
+    def _not_modified(etag, last_modified, encoding):
+        if request.if_none_match:
+            # The identity variant (small bodies) or the one in the negotiated encoding
+            return (request.if_none_match.contains(etag)
+                    or (encoding is not None and request.if_none_match.contains(f"{etag}-{encoding}")))
+        since = request.if_modified_since
+        return since is not None and last_modified is not None and since >= last_modified
+
+    @staticmethod
+    def _set_validators(response, etag, last_modified):
+        response.set_etag(etag)
+        if last_modified is not None:
+            response.last_modified = last_modified
+        # Cache, but revalidate every time: a bump can happen at any moment
+        response.headers['Cache-Control'] = 'no-cache'
+
+    def _compress(self, response, key, encoding, timeout, store):
+        """Send the `encoding` variant of a complete response, reusing cached compressed bytes"""
+        compressor = self.compressor
+        response.vary.add('Accept-Encoding')
+        if encoding is None or not compressor.eligible(response):
+            return
+        body = response.get_data()
+        if len(body) < compressor.min_size:
+            return
+        variant_key = f"{key}~{encoding}"
+        data = self._get(variant_key) if store else None
+        if data is None:
+            data = compressor.compress(body, encoding)
+            self._count(request.endpoint, 'compressed')
+            if store:
+                self._set(variant_key, data, timeout)
+        compressor.apply(response, encoding, data)
+
+    def _finish(self, response, key, etag, last_modified, encoding, timeout, store):
+        """Validators, compression and (without a versioned ETag) the conditional check"""
+        if etag:
+            self._set_validators(response, etag, last_modified)
+        if self.compressor:
+            self._compress(response, key, encoding, timeout, store and self.store_compressed)
+        if etag:
+            return response
+        # No data version to derive a validator from: hash the body
+        response.add_etag()
+        response = response.make_conditional(request)
+        if response.status_code == 304:
+            self._count(request.endpoint, 'not_modified')
+        return response
+
+    def _revalidate(self, key, endpoint, headers, recompute):
+        """Recompute a stale entry in the background, once per key over all workers"""
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        lock_key = key + '!refresh'
+        if not self._acquire(lock_key):
+            with self._lock:
+                self._refreshing.discard(key)
+            return
+        app = current_app._get_current_object()
+        path, query_string = request.path, request.query_string
+        self._executor.submit(self._refresh, app, key, lock_key, endpoint, path, query_string, headers, recompute)
+
+    def _refresh(self, app, key, lock_key, endpoint, path, query_string, headers, recompute):
+        stored = False
+        try:
+            # The view runs in a request context like the one of the request that found the entry stale
+            with app.test_request_context(path, query_string=query_string, headers=headers):
+                stored = recompute()
+        except Exception as e:
+            print(f"Response cache refresh failed ({path}): {e}")
+        finally:
+            if stored:
+                self._count(endpoint, 'refreshed')
+                self._delete(lock_key)
+            else:
+                # Keep serving the stale entry; retry after a pause instead of on every request
+                self._set(lock_key, os.getpid(), REFRESH_RETRY_INTERVAL)
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def cached(self, timeout, max_bytes=2 * 1024 * 1024, defaults=None, types=None, lists=(), depends=(),
+               unless=None, variant=None, vary=(), stale=None):
+        """
+        Decorator caching a view's response
+
+        Args:
+            timeout: TTL in seconds
+            max_bytes: Larger responses are not stored
+            defaults: Parameter defaults of this endpoint (dropped from the key)
+            types: Parameter types used to normalise values, e.g. {'year_start': int}
+            lists: Parameters holding comma-separated / repeated id lists
+            depends: Data-version namespaces the response is derived from
+            unless: Callable returning True when the current request must not be cached
+            variant: Callable returning the negotiated representation (None for the default),
+                e.g. binary_formats.binary_variant; part of the key
+            vary: Request headers the variant is derived from (sent as Vary)
+            stale: Seconds an expired or outdated entry is served while it is recomputed
+                (default: the cache's `stale`)
+        """
+        def decorator(view):
+            def request_key():
+                """(key, key without data versions) of the current request"""
+                key = cache_key(request.path, normalized_params(request.args, defaults, types, lists))
+                representation = variant() if variant else None
+                if representation:
+                    key += '|' + representation
+                base_key = key
+                if depends and self.versions:
+                    key += '#' + self.versions.key(depends)
+                return key, base_key
+
+            def store(key, base_key, response, keep):
+                """Store a complete response; True when it was stored"""
+                if response.status_code != 200 or response.is_streamed or g.get('source_errors'):
+                    return False
+                body = response.get_data()
+                if len(body) > max_bytes:
+                    self._count(request.endpoint, 'skipped')
+                    return False
+                headers = {name: response.headers[name] for name in CACHED_HEADERS if name in response.headers}
+                if not self._set(key, (body, response.status_code, headers, time.time() + timeout), keep):
+                    return False
+                if key != base_key and keep > timeout:
+                    # Lets the next data version find this response while it is being computed
+                    self._set(base_key + '#latest', key, keep)
+                self._count(request.endpoint, 'stored')
+                return True
+
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                if request.method != 'GET' or (unless and unless()):
+                    return view(*args, **kwargs)
+
+                key, base_key = request_key()
+                stale_seconds = self.stale if stale is None else stale
+                keep = timeout + stale_seconds
+                etag, last_modified = self._validators(key, depends)
+                encoding = self.compressor.negotiate() if self.compressor else None
+                if etag and self._not_modified(etag, last_modified, encoding):
+                    return self._not_modified_response(etag, last_modified, vary)
+
+                entry_key = key
+                entry = self._get(key)
+                if entry is None and stale_seconds and key != base_key:
+                    # Data version bumped: the previous version's response, if still there
+                    entry_key = self._get(base_key + '#latest')
+                    entry = self._get(entry_key) if entry_key else None
+                    if entry is not None and etag:
+                        etag, last_modified = entity_tag(entry_key), None
+                        if self._not_modified(etag, last_modified, encoding):
+                            return self._not_modified_response(etag, last_modified, vary)
+                if entry is not None:
+                    # Entries written before stale-while-revalidate have no freshness stamp
+                    body, status, headers, fresh_until = entry if len(entry) == 4 else (*entry, 0)
+                    if not stale_seconds and time.time() >= fresh_until:
+                        entry = None
+                if entry is not None:
+                    response = Response(body, status=status, headers=headers)
+                    response.vary.update(vary)
+                    if entry_key == key and time.time() < fresh_until:
+                        self._count(request.endpoint, 'hits')
+                        response.headers['X-Cache'] = 'HIT'
+                    else:
+                        self._count(request.endpoint, 'stale')
+                        response.headers['X-Cache'] = 'STALE'
+                        refresh_headers = {name: request.headers[name] for name in vary if name in request.headers}
+
+                        def recompute():
+                            new_key, new_base_key = request_key()
+                            stored = store(new_key, new_base_key, make_response(view(*args, **kwargs)), keep)
+                            if stored and self.compressor:
+                                # Compressed variants of the replaced body
+                                self._delete(*(f"{new_key}~{e}" for e in self.compressor.encodings))
+                            return stored
+
+                        self._revalidate(key, request.endpoint, refresh_headers, recompute)
+                    return self._finish(response, entry_key, etag, last_modified, encoding, keep, store=True)
+
+                self._count(request.endpoint, 'misses')
+                response = make_response(view(*args, **kwargs))
+                response.headers['X-Cache'] = 'MISS'
+                response.vary.update(vary)
+                if response.status_code != 200 or response.is_streamed or g.get('source_errors'):
+                    return response
+                stored = store(key, base_key, response, keep)
+                return self._finish(response, key, etag, last_modified, encoding, keep, store=stored)
+            return wrapper
+        return decorator
+
+    def _not_modified_response(self, etag, last_modified, vary):
+        self._count(request.endpoint, 'not_modified')
+        response = Response(status=304)
+        self._set_validators(response, etag, last_modified)
+        if self.compressor:
+            response.vary.add('Accept-Encoding')
+        response.vary.update(vary)
+        return response
+
+    def clear(self):
+        """Remove all cached responses (and everything else in the backend)"""
+        self.cache.clear()
+
+    def stats(self):
+        """Per-endpoint hit/miss counters of this worker process"""
+        with self._lock:
+            return {endpoint: dict(counters) for endpoint, counters in self._stats.items()}
@@ -0,0 +1,81 @@
+"""
+Keyset pagination of /api/observations with NULL sort keys
+
+keyset_condition() is run against SQLite, which shares the SQL it produces;
+each source is paged with it and the pages are merged as the endpoint does.
+
+Usage:
+    python -m pytest test_observation_keyset.py
+"""
+
+import itertools
+import sqlite3
+
+from app import KEYSET_YEAR, keyset_condition, merge_observation_streams
+
+YEARS = [2001, 2000, 1999, None]
+DAYS = [1, 120, None]
+
+
+def make_source(source_index):
+    """In-memory dwd_observation with every year/day combination, NULLs included"""
+    conn = sqlite3.connect(':memory:')
+    conn.execute("CREATE TABLE dwd_observation (id INTEGER PRIMARY KEY, reference_year INTEGER, day_of_year INTEGER)")
+    rows = [(source_index * 100 + n, year, day)
+            for n, (year, day, _copy) in enumerate(itertools.product(YEARS, DAYS, range(2)))]
+    conn.executemany("INSERT INTO dwd_observation VALUES (?, ?, ?)", rows)
+    return conn
+
+
+def fetch_page(conn, source_index, after, limit):
+    where, params = "", []
+    if after:
+        condition, params = keyset_condition(after, source_index)
+        where = "WHERE " + condition
+    cursor = conn.execute(f"""
+        SELECT o.id, o.reference_year, o.day_of_year FROM dwd_observation o
+        {where}
+        ORDER BY {KEYSET_YEAR} DESC, o.day_of_year IS NULL, o.day_of_year, o.id
+        LIMIT ?
+    """.replace('%s', '?'), params + [limit])
+    return [dict(zip(('id', 'reference_year', 'day_of_year'), row)) for row in cursor.fetchall()]
+
+
+def expected_order(sources):
+    rows = []
+    for source_index, conn in enumerate(sources):
+        for row_id, year, day in conn.execute("SELECT id, reference_year, day_of_year FROM dwd_observation"):
+            rows.append((source_index, {'id': row_id, 'reference_year': year, 'day_of_year': day}))
+    # reference_year DESC NULLS LAST, day_of_year NULLS LAST, source, id
+    return sorted(rows, key=lambda item: (item[1]['reference_year'] is None, -(item[1]['reference_year'] or 0),
+                                          item[1]['day_of_year'] is None, item[1]['day_of_year'] or 0,
+                                          item[0], item[1]['id']))
+
+
+def test_merge_orders_null_keys_last():
+    sources = [make_source(0), make_source(1)]
+    streams = [(source_index, fetch_page(conn, source_index, None, 1000)) for source_index, conn in enumerate(sources)]
+    assert list(merge_observation_streams(streams)) == expected_order(sources)
+
+
+def test_keyset_pages_cover_null_keys():
+    sources = [make_source(0), make_source(1)]
+    for limit in (1, 5, 7):
+        seen, after = [], None
+        while True:
+            streams = [(source_index, fetch_page(conn, source_index, after, limit))
+                       for source_index, conn in enumerate(sources)]
+            page = list(itertools.islice(merge_observation_streams(streams), limit))
+            seen.extend(page)
+            if len(page) < limit:
+                break
+            source_index, row = page[-1]
+            after = [row['reference_year'], row['day_of_year'], source_index, row['id']]
+        assert seen == expected_order(sources)
+
+
+def test_null_year_cursor_stays_in_null_rows():
+    conn = make_source(0)
+    rows = fetch_page(conn, 0, [None, 1, 0, 0], 1000)
+    assert rows and all(row['reference_year'] is None for row in rows)
+    assert [row['day_of_year'] for row in rows] == [1, 1, 120, 120, None, None]